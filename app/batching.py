@@ -0,0 +1,126 @@
+# app/batching.py
+
+import threading
+import time
+import numpy as np
+
+
+class MicroBatcher:
+    """Queues feature rows and flushes them to the model as a single 2-D batch.
+
+    A batch is flushed when it holds `max_batch_size` rows or when the oldest
+    queued row has waited `max_latency_ms`, whichever happens first.
+    Predictions are handed to `on_predictions(contexts, predictions)` in the
+    same order the rows were submitted. A flush takes the pending rows under
+    the submit lock but predicts and dispatches after releasing it, so
+    submitters fill the other row buffer meanwhile; flushes themselves run
+    one at a time.
+    """
+
+    def __init__(self, predict_fn, on_predictions, n_features, max_batch_size=64, max_latency_ms=5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        self.predict_fn = predict_fn
+        self.on_predictions = on_predictions
+        self.max_batch_size = max_batch_size
+        self.max_latency_ms = max_latency_ms
+
+        # Two preallocated row buffers: one is filled while the other is being predicted
+        self._rows = np.empty((max_batch_size, n_features), dtype=np.float64)
+        self._spare_rows = np.empty_like(self._rows)
+        self._contexts = []
+        self._oldest_ts = None
+        self._lock = threading.Lock() # Guards the pending batch
+        self._flush_lock = threading.Lock() # Serializes flushes, keeping batches and callbacks in order
+
+        self._stop_event = threading.Event()
+        self._flusher = None
+
+        # Tuning statistics
+        self._started_ts = time.monotonic()
+        self.batches_flushed = 0
+        self.rows_predicted = 0
+        self.predict_seconds = 0.0
+
+    def submit(self, features, context):
+        """Queues one feature row. Flushes immediately if the batch is full."""
+        while True:
+            with self._lock:
+                n = len(self._contexts)
+                if n < self.max_batch_size:
+                    self._rows[n] = features
+                    self._contexts.append(context)
+                    if n == 0:
+                        self._oldest_ts = time.monotonic()
+                    break
+            self.flush() # Full, and the submitter that filled it has not taken it yet
+        if n + 1 >= self.max_batch_size:
+            self.flush()
+
+    def flush_if_due(self):
+        """Flushes the pending batch if its oldest row exceeded the latency budget."""
+        with self._lock:
+            due = self._contexts and (time.monotonic() - self._oldest_ts) * 1000.0 >= self.max_latency_ms
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Flushes whatever is pending, regardless of size or age."""
+        with self._flush_lock:
+            with self._lock:
+                n = len(self._contexts)
+                if n == 0:
+                    return
+                rows, contexts = self._rows[:n], self._contexts
+                # The spare buffer is free: the flush that last used it finished before this one got the flush lock
+                self._rows, self._spare_rows = self._spare_rows, self._rows
+                self._contexts = []
+                self._oldest_ts = None
+
+            start = time.perf_counter()
+            predictions = self.predict_fn(rows)
+            self.predict_seconds += time.perf_counter() - start
+            self.batches_flushed += 1
+            self.rows_predicted += n
+
+            self.on_predictions(contexts, predictions)
+
+    def pending(self):
+        return len(self._contexts)
+
+    def start(self):
+        """Starts a daemon thread that enforces the latency budget when traffic is sparse."""
+        if self._flusher is not None:
+            return
+        self._stop_event.clear()
+        self._flusher = threading.Thread(target=self._run_flusher, name="batch-flusher", daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        """Stops the flusher thread and drains the pending batch."""
+        if self._flusher is not None:
+            self._stop_event.set()
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def _run_flusher(self):
+        interval = max(self.max_latency_ms / 2000.0, 0.0005)
+        while not self._stop_event.wait(interval):
+            try:
+                self.flush_if_due()
+            except Exception as e:
+                print(f"Batcher: Error flushing batch: {e}")
+
+    def stats(self):
+        """Returns batch size, latency budget and achieved throughput."""
+        elapsed = time.monotonic() - self._started_ts
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_latency_ms": self.max_latency_ms,
+            "batches_flushed": self.batches_flushed,
+            "rows_predicted": self.rows_predicted,
+            "avg_batch_size": self.rows_predicted / self.batches_flushed if self.batches_flushed else 0.0,
+            "rows_per_second": self.rows_predicted / elapsed if elapsed > 0 else 0.0,
+            "predict_rows_per_second": self.rows_predicted / self.predict_seconds if self.predict_seconds > 0 else 0.0,
+        }
@@ -0,0 +1,166 @@
+# app/device_state.py
+
+import time
+import numpy as np
+
+
+class DeviceStateStore:
+    """Compact per-device reading history and rolling error statistics.
+
+    All state lives in preallocated 2-D NumPy arrays with one row ("slot")
+    per device, so memory is fixed at construction time by `max_devices`.
+    Devices idle for longer than `idle_timeout_s` are evicted, and when every
+    slot is taken the least recently seen device makes room for a new one.
+    `on_evict(device_id)` is called for every evicted device, so state kept
+    elsewhere per device can be dropped with it.
+    """
+
+    def __init__(self, history_length, error_window, max_devices=10000, idle_timeout_s=600.0, n_channels=1,
+                 on_evict=None):
+        self.history_length = history_length
+        self.n_channels = n_channels
+        self.error_window = error_window
+        self.max_devices = max_devices
+        self.idle_timeout_s = idle_timeout_s
+        self.on_evict = on_evict
+
+        # Reading history per device, oldest reading first
+        self.history = np.zeros((max_devices, history_length, n_channels), dtype=np.float64)
+        self.history_count = np.zeros(max_devices, dtype=np.int32)
+
+        # Rolling squared-error ring buffers with running sums
+        self.errors_sq = np.zeros((max_devices, error_window), dtype=np.float64)
+        self.err_head = np.zeros(max_devices, dtype=np.int32)
+        self.err_count = np.zeros(max_devices, dtype=np.int32)
+        self.err_since_resum = np.zeros(max_devices, dtype=np.int32)
+        self.sum_sq = np.zeros(max_devices, dtype=np.float64)
+
+        self.last_seen = np.zeros(max_devices, dtype=np.float64)
+        self._slots = {} # device_id -> slot
+        self._device_ids = [None] * max_devices
+        self._free = list(range(max_devices - 1, -1, -1))
+        self._next_sweep = 0.0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, device_id):
+        return device_id in self._slots
+
+    def _acquire_slot(self, device_id):
+        if not self._free:
+            # Full: evict the least recently seen device
+            occupied = np.array(list(self._slots.values()), dtype=np.int64)
+            self._evict(int(occupied[np.argmin(self.last_seen[occupied])]))
+        slot = self._free.pop()
+        self.history_count[slot] = 0
+        self._reset_errors(slot)
+        self._slots[device_id] = slot
+        self._device_ids[slot] = device_id
+        return slot
+
+    def _evict(self, slot):
+        device_id = self._device_ids[slot]
+        del self._slots[device_id]
+        self._device_ids[slot] = None
+        self._free.append(slot)
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(device_id)
+
+    def _reset_errors(self, slot):
+        self.err_head[slot] = 0
+        self.err_count[slot] = 0
+        self.err_since_resum[slot] = 0
+        self.sum_sq[slot] = 0.0
+
+    def evict_idle(self, now=None):
+        """Frees the slots of devices not seen within the idle timeout."""
+        now = time.monotonic() if now is None else now
+        cutoff = now - self.idle_timeout_s
+        for device_id, slot in list(self._slots.items()):
+            if self.last_seen[slot] < cutoff:
+                self._evict(slot)
+
+    def push_reading(self, device_id, values, now=None):
+        """Appends a reading (one value per channel) to the device's history.
+
+        Returns a copy of the history *before* this reading, shaped
+        (history_length, n_channels) oldest first, once the device has enough
+        past readings; those are the inputs for predicting this reading.
+        Otherwise returns None.
+        """
+        now = time.monotonic() if now is None else now
+        if now >= self._next_sweep:
+            self._next_sweep = now + self.idle_timeout_s / 4
+            self.evict_idle(now)
+
+        slot = self._slots.get(device_id)
+        if slot is None:
+            slot = self._acquire_slot(device_id)
+        self.last_seen[slot] = now
+
+        history = self.history[slot]
+        window = history.copy() if self.history_count[slot] == self.history_length else None
+        history[:-1] = history[1:]
+        history[-1] = values
+        if self.history_count[slot] < self.history_length:
+            self.history_count[slot] += 1
+        return window
+
+    def record_error(self, device_id, actual, prediction):
+        """Adds one prediction error for the device and returns its rolling RMSE.
+
+        Returns None if the device has been evicted or has fewer than 2 errors.
+        """
+        slot = self._slots.get(device_id)
+        if slot is None:
+            return None
+        error = float(actual) - float(prediction)
+        head = self.err_head[slot]
+        if self.err_count[slot] == self.error_window:
+            self.sum_sq[slot] -= self.errors_sq[slot, head]
+        else:
+            self.err_count[slot] += 1
+        self.errors_sq[slot, head] = error * error
+        self.sum_sq[slot] += error * error
+        self.err_head[slot] = (head + 1) % self.error_window
+
+        # Periodically re-sum to bound float error
+        self.err_since_resum[slot] += 1
+        if self.err_since_resum[slot] >= self.error_window:
+            self.sum_sq[slot] = self.errors_sq[slot, :self.err_count[slot]].sum()
+            self.err_since_resum[slot] = 0
+        return self.rmse(device_id)
+
+    def rmse(self, device_id):
+        slot = self._slots.get(device_id)
+        if slot is None or self.err_count[slot] < 2:
+            return None
+        return float(np.sqrt(max(self.sum_sq[slot], 0.0) / self.err_count[slot]))
+
+    def reset_errors(self):
+        """Clears every device's error window (e.g. after a model swap)."""
+        self.err_head[:] = 0
+        self.err_count[:] = 0
+        self.err_since_resum[:] = 0
+        self.sum_sq[:] = 0.0
+
+    def drifting_devices(self, threshold, limit=10):
+        """Returns up to `limit` (device_id, rmse) pairs above `threshold`, worst first."""
+        # list() snapshots the dict atomically; this may run on the state-writer thread
+        slots = np.array(list(self._slots.values()), dtype=np.int64)
+        if slots.size == 0:
+            return []
+        counts = self.err_count[slots]
+        slots = slots[counts >= 2]
+        rmses = np.sqrt(np.maximum(self.sum_sq[slots], 0.0) / self.err_count[slots])
+        order = np.argsort(-rmses)
+        return [(self._device_ids[slots[i]], float(rmses[i])) for i in order[:limit] if rmses[i] > threshold]
+
+    def memory_bytes(self):
+        """Bytes held by the preallocated per-device arrays."""
+        arrays = (self.history, self.history_count, self.errors_sq, self.err_head,
+                  self.err_count, self.err_since_resum, self.sum_sq, self.last_seen)
+        return sum(a.nbytes for a in arrays)
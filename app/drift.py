@@ -0,0 +1,201 @@
+# app/drift.py
+
+import time
+
+
+class ThresholdDetector:
+    """Fires when a device's rolling RMSE exceeds `threshold`, with hysteresis.
+
+    A device that fired stays disarmed until its RMSE falls below
+    `clear_ratio * threshold`, so a window hovering around the threshold
+    raises one alarm instead of one per reading.
+    """
+
+    name = "threshold"
+
+    def __init__(self, threshold, clear_ratio=0.8):
+        self.threshold = threshold
+        self.clear_level = threshold * clear_ratio
+        self._disarmed = set() # Devices that fired and have not recovered yet
+
+    def update(self, device_id, actual, prediction, device_rmse):
+        if device_rmse is None:
+            return None
+        if device_id in self._disarmed:
+            if device_rmse < self.clear_level:
+                self._disarmed.discard(device_id)
+            return None
+        if device_rmse > self.threshold:
+            self._disarmed.add(device_id)
+            return f"{device_id} RMSE {device_rmse:.2f} > {self.threshold}"
+        return None
+
+    def reset(self):
+        self._disarmed.clear()
+
+    def forget(self, device_id):
+        self._disarmed.discard(device_id)
+
+
+class PageHinkleyDetector:
+    """Page-Hinkley test for an increase in the mean absolute residual across all devices.
+
+    Tracks m_t = sum(|e_i| - mean_i - delta) and its running minimum; the
+    test fires when m_t rises more than `threshold` above that minimum,
+    i.e. errors have been persistently larger than before by more than
+    `delta`. Nothing fires during the first `min_samples` residuals, and
+    the test restarts after each alarm.
+    """
+
+    name = "page_hinkley"
+
+    def __init__(self, delta, threshold, min_samples=100):
+        self.delta = delta
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean = 0.0
+        self.cumulative = 0.0
+        self.minimum = 0.0
+
+    def forget(self, device_id):
+        pass # Residuals are pooled across devices
+
+    def update(self, device_id, actual, prediction, device_rmse):
+        x = abs(actual - prediction)
+        self.n += 1
+        self.mean += (x - self.mean) / self.n
+        self.cumulative += x - self.mean - self.delta
+        self.minimum = min(self.minimum, self.cumulative)
+        statistic = self.cumulative - self.minimum
+        if self.n >= self.min_samples and statistic > self.threshold:
+            self.reset()
+            return f"residuals increased (Page-Hinkley {statistic:.0f} > {self.threshold:.0f})"
+        return None
+
+
+class InputShiftDetector:
+    """Two-sided CUSUM on the incoming readings against a reference taken after each reset.
+
+    The first `reference_size` readings fix the reference mean and standard
+    deviation; after that each standardized reading z feeds
+    g+ = max(0, g+ + z - k) and g- = max(0, g- - z - k), and the test fires
+    when either exceeds `threshold`. Since the model's lag features are
+    past readings, this watches the input distribution the model sees.
+    """
+
+    name = "input_shift"
+
+    def __init__(self, reference_size=500, k=0.5, threshold=50.0):
+        self.reference_size = reference_size
+        self.k = k
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.std = None
+        self.upper = self.lower = 0.0
+
+    def forget(self, device_id):
+        pass # Readings are pooled across devices
+
+    def update(self, device_id, actual, prediction, device_rmse):
+        if self.std is None:
+            # Welford's running mean/variance for the reference
+            self.n += 1
+            delta = actual - self.mean
+            self.mean += delta / self.n
+            self._m2 += delta * (actual - self.mean)
+            if self.n >= self.reference_size:
+                self.std = max((self._m2 / (self.n - 1)) ** 0.5, 1e-9)
+            return None
+        z = (actual - self.mean) / self.std
+        self.upper = max(0.0, self.upper + z - self.k)
+        self.lower = max(0.0, self.lower - z - self.k)
+        if self.upper > self.threshold or self.lower > self.threshold:
+            direction = "up" if self.upper > self.threshold else "down"
+            self.reset()
+            return f"input distribution shifted {direction} (CUSUM)"
+        return None
+
+
+# Detectors selectable by name (e.g. EDGE_DRIFT_DETECTORS=threshold,page_hinkley)
+DETECTORS = {cls.name: cls for cls in (ThresholdDetector, PageHinkleyDetector, InputShiftDetector)}
+
+
+class DriftMonitor:
+    """Feeds every prediction to a set of detectors and decides when a retrain is due.
+
+    The first alarm stays pending until `acknowledge()` (a retrain was
+    started) or `reset()` (a new model is serving). `poll()` withholds it
+    while the cooldown started by `start_cooldown()` is running, so
+    persistent drift retrains at most once per `cooldown_s`. Every update is
+    O(1) per detector.
+    """
+
+    def __init__(self, detectors, cooldown_s=0.0):
+        self.detectors = list(detectors)
+        self.cooldown_s = cooldown_s
+        self.cooldown_until = 0.0
+        self.alarm = None
+        self.alarms = 0
+        self.last_alarm = None
+
+    @classmethod
+    def from_names(cls, names, params=None, cooldown_s=0.0):
+        """Builds the monitor from detector names, each constructed with `params.get(name, {})`."""
+        params = params or {}
+        return cls([DETECTORS[name](**params.get(name, {})) for name in names], cooldown_s=cooldown_s)
+
+    def update(self, device_id, actual, prediction, device_rmse=None):
+        for detector in self.detectors:
+            reason = detector.update(device_id, actual, prediction, device_rmse)
+            if reason is not None:
+                self.alarms += 1
+                self.last_alarm = f"{detector.name}: {reason}"
+                if self.alarm is None:
+                    self.alarm = self.last_alarm
+
+    def poll(self, now=None):
+        """The pending alarm if a retrain may start now, else None."""
+        now = time.monotonic() if now is None else now
+        if self.alarm is None or now < self.cooldown_until:
+            return None
+        return self.alarm
+
+    def acknowledge(self):
+        self.alarm = None
+
+    def start_cooldown(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.cooldown_until = now + self.cooldown_s
+
+    def reset(self):
+        """Restarts every detector (e.g. for a new model); the cooldown keeps running."""
+        for detector in self.detectors:
+            detector.reset()
+        self.alarm = None
+
+    def forget(self, device_id):
+        """Drops a device's per-device detector state (e.g. when the device store evicts it)."""
+        for detector in self.detectors:
+            detector.forget(device_id)
+
+    def cooldown_remaining(self, now=None):
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.cooldown_until - now)
+
+    def stats(self):
+        return {
+            "detectors": [d.name for d in self.detectors],
+            "alarms": self.alarms,
+            "pending": self.alarm,
+            "last_alarm": self.last_alarm,
+            "cooldown_remaining_s": round(self.cooldown_remaining(), 1),
+        }
@@ -1,138 +1,704 @@
 # app/edge_infer.py
 
+import time
+STARTUP_T0 = time.perf_counter() # The startup report's first phase covers the imports below
+
 import paho.mqtt.client as mqtt
 import json
-import joblib
 import numpy as np
 import os
+import shlex
+import socket
 import subprocess
-from collections import deque
+import sys
+import threading
+from collections import OrderedDict
 from datetime import datetime
-import time
+
+# Make the project root importable when run as `python app/edge_infer.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.batching import MicroBatcher
+from app.device_state import DeviceStateStore
+from app.drift import DriftMonitor
+from app.error_stats import RollingErrorStats
+from app.ingest_queue import IngestQueue
+from app.metrics import MetricsRegistry, start_metrics_server
+from app.scale_out import PartitionMembership
+from app.shadow import ShadowEvaluator
+from app.state_writer import StateWriter
+from common.compiled_model import CompiledTreeModel
+from common.features import FeatureSpec, build_feature_row
+from common.model_registry import ModelRegistry
+from common.partitioning import DEFAULT_PARTITIONS
+from common.payload import decode_binary, is_binary, to_epoch_ms
+from common.rollups import PREDICTION_METRICS, RollupWriter
 
 # --- Configuration ---
 MQTT_BROKER = "broker"
 MQTT_PORT = 1883
-MQTT_TOPIC_SENSORS = "roomA/sensors"
+MQTT_TOPIC_SENSORS = os.environ.get("EDGE_TOPIC_SENSORS", "+/sensors") # '<device_id>/sensors'
+# "single": one replica, plain subscription. "shared": replicas split partitioned topics (MQTT v5 shared subscriptions)
+SCALE_MODE = os.environ.get("EDGE_SCALE_MODE", "single")
+SENSOR_PARTITIONS = int(os.environ.get("SENSOR_PARTITIONS", DEFAULT_PARTITIONS)) # Must match the publishers
+REPLICA_ID = os.environ.get("EDGE_REPLICA_ID") or socket.gethostname() # Pod name under k8s
+SHARE_GROUP = os.environ.get("EDGE_SHARE_GROUP", "edge")
+MEMBERSHIP_SETTLE_S = float(os.environ.get("EDGE_MEMBERSHIP_SETTLE_S", 2.0)) # Longest wait for the other replicas' presences
+MAX_DEVICES = int(os.environ.get("EDGE_MAX_DEVICES", 10000)) # Bounds per-device state memory
+DEVICE_IDLE_TIMEOUT_S = float(os.environ.get("EDGE_DEVICE_IDLE_TIMEOUT_S", 600))
 MODEL_DIR = "models"
-STATE_FILE = "data/state.json" # saves to 'data/' volume so dashboard sees it
+# "compiled" serves the NumPy tree artifact next to each .joblib when present; "joblib" always unpickles
+MODEL_FORMAT = os.environ.get("EDGE_MODEL_FORMAT", "compiled")
+MODEL_CACHE_SIZE = int(os.environ.get("EDGE_MODEL_CACHE_SIZE", 3)) # Loaded models kept for instant rollback
+ROLLBACK_TOLERANCE = float(os.environ.get("EDGE_ROLLBACK_TOLERANCE", 0.25)) # Roll back a swapped-in model this much worse; <0 disables
+STATE_FILE = os.environ.get("EDGE_STATE_FILE", "data/state.json") # saves to 'data/' volume so dashboard sees it
+STATE_WRITE_INTERVAL_S = float(os.environ.get("EDGE_STATE_WRITE_INTERVAL_S", 1.0))
+STATE_SOCKET = os.environ.get("EDGE_STATE_SOCKET") or None # e.g. data/state.sock
 N_LAGS = 5
+FEATURE_SPEC = FeatureSpec(target_col="voc_ppb", feature_cols=("voc_ppb",), n_lags=N_LAGS) # Must match cloud/train.py
 RETRAIN_THRESHOLD_RMSE = 75.0
+# Detectors that can request a retrain (app/drift.py): "threshold" (per-device RMSE above RETRAIN_THRESHOLD_RMSE),
+# "page_hinkley" (fleet-wide residual increase) and "input_shift" (reading distribution change)
+DRIFT_DETECTORS = [n.strip() for n in os.environ.get("EDGE_DRIFT_DETECTORS", "threshold,page_hinkley").split(",") if n.strip()]
+DRIFT_CLEAR_RATIO = float(os.environ.get("EDGE_DRIFT_CLEAR_RATIO", 0.8)) # A device re-arms below this share of the threshold
+PH_DELTA = float(os.environ.get("EDGE_PH_DELTA", 0.1 * RETRAIN_THRESHOLD_RMSE)) # Tolerated |error| increase (ppb)
+PH_THRESHOLD = float(os.environ.get("EDGE_PH_THRESHOLD", 20 * RETRAIN_THRESHOLD_RMSE))
+RETRAIN_COOLDOWN_S = float(os.environ.get("EDGE_RETRAIN_COOLDOWN_S", 300)) # Minimum gap between a retrain and the next
+DRIFT_DETECTOR_PARAMS = {
+    "threshold": {"threshold": RETRAIN_THRESHOLD_RMSE, "clear_ratio": DRIFT_CLEAR_RATIO},
+    "page_hinkley": {"delta": PH_DELTA, "threshold": PH_THRESHOLD, "min_samples": 100},
+}
+RETRAIN_COMMAND = os.environ.get("EDGE_RETRAIN_COMMAND", "python cloud/train.py")
+# With no model at startup, the edge serves MQTT and trains in the background once the raw store has enough rows
+RAW_DATA_FORMAT = os.environ.get("RAW_DATA_FORMAT", "parquet") # Must match the publisher and cloud/train.py
+RAW_STORE_DIR = "data/raw"
+RAW_DATA_FILE = "data/raw.csv"
+INITIAL_TRAIN_MIN_ROWS = int(os.environ.get("EDGE_INITIAL_TRAIN_MIN_ROWS", FEATURE_SPEC.history_length + 10)) # Trainer minimum
+READINESS_POLL_S = float(os.environ.get("EDGE_READINESS_POLL_S", 1.0))
+INITIAL_TRAIN_RETRY_S = float(os.environ.get("EDGE_INITIAL_TRAIN_RETRY_S", 10))
 PREDICTION_BUFFER_SIZE = 100
+# A retrained model is first scored in shadow on live traffic and only swapped in if it is no worse.
+# 0 swaps new models in immediately.
+SHADOW_MIN_SAMPLES = int(os.environ.get("EDGE_SHADOW_MIN_SAMPLES", 200))
+SHADOW_MAX_SAMPLES = int(os.environ.get("EDGE_SHADOW_MAX_SAMPLES", 2000))
+SHADOW_TIMEOUT_S = float(os.environ.get("EDGE_SHADOW_TIMEOUT_S", 600))
+SHADOW_TOLERANCE = float(os.environ.get("EDGE_SHADOW_TOLERANCE", 0.0)) # Allowed relative MSE increase
+# Micro-batching: a batch size of 1 predicts every message individually
+BATCH_MAX_SIZE = int(os.environ.get("EDGE_BATCH_MAX_SIZE", 64))
+BATCH_MAX_LATENCY_MS = float(os.environ.get("EDGE_BATCH_MAX_LATENCY_MS", 5))
+# Bounded queue between paho's network thread and processing; 0 processes on paho's thread
+INGEST_QUEUE_SIZE = int(os.environ.get("EDGE_INGEST_QUEUE_SIZE", 10000))
+INGEST_POLICY = os.environ.get("EDGE_INGEST_POLICY", "spill") # "drop_oldest", "block" or "spill"
+INGEST_SPILL_PATH = "data/ingest.log" # Replayed after a crash
+METRICS_PORT = int(os.environ.get("EDGE_METRICS_PORT", 9100)) # Prometheus /metrics; 0 disables
+LAG_SAMPLE_INTERVAL_S = 0.1
+ROLLUP_DIR = "data/rollups" # Per-minute/hour prediction error for the dashboard's history views
+ROLLUPS_ENABLED = os.environ.get("EDGE_ROLLUPS", "1") == "1"
 
 # --- Global State ---
-prediction_buffer = deque(maxlen=PREDICTION_BUFFER_SIZE)
-latest_voc_readings = deque(maxlen=N_LAGS)
+prediction_buffer = RollingErrorStats(PREDICTION_BUFFER_SIZE) # Rolling errors across all devices
+device_store = DeviceStateStore(FEATURE_SPEC.history_length, PREDICTION_BUFFER_SIZE, max_devices=MAX_DEVICES,
+                                idle_timeout_s=DEVICE_IDLE_TIMEOUT_S, n_channels=len(FEATURE_SPEC.feature_cols),
+                                on_evict=lambda device_id: drift_monitor.forget(device_id))
 model = None
 model_version = "N/A"
+shadow = None # ShadowEvaluator of the candidate model, while one is being evaluated
+inference_batcher = None # Created at startup when BATCH_MAX_SIZE > 1
+membership = None # PartitionMembership in shared scale mode
+ingest_queue = None # Created at startup when INGEST_QUEUE_SIZE > 0
+prediction_rollups = None # Created at startup when ROLLUPS_ENABLED
+model_lock = threading.Lock() # Guards the model/model_version swap
+model_generation = 0 # Bumped on every swap so stale predictions can be discarded
+buffer_generation = 0 # Model generation the prediction buffer was filled with
+rollback_watch = None # (generation, replaced version, its RMSE, readings left) while a swapped-in model is on probation
+retrain_guard = threading.Lock() # Held while a background retrain is running
+retrain_thread = None
+drift_monitor = DriftMonitor.from_names(DRIFT_DETECTORS, DRIFT_DETECTOR_PARAMS, cooldown_s=RETRAIN_COOLDOWN_S)
+state_writer = StateWriter(STATE_FILE, interval_s=STATE_WRITE_INTERVAL_S, socket_path=STATE_SOCKET)
+model_registry = ModelRegistry(MODEL_DIR)
+model_cache = OrderedDict() # model file name -> loaded model, most recently used last
+startup_phases = OrderedDict() # phase -> seconds, for the startup timing report
+startup_mark = STARTUP_T0 # End of the last recorded phase
+
+# --- Metrics ---
+metrics = MetricsRegistry()
+messages_received = metrics.counter("edge_messages_received_total", "MQTT messages received")
+readings_received = metrics.counter("edge_readings_received_total", "Sensor readings received")
+decode_errors = metrics.counter("edge_decode_errors_total", "Messages that could not be decoded")
+message_errors = metrics.counter("edge_message_errors_total", "Decoded messages that failed during processing")
+predictions_made = metrics.counter("edge_predictions_total", "Predictions made")
+prediction_latency = metrics.histogram("edge_prediction_latency_seconds", "Model predict() time per batch")
+batch_sizes = metrics.histogram("edge_batch_size", "Rows per model predict() call",
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024))
+message_lag = metrics.gauge("edge_message_lag_seconds", "Age of the newest reading when its message was handled")
+next_lag_sample = 0.0 # time.monotonic() after which record_lag samples again
+retrains_started = metrics.counter("edge_retrains_total", "Background retrains started")
+retrain_failures = metrics.counter("edge_retrain_failures_total", "Background retrains that failed")
+retrain_duration = metrics.histogram("edge_retrain_duration_seconds", "Trainer run time",
+                                     buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+model_load_time = metrics.histogram("edge_model_load_seconds", "Time to load a model artifact from disk")
+rollbacks = metrics.counter("edge_rollbacks_total", "Swapped-in models rolled back after their RMSE regressed")
+shadow_promotions = metrics.counter("edge_shadow_promotions_total", "Candidate models promoted after shadow evaluation")
+shadow_rejections = metrics.counter("edge_shadow_rejections_total", "Candidate models rejected after shadow evaluation")
+# Computed at scrape time, so they cost nothing on the message path
+metrics.gauge("edge_rolling_rmse", "RMSE over the global prediction buffer", fn=lambda: calculate_rolling_rmse())
+metrics.gauge("edge_active_devices", "Devices with state on this replica", fn=lambda: len(device_store))
+metrics.gauge("edge_startup_seconds", "Time from process start to the latest startup phase (connected, first model)",
+              fn=lambda: sum(startup_phases.values()) if startup_phases else None)
+metrics.gauge("edge_model_generation", "Model swaps since start", fn=lambda: model_generation)
+metrics.gauge("edge_retraining", "1 while a background retrain runs", fn=lambda: int(retrain_guard.locked()))
+metrics.counter("edge_drift_alarms_total", "Alarms raised by the drift detectors", fn=lambda: drift_monitor.alarms)
+metrics.gauge("edge_retrain_cooldown_seconds", "Time until drift may start another retrain",
+              fn=lambda: drift_monitor.cooldown_remaining())
+metrics.gauge("edge_shadow_active", "1 while a candidate model is scored in shadow", fn=lambda: int(shadow is not None))
+metrics.gauge("edge_owned_partitions", "Sensor partitions this replica subscribes to (shared mode)",
+              fn=lambda: len(membership.owned) if membership is not None else None)
+metrics.gauge("edge_ingest_queue_depth", "Messages waiting in the in-memory ingest queue",
+              fn=lambda: ingest_queue.depth() if ingest_queue is not None else 0)
+metrics.gauge("edge_ingest_spill_backlog_bytes", "Spilled bytes not yet processed",
+              fn=lambda: ingest_queue.spill_backlog_bytes() if ingest_queue is not None else 0)
+metrics.counter("edge_ingest_dropped_total", "Messages dropped by the drop_oldest policy",
+                fn=lambda: ingest_queue.dropped if ingest_queue is not None else 0)
+metrics.counter("edge_ingest_spilled_total", "Messages written to the spill log",
+                fn=lambda: ingest_queue.spilled if ingest_queue is not None else 0)
+metrics.gauge("edge_batch_pending_rows", "Rows waiting in the micro-batcher",
+              fn=lambda: inference_batcher.pending() if inference_batcher is not None else 0)
+
+def record_startup_phase(name):
+    """Records the time since the previous phase (or since the imports began) under `name`."""
+    global startup_mark
+    now = time.perf_counter()
+    startup_phases[name] = now - startup_mark
+    startup_mark = now
+
+def startup_report():
+    phases = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in startup_phases.items())
+    return f"Edge: Startup phases: {phases} (total {sum(startup_phases.values()):.2f}s)"
+
+def raw_row_count():
+    """Rows in the raw store the trainer reads (Parquet footers, or the CSV's lines)."""
+    if RAW_DATA_FORMAT == "parquet":
+        from common.raw_store import RawDataReader # pandas/pyarrow: only needed until the first model exists
+        return RawDataReader(RAW_STORE_DIR).row_count()
+    try:
+        with open(RAW_DATA_FILE, "rb") as f:
+            return max(sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b"")) - 1, 0)
+    except FileNotFoundError:
+        return 0
+
+def wait_for_training_data(min_rows=None, poll_s=None):
+    """Blocks until the raw store holds at least `min_rows` rows (readiness check for the initial training)."""
+    min_rows = INITIAL_TRAIN_MIN_ROWS if min_rows is None else min_rows
+    poll_s = READINESS_POLL_S if poll_s is None else poll_s
+    waiting = False
+    while True:
+        rows = raw_row_count()
+        if rows >= min_rows:
+            return rows
+        if not waiting:
+            print(f"Edge: Waiting for training data ({rows}/{min_rows} rows)...")
+            waiting = True
+        time.sleep(poll_s)
+
+def find_latest_model_file():
+    """Returns the file name of the model to serve: the registry's current version,
+    or the newest .joblib for model directories without a manifest."""
+    if model_registry.exists():
+        entry = model_registry.current()
+        return entry["path"] if entry else None
+    model_files = [f for f in os.listdir(MODEL_DIR) if f.endswith(".joblib")]
+    if not model_files: return None
+    return max(model_files, key=lambda f: os.path.getctime(os.path.join(MODEL_DIR, f)))
+
+def find_candidate_model_file():
+    """Returns the file name of the newest version registered after the current one that has not been
+    through shadow evaluation yet, or None. Without a manifest, a newest .joblib that is not serving."""
+    if not model_registry.exists():
+        newest = find_latest_model_file()
+        return newest if newest != model_version else None
+    current = model_registry.current()
+    entries = model_registry.entries()
+    versions = [e["version"] for e in entries]
+    newer = entries[versions.index(current["version"]) + 1:] if current else entries
+    pending = [e for e in newer if "shadow" not in e]
+    return pending[-1]["path"] if pending else None
+
+def read_model(model_file):
+    """Loads a model artifact, reusing the in-process LRU of recently loaded models."""
+    if model_file in model_cache:
+        model_cache.move_to_end(model_file)
+        return model_cache[model_file]
+
+    start = time.perf_counter()
+    model_path = os.path.join(MODEL_DIR, model_file)
+    compiled_path = model_path.replace(".joblib", ".npz")
+    if MODEL_FORMAT == "compiled" and os.path.exists(compiled_path):
+        model_registry.verify(os.path.basename(compiled_path))
+        new_model = CompiledTreeModel.load(compiled_path)
+    else:
+        import joblib # Pulls in sklearn/LightGBM; only needed for the pickled artifact
+        model_registry.verify(model_file) # Never unpickle a file that is not what the trainer registered
+        new_model = joblib.load(model_path)
+    model_spec = getattr(new_model, "feature_spec_", None)
+    if model_spec is not None and FeatureSpec.from_dict(model_spec) != FEATURE_SPEC:
+        raise ValueError(f"{model_file} was trained with features {model_spec}, edge builds {FEATURE_SPEC.to_dict()}")
+    model_load_time.observe(time.perf_counter() - start)
+
+    model_cache[model_file] = new_model
+    while len(model_cache) > MODEL_CACHE_SIZE:
+        model_cache.popitem(last=False)
+    return new_model
+
+def swap_model(new_model, new_version):
+    """Atomically replaces the serving model."""
+    global model, model_version, model_generation
+    with model_lock:
+        model = new_model
+        model_version = new_version
+        model_generation += 1
 
 def load_latest_model():
-    """Loads the most recently created model file from the models directory."""
-    global model, model_version
+    """Serves the registry's current version, or evaluates a newer candidate.
+
+    The trainer registers new versions as candidates, scored in shadow
+    next to the serving model (see start_shadow) and only made current when
+    promoted; a restart serves the current version and resumes evaluating
+    the candidate. A candidate is served right away only if no version was
+    ever made current, or with SHADOW_MIN_SAMPLES at 0.
+    """
+    global shadow
     try:
-        model_files = [f for f in os.listdir(MODEL_DIR) if f.endswith(".joblib")]
-        if not model_files: return False
-        
-        # Find the newest file
-        latest_model_file = max(model_files, key=lambda f: os.path.getctime(os.path.join(MODEL_DIR, f)))
-        model_path = os.path.join(MODEL_DIR, latest_model_file)
-        
-        model = joblib.load(model_path)
-        model_version = latest_model_file
+        current_file = find_latest_model_file()
+        candidate_file = find_candidate_model_file()
+        if SHADOW_MIN_SAMPLES <= 0:
+            target = candidate_file or current_file
+        elif model is None:
+            target = current_file or candidate_file
+        elif candidate_file is not None:
+            if shadow is None or shadow.version != candidate_file:
+                start_shadow(read_model(candidate_file), candidate_file)
+            return True
+        else:
+            shadow = None # Nothing left to evaluate (e.g. decided by another replica)
+            target = current_file # Vetted: promoted here or elsewhere, or rolled back to
+        if target is None: return False
+        if target == model_version and model is not None:
+            return True # Already serving it
+
+        # Load fully before swapping so predictions never see a half-loaded model
+        new_model = read_model(target)
+        if target != current_file and model_registry.exists():
+            model_registry.set_current(os.path.splitext(target)[0])
+        # The serving model's RMSE is the bar, unless its buffer was not refilled since the last swap
+        fresh = model is not None and buffer_generation == model_generation
+        replaced, replaced_rmse = (model_version, calculate_rolling_rmse()) if fresh else (None, None)
+        swap_model(new_model, target)
+        watch_for_regression(replaced, replaced_rmse)
         print(f"Edge: Successfully loaded model: {model_version}")
+        if SHADOW_MIN_SAMPLES > 0 and candidate_file not in (None, target):
+            start_shadow(read_model(candidate_file), candidate_file) # Registered while we were down
         return True
     except Exception as e:
         print(f"Edge: Error loading model: {e}")
         return False
 
-def save_state():
-    """Saves current pipeline state to a JSON file for the dashboard."""
+def start_shadow(candidate, candidate_version):
+    """Starts scoring `candidate` next to the serving model; finish_shadow swaps it in or drops it."""
+    global shadow
+    shadow = ShadowEvaluator(candidate, candidate_version, PREDICTION_BUFFER_SIZE, min_samples=SHADOW_MIN_SAMPLES,
+                             max_samples=SHADOW_MAX_SAMPLES, timeout_s=SHADOW_TIMEOUT_S, tolerance=SHADOW_TOLERANCE)
+    print(f"Edge: Evaluating {candidate_version} in shadow against {model_version}")
+
+def finish_shadow(evaluator, decision):
+    """Promotes ("promote") or rejects the candidate of a finished shadow evaluation.
+
+    A promoted model keeps the errors it made in shadow as its prediction
+    buffer, so drift checks do not start from an empty window, and becomes
+    the registry's current version. Either way the result is recorded on the
+    candidate's entry, which takes it out of find_candidate_model_file, so a
+    restart does not evaluate it again.
+    """
+    global shadow, prediction_buffer, buffer_generation
+    if shadow is not evaluator:
+        return
+    shadow = None
+    stats = evaluator.stats()
+    if decision == "promote":
+        replaced = model_version
+        swap_model(evaluator.model, evaluator.version)
+        watch_for_regression(replaced, evaluator.active_errors.rmse())
+        prediction_buffer = evaluator.candidate_errors
+        device_store.reset_errors()
+        buffer_generation = model_generation
+        shadow_promotions.inc()
+    else:
+        shadow_rejections.inc()
+    # Either way, detectors start over: a new model, or re-armed for drift that persists (after the cooldown)
+    drift_monitor.reset()
+    print(f"Edge: Shadow evaluation of {evaluator.version}: {decision} after {stats['samples']} readings "
+          f"(RMSE {stats['candidate_rmse']} vs {stats['active_rmse']}), serving {model_version}")
+    try:
+        model_registry.annotate(os.path.splitext(evaluator.version)[0], shadow=dict(stats, decision=decision))
+        if decision == "promote":
+            model_registry.set_current(os.path.splitext(evaluator.version)[0])
+    except (KeyError, OSError) as e:
+        print(f"Edge: Could not record the shadow result in the registry: {e}")
+
+def rollback_model(target=None):
+    """Makes `target` (a model file; default the previously registered version) current again
+    and serves it, from the LRU if cached."""
+    try:
+        if target is not None:
+            previous = model_registry.get(os.path.splitext(target)[0])
+        else:
+            current = model_registry.get(os.path.splitext(model_version)[0])
+            previous = model_registry.previous(current["version"]) if current else None
+        if previous is None:
+            print("Edge: No previous model version to roll back to.")
+            return False
+        new_model = read_model(previous["path"])
+        model_registry.set_current(previous["version"])
+        swap_model(new_model, previous["path"])
+        rollbacks.inc()
+        print(f"Edge: Rolled back to model: {model_version}")
+        return True
+    except Exception as e:
+        print(f"Edge: Error rolling back model: {e}")
+        return False
+
+def watch_for_regression(replaced_version, replaced_rmse):
+    """Puts the model just swapped in on probation: check_regression compares it with the one it replaced."""
+    global rollback_watch
+    if replaced_version is None or replaced_rmse is None or ROLLBACK_TOLERANCE < 0:
+        rollback_watch = None
+    else:
+        rollback_watch = (model_generation, replaced_version, replaced_rmse, PREDICTION_BUFFER_SIZE)
+
+def check_regression(n_readings):
+    """Once the model on probation has filled the prediction buffer, rolls back to the replaced
+    version if its RMSE is more than ROLLBACK_TOLERANCE above the replaced model's."""
+    global rollback_watch
+    generation, replaced_version, replaced_rmse, remaining = rollback_watch
+    if generation != model_generation:
+        rollback_watch = None # Swapped again meanwhile
+        return
+    if remaining > n_readings:
+        rollback_watch = (generation, replaced_version, replaced_rmse, remaining - n_readings)
+        return
+    rollback_watch = None
+    rmse = calculate_rolling_rmse()
+    if rmse is not None and rmse > replaced_rmse * (1 + ROLLBACK_TOLERANCE):
+        print(f"Edge: {model_version} RMSE {rmse:.2f} regressed from {replaced_rmse:.2f} of {replaced_version}.")
+        rollback_model(replaced_version)
+
+def build_state():
+    """Collects the current pipeline state for the dashboard."""
     rolling_rmse = calculate_rolling_rmse()
     state = {
         "model_version": model_version, 
         "buffer_size": len(prediction_buffer), 
         "rolling_rmse": rolling_rmse, 
+        "rolling_mae": prediction_buffer.mae(),
+        "rolling_bias": prediction_buffer.bias(),
+        "rolling_p95_error": prediction_buffer.percentile(95),
         "retrain_threshold": RETRAIN_THRESHOLD_RMSE, 
+        "retraining": retrain_guard.locked(),
+        "shadow": shadow.stats() if shadow is not None else None,
+        "drift": drift_monitor.stats(),
+        "startup_s": {name: round(seconds, 3) for name, seconds in startup_phases.items()},
         "last_updated": datetime.now().isoformat()
     }
-    # Ensure directory exists
-    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
-    with open(STATE_FILE, 'w') as f: 
-        json.dump(state, f, indent=4)
+    state["devices"] = {
+        "active": len(device_store),
+        "capacity": MAX_DEVICES,
+        "evictions": device_store.evictions,
+        "memory_bytes": device_store.memory_bytes(),
+        "drifting": dict(device_store.drifting_devices(RETRAIN_THRESHOLD_RMSE)),
+    }
+    if inference_batcher is not None:
+        state["inference"] = inference_batcher.stats()
+    return state
+
+def save_state():
+    """Publishes pipeline state for the dashboard; coalesced to STATE_WRITE_INTERVAL_S."""
+    state_writer.publish(build_state)
 
 def calculate_rolling_rmse():
-    """Calculates RMSE from the current prediction buffer."""
+    """Returns the RMSE of the current prediction buffer in O(1)."""
     if len(prediction_buffer) < 2: return None
-    actuals, predictions = zip(*prediction_buffer)
-    return np.sqrt(np.mean((np.array(actuals) - np.array(predictions))**2))
+    return prediction_buffer.rmse()
+
+def trigger_retrain():
+    """Starts retraining in the background. Returns False if one is already running,
+    or while the last retrain's model is still being evaluated in shadow."""
+    global retrain_thread
+    if shadow is not None or not retrain_guard.acquire(blocking=False):
+        return False
+    retrain_thread = threading.Thread(target=_retrain_worker, name="retrain", daemon=True)
+    retrain_thread.start()
+    return True
+
+def _retrain_worker():
+    """Runs the trainer (RETRAIN_COMMAND) in a child process, then hot-swaps the new model in."""
+    try:
+        print("--- Triggering model retraining (background) ---")
+        retrains_started.inc()
+        start = time.monotonic()
+        subprocess.run(shlex.split(RETRAIN_COMMAND), check=True)
+        retrain_duration.observe(time.monotonic() - start)
+        print(f"--- Retraining finished in {time.monotonic() - start:.1f}s. Reloading new model. ---")
+        load_latest_model()
+    except Exception as e:
+        retrain_failures.inc()
+        print(f"Edge: Background retraining failed: {e}")
+    finally:
+        drift_monitor.start_cooldown()
+        retrain_guard.release()
+
+def start_initial_training():
+    """Trains the first model in the background (holding retrain_guard), so the edge can connect meanwhile."""
+    global retrain_thread
+    retrain_guard.acquire()
+    retrain_thread = threading.Thread(target=_initial_training_worker, name="initial-training", daemon=True)
+    retrain_thread.start()
+
+def _initial_training_worker():
+    """Waits for enough raw rows, then runs the trainer until a model loads."""
+    try:
+        while model is None:
+            rows = wait_for_training_data()
+            print(f"Edge: {rows} raw rows available. Triggering INITIAL training...")
+            try:
+                subprocess.run(shlex.split(RETRAIN_COMMAND), check=True)
+            except Exception as e:
+                print(f"Edge: Initial training failed: {e}")
+            if load_latest_model():
+                record_startup_phase("first_model")
+                print(startup_report())
+            else:
+                time.sleep(INITIAL_TRAIN_RETRY_S)
+    finally:
+        retrain_guard.release()
+
+def wait_for_retrain(timeout=None):
+    """Blocks until the running background retrain (if any) has finished."""
+    thread = retrain_thread
+    if thread is not None:
+        thread.join(timeout)
 
 def on_connect(client, userdata, flags, reason_code, properties):
     """MQTT V2 Callback for connection."""
     if reason_code == 0:
         print("Edge: Connected to MQTT Broker!")
-        client.subscribe(MQTT_TOPIC_SENSORS)
-        print(f"Edge: Subscribed to topic: {MQTT_TOPIC_SENSORS}")
+        if membership is not None:
+            membership.on_connect(client)
+            # Unpartitioned publishers are still handled once, just without device affinity
+            client.subscribe(f"$share/{SHARE_GROUP}/{MQTT_TOPIC_SENSORS}")
+            print(f"Edge: Replica {REPLICA_ID} joined share group {SHARE_GROUP}")
+            return
+        # Both topic forms, so readings arrive whether or not the publishers partition them
+        topics = [MQTT_TOPIC_SENSORS, f"{MQTT_TOPIC_SENSORS}/+"]
+        client.subscribe([(topic, 0) for topic in topics])
+        print(f"Edge: Subscribed to topics: {', '.join(topics)}")
     else:
         print(f"Edge: Failed to connect, return code {reason_code}\n")
 
+def predict_batch(features):
+    """Runs the active model on a 2-D feature matrix, and the shadow candidate (if any) on the same matrix.
+
+    Returns (predictions, shadow_scores), where shadow_scores is None or
+    (evaluator, candidate predictions) for handle_predictions.
+    """
+    evaluator = shadow
+    start = time.perf_counter()
+    predictions = model.predict(features)
+    prediction_latency.observe(time.perf_counter() - start)
+    batch_sizes.observe(len(features))
+    predictions_made.inc(len(features))
+    if evaluator is None:
+        return predictions, None
+    return predictions, (evaluator, evaluator.model.predict(features))
+
+def device_id_from_topic(topic):
+    """Extracts the device id from a '<device_id>/sensors' topic."""
+    return topic.split("/", 1)[0]
+
+def handle_predictions(contexts, predictions, shadow_scores=None):
+    """Stores predictions in order per device, then checks for drift once per batch.
+
+    `contexts` holds one (device_id, actual_voc) pair per prediction;
+    `shadow_scores` is the candidate part of predict_batch's result.
+    """
+    global buffer_generation
+    if buffer_generation != model_generation:
+        # Reset buffers to give the new model a fresh start
+        prediction_buffer.clear()
+        device_store.reset_errors()
+        drift_monitor.reset()
+        buffer_generation = model_generation
+
+    for (device_id, actual_voc), prediction in zip(contexts, predictions):
+        prediction_buffer.update(actual_voc, prediction)
+        device_rmse = device_store.record_error(device_id, actual_voc, prediction)
+        drift_monitor.update(device_id, actual_voc, prediction, device_rmse)
+    if rollback_watch is not None:
+        check_regression(len(contexts))
+
+    if prediction_rollups is not None:
+        errors = np.fromiter((actual for _, actual in contexts), np.float64, len(contexts)) - np.asarray(predictions)
+        prediction_rollups.add(to_epoch_ms(datetime.now()), np.column_stack([np.abs(errors), errors * errors]))
+
+    # Check for Drift once per batch; a pending alarm waits out the cooldown or a running retrain
+    reason = drift_monitor.poll()
+    if reason is not None and trigger_retrain():
+        drift_monitor.acknowledge()
+        # The old model keeps serving until the new one is swapped in
+        print(f"!!! DRIFT DETECTED ({reason}) !!!")
+
+    if shadow_scores is not None:
+        evaluator, candidate_predictions = shadow_scores
+        if evaluator is shadow: # Not already decided
+            decision = evaluator.observe([actual for _, actual in contexts], predictions, candidate_predictions)
+            if decision is not None:
+                finish_shadow(evaluator, decision)
+
+    # Save state for Dashboard
+    save_state()
+
+def process_reading(device_id, reading, actual_voc):
+    """Updates a device's history with one reading (FEATURE_SPEC.feature_cols values) and queues its prediction."""
+    # History *before* this reading: the same inputs training used to predict it
+    history = device_store.push_reading(device_id, reading)
+
+    # Only predict if we have enough lags and a loaded model
+    if history is not None and model:
+        features = build_feature_row(history, FEATURE_SPEC)
+        if inference_batcher is not None:
+            # Queued; predictions come back through handle_predictions
+            inference_batcher.submit(features, (device_id, actual_voc))
+        else:
+            predictions, shadow_scores = predict_batch(features.reshape(1, -1))
+            handle_predictions([(device_id, actual_voc)], predictions, shadow_scores)
+
+def process_binary_message(topic_device_id, device_ids, records):
+    """Handles a decoded binary message (common/payload.py) without per-reading dicts."""
+    readings = np.column_stack([records[col] for col in FEATURE_SPEC.feature_cols]).astype(np.float64)
+    actual_vocs = records["voc_ppb"].astype(np.float64).tolist()
+    devices = records["device"].tolist()
+    for i, reading in enumerate(readings):
+        device_id = device_ids[devices[i]] if device_ids else topic_device_id
+        process_reading(device_id, reading, actual_vocs[i])
+
+def record_lag(timestamp):
+    """Sets the message lag gauge from the newest reading's timestamp (ISO string or epoch ms).
+
+    Parsing timestamps costs more than the rest of the instrumentation, so
+    the gauge is refreshed at most every LAG_SAMPLE_INTERVAL_S.
+    """
+    global next_lag_sample
+    now = time.monotonic()
+    if timestamp is None or now < next_lag_sample:
+        return
+    next_lag_sample = now + LAG_SAMPLE_INTERVAL_S
+    ts_ms = timestamp if isinstance(timestamp, int) else to_epoch_ms(timestamp)
+    message_lag.set((to_epoch_ms(datetime.now()) - ts_ms) / 1000.0)
+
 def on_message(client, userdata, msg):
-    """Main logic: Receive data -> Predict -> Check Drift -> Trigger Retrain"""
+    """MQTT callback: hands the message to the ingest queue, or processes it right away."""
+    messages_received.inc()
+    if ingest_queue is not None:
+        ingest_queue.put(msg.topic, msg.payload)
+    else:
+        process_message(msg.topic, msg.payload)
+
+def process_message(topic, message):
+    """Main logic: Receive data -> Predict -> Check Drift -> Trigger Retrain
+
+    A message holds one reading (a JSON dict), a batch of readings (a JSON
+    list, as sent by the simulator) or a packed binary batch. A reading's
+    device id takes precedence over the topic.
+    """
+    binary = is_binary(message)
+    try:
+        if binary:
+            device_ids, readings = decode_binary(message)
+        else:
+            payload = json.loads(message.decode())
+            readings = payload if isinstance(payload, list) else (payload,)
+    except Exception as e:
+        decode_errors.inc()
+        print(f"Edge: Could not decode message on {topic}: {e}")
+        return
+
     try:
-        payload = json.loads(msg.payload.decode())
-        actual_voc = payload['voc_ppb']
-        latest_voc_readings.append(actual_voc)
-
-        # Only predict if we have enough lags and a loaded model
-        if len(latest_voc_readings) == N_LAGS and model:
-            features = np.array(list(latest_voc_readings)).reshape(1, -1)
-            prediction = model.predict(features)[0]
-            
-            # Store (actual, prediction)
-            prediction_buffer.append((actual_voc, prediction))
-            
-            # Check for Drift
-            rolling_rmse = calculate_rolling_rmse()
-            if rolling_rmse is not None:
-                # print(f"Actual: {actual_voc:<5} | Pred: {prediction:<5.1f} | Rolling RMSE: {rolling_rmse:.2f}")
-                
-                if rolling_rmse > RETRAIN_THRESHOLD_RMSE:
-                    print(f"!!! DRIFT DETECTED (RMSE {rolling_rmse:.2f} > {RETRAIN_THRESHOLD_RMSE}) !!!")
-                    print("--- Triggering model retraining ---")
-                    
-                    # Run the training script via subprocess
-                    subprocess.run(["python", "cloud/train.py"], check=True)
-                    
-                    print("--- Retraining finished. Reloading new model. ---")
-                    load_latest_model()
-                    prediction_buffer.clear() # Reset buffer to give new model a fresh start
-                    latest_voc_readings.clear()
-            
-            # Save state for Dashboard
-            save_state()
+        readings_received.inc(len(readings))
+        topic_device_id = device_id_from_topic(topic)
+        if binary:
+            process_binary_message(topic_device_id, device_ids, readings)
+            if len(readings):
+                record_lag(int(readings["timestamp_ms"][-1]))
+            return
+        for reading in readings:
+            values = [reading[col] for col in FEATURE_SPEC.feature_cols]
+            process_reading(reading.get("device_id", topic_device_id), values, reading['voc_ppb'])
+        if readings:
+            record_lag(readings[-1].get("timestamp"))
 
     except Exception as e: 
+        message_errors.inc()
         print(f"An error occurred in on_message: {e}")
 
+def on_batch_predictions(contexts, scored):
+    """Batcher callback for predict_batch's results; errors are reported like on_message so the flusher keeps running."""
+    try:
+        handle_predictions(contexts, *scored)
+    except Exception as e:
+        print(f"An error occurred handling a prediction batch: {e}")
+
 # --- Main Execution ---
 if __name__ == "__main__":
+    record_startup_phase("imports")
     # 1. Check if model exists
     if not load_latest_model():
-        print("Edge: No model found. Waiting 30s for data, then training...")
-        # Wait for Publisher to generate enough data (need >15 rows)
-        time.sleep(30) 
-        
-        print("Edge: Triggering INITIAL training...")
-        try:
-            # Run training automatically
-            subprocess.run(["python", "cloud/train.py"], check=True)
-            load_latest_model()
-        except Exception as e:
-            print(f"Edge: Initial training failed: {e}")
+        # Readings received meanwhile fill the devices' lag windows, so predictions start as soon as it loads
+        print("Edge: No model found. Training in the background once enough data has arrived.")
+        start_initial_training()
+    record_startup_phase("model_load")
 
     # 2. Proceed to MQTT (Normal startup)
+    state_writer.start()
+    if METRICS_PORT:
+        start_metrics_server(metrics, METRICS_PORT)
+        print(f"Edge: Serving metrics on :{METRICS_PORT}/metrics")
+    if BATCH_MAX_SIZE > 1:
+        inference_batcher = MicroBatcher(
+            predict_batch, on_batch_predictions, FEATURE_SPEC.n_features,
+            max_batch_size=BATCH_MAX_SIZE, max_latency_ms=BATCH_MAX_LATENCY_MS
+        )
+        inference_batcher.start()
+        print(f"Edge: Micro-batching enabled ({BATCH_MAX_SIZE} rows / {BATCH_MAX_LATENCY_MS} ms).")
+
+    if INGEST_QUEUE_SIZE > 0:
+        # Replays messages spilled before a crash, then decouples paho's thread from processing
+        ingest_queue = IngestQueue(process_message, maxsize=INGEST_QUEUE_SIZE, policy=INGEST_POLICY,
+                                   spill_path=INGEST_SPILL_PATH)
+        ingest_queue.start()
+        print(f"Edge: Ingest queue enabled ({INGEST_QUEUE_SIZE} messages, {INGEST_POLICY} when full).")
+
+    if ROLLUPS_ENABLED:
+        # One set of files per replica; the dashboard merges them
+        prediction_rollups = RollupWriter(ROLLUP_DIR, "predictions" if SCALE_MODE != "shared" else f"predictions-{REPLICA_ID}",
+                                          PREDICTION_METRICS)
+
+    record_startup_phase("services")
     print("Edge: Proceeding to connect to MQTT.")
     
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="edge_inference_service")
+    if SCALE_MODE == "shared":
+        # Unique id per replica: a shared id would make replicas kick each other off the broker
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"edge_{REPLICA_ID}", protocol=mqtt.MQTTv5)
+        membership = PartitionMembership(REPLICA_ID, SENSOR_PARTITIONS, group=SHARE_GROUP, settle_s=MEMBERSHIP_SETTLE_S)
+        membership.attach(client)
+    else:
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="edge_inference_service")
     client.on_connect = on_connect
     client.on_message = on_message
 
@@ -144,9 +710,22 @@ if __name__ == "__main__":
         except ConnectionRefusedError:
             print("Edge: Connection refused. Retrying in 5 seconds...")
             time.sleep(5)
+    record_startup_phase("mqtt_connect")
+    print(startup_report())
 
     try:
         client.loop_forever()
     except KeyboardInterrupt:
         print("Edge inference service stopped.")
-        client.disconnect()
\ No newline at end of file
+        if ingest_queue is not None:
+            ingest_queue.stop() # Unprocessed messages stay in the spill log for the next start
+        wait_for_retrain()
+        if inference_batcher is not None:
+            inference_batcher.stop()
+        state_writer.stop()
+        if prediction_rollups is not None:
+            prediction_rollups.flush()
+        if membership is not None:
+            membership.leave(client)
+        else:
+            client.disconnect()
\ No newline at end of file
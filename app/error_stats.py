@@ -0,0 +1,83 @@
+# app/error_stats.py
+
+import numpy as np
+
+
+class RollingErrorStats:
+    """Rolling prediction-error statistics over the last `window` predictions.
+
+    Running sums of squared, absolute and signed error are maintained as
+    values enter and leave the window, so RMSE/MAE/bias are O(1) per update.
+    The sums are recomputed from the window every `resum_interval` updates
+    to stop floating point error from accumulating.
+    """
+
+    def __init__(self, window, resum_interval=None):
+        if window < 1:
+            raise ValueError("window must be at least 1")
+        self.window = window
+        self.resum_interval = resum_interval or window
+        self._errors = np.zeros(window, dtype=np.float64)
+        self.clear()
+
+    def clear(self):
+        self._errors[:] = 0.0
+        self._head = 0 # Next slot to overwrite
+        self._count = 0
+        self._sum_sq = 0.0
+        self._sum_abs = 0.0
+        self._sum = 0.0
+        self._since_resum = 0
+
+    def __len__(self):
+        return self._count
+
+    def update(self, actual, prediction):
+        """Adds one (actual, prediction) pair, evicting the oldest if the window is full."""
+        error = float(actual) - float(prediction)
+        if self._count == self.window:
+            old = self._errors[self._head]
+            self._sum_sq -= old * old
+            self._sum_abs -= abs(old)
+            self._sum -= old
+        else:
+            self._count += 1
+        self._errors[self._head] = error
+        self._sum_sq += error * error
+        self._sum_abs += abs(error)
+        self._sum += error
+        self._head = (self._head + 1) % self.window
+
+        self._since_resum += 1
+        if self._since_resum >= self.resum_interval:
+            self.resum()
+
+    def resum(self):
+        """Recomputes the running sums exactly from the window contents."""
+        errors = self.errors()
+        self._sum_sq = float(np.dot(errors, errors))
+        self._sum_abs = float(np.abs(errors).sum())
+        self._sum = float(errors.sum())
+        self._since_resum = 0
+
+    def errors(self):
+        """Returns the errors currently in the window (oldest order not guaranteed)."""
+        return self._errors[:self._count]
+
+    def rmse(self):
+        if self._count == 0: return None
+        return float(np.sqrt(max(self._sum_sq, 0.0) / self._count))
+
+    def mae(self):
+        if self._count == 0: return None
+        return max(self._sum_abs, 0.0) / self._count
+
+    def bias(self):
+        """Mean signed error (actual - prediction); positive means under-prediction."""
+        if self._count == 0: return None
+        return self._sum / self._count
+
+    def percentile(self, q):
+        """Percentile of absolute error. O(window), intended for reporting only."""
+        if self._count == 0: return None
+        return float(np.percentile(np.abs(self.errors()), q))
@@ -0,0 +1,269 @@
+# app/ingest_queue.py
+
+import os
+import struct
+import threading
+import time
+from collections import deque
+
+POLICIES = ("drop_oldest", "block", "spill")
+_RECORD_HEADER = struct.Struct("<HI") # topic length, payload length
+
+
+class IngestQueue:
+    """Bounded queue between the MQTT network thread and message processing.
+
+    `put()` is called from paho's thread and returns quickly; a worker thread
+    hands each (topic, payload) to `handler` in arrival order. When
+    `maxsize` messages are waiting the `policy` decides:
+
+    - drop_oldest: discard the oldest waiting message (counted in `dropped`)
+    - block: hold paho's thread until there is room, so TCP backpressure
+      slows the broker down instead of buffering in memory
+    - spill: append new messages to the log at `spill_path` until the worker
+      has caught up. The log survives a crash; on start, records after the
+      last committed offset are replayed before new messages
+      (at-least-once: up to `commit_interval_s` of records may repeat).
+    """
+
+    def __init__(self, handler, maxsize=10000, policy="drop_oldest", spill_path=None, commit_interval_s=1.0):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy!r}, expected one of {POLICIES}")
+        if policy == "spill" and not spill_path:
+            raise ValueError("The spill policy needs a spill_path")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.spill_path = spill_path
+        self.commit_interval_s = commit_interval_s
+
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._worker = None
+
+        # Spill log state (guarded by _cond)
+        self._log = None
+        self._spilling = False
+        self._write_offset = 0
+        self._read_offset = 0
+        self._last_commit = 0.0
+
+        self.received = 0
+        self.handled = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.replayed = 0
+        self.errors = 0
+        self.blocked_seconds = 0.0
+        if policy == "spill":
+            self._open_log()
+
+    # --- Producer side (network thread) ---
+
+    def put(self, topic, payload):
+        with self._cond:
+            self.received += 1
+            if self._spilling:
+                # Keep arrival order: once spilling, everything goes to the log until it is drained
+                self._append_log(topic, payload)
+                return
+            if len(self._items) >= self.maxsize:
+                if self.policy == "drop_oldest":
+                    self._items.popleft()
+                    self.dropped += 1
+                elif self.policy == "block":
+                    start = time.monotonic()
+                    while len(self._items) >= self.maxsize and not self._stopped:
+                        self._cond.wait(0.1)
+                    self.blocked_seconds += time.monotonic() - start
+                else:
+                    self._spilling = True
+                    self._append_log(topic, payload)
+                    return
+            self._items.append((topic, payload))
+            self._cond.notify_all()
+
+    def depth(self):
+        """Messages waiting in memory (spilled ones are in spill_backlog_bytes)."""
+        return len(self._items)
+
+    def spill_backlog_bytes(self):
+        return self._write_offset - self._read_offset
+
+    # --- Consumer side ---
+
+    def start(self):
+        self._worker = threading.Thread(target=self._run, name="ingest", daemon=True)
+        self._worker.start()
+
+    def stop(self, timeout=5.0):
+        """Stops after the in-memory queue drains (or `timeout`); leftovers are spilled if possible.
+
+        A worker still inside a handler when `timeout` runs out keeps the log
+        open and spills and closes it itself once that handler returns.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._items and time.monotonic() < deadline:
+                self._cond.wait(0.05)
+            self._stopped = True
+            self._cond.notify_all()
+        if self._worker is not None:
+            self._worker.join(max(deadline - time.monotonic(), 0.1))
+            if self._worker.is_alive():
+                print("Edge: Ingest worker is still busy; it will spill the queue and close the log when done.")
+                return
+        with self._cond:
+            self._close_log()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._items and not self._log_pending() and not self._stopped:
+                    self._cond.wait(0.5)
+                if self._stopped:
+                    self._close_log()
+                    return
+                if self._items:
+                    item = self._items.popleft()
+                    self._cond.notify_all() # Wake a blocked producer
+                else:
+                    item = None
+                    end = self._write_offset
+            if item is not None:
+                self._handle(*item)
+            else:
+                self._replay_log(end)
+
+    def _handle(self, topic, payload):
+        try:
+            self.handler(topic, payload)
+        except Exception as e:
+            self.errors += 1
+            print(f"Edge: Ingest handler failed: {e}")
+        self.handled += 1
+
+    # --- Spill log ---
+
+    def _log_pending(self):
+        return self._spilling and self._read_offset < self._write_offset
+
+    def _open_log(self):
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        end = self._scan_complete_records()
+        with open(self.spill_path, "ab") as f:
+            f.truncate(end) # Drop a record torn by a crash
+        self._log = open(self.spill_path, "ab")
+        self._write_offset = end
+        self._read_offset = min(self._read_commit(), end)
+        self._spilling = self._read_offset < end
+        if self._spilling:
+            print(f"Edge: Replaying {end - self._read_offset} bytes of spilled messages from {self.spill_path}")
+
+    def _close_log(self):
+        """Spills what is still queued in memory, commits the read offset and closes the log (under _cond)."""
+        if self._log is None:
+            return
+        for topic, payload in self._items:
+            self._append_log(topic, payload)
+        self._items.clear()
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._commit(force=True)
+        self._log.close()
+        self._log = None
+
+    def _scan_complete_records(self):
+        """Returns the end offset of the last complete record in the log."""
+        try:
+            f = open(self.spill_path, "rb")
+        except FileNotFoundError:
+            return 0
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            offset = 0
+            while offset + _RECORD_HEADER.size <= size:
+                f.seek(offset)
+                topic_len, payload_len = _RECORD_HEADER.unpack(f.read(_RECORD_HEADER.size))
+                record_end = offset + _RECORD_HEADER.size + topic_len + payload_len
+                if record_end > size:
+                    break
+                offset = record_end
+            return offset
+
+    def _append_log(self, topic, payload):
+        topic_bytes = topic.encode()
+        self._log.write(_RECORD_HEADER.pack(len(topic_bytes), len(payload)) + topic_bytes + bytes(payload))
+        self._log.flush() # Visible to the worker's reader, and to a restarted process
+        self._write_offset = self._log.tell()
+        self.spilled += 1
+        self._cond.notify_all()
+
+    def _replay_log(self, end, max_records=256):
+        """Handles up to `max_records` spilled records between the read offset and `end`.
+
+        Records are read through a private handle, outside the lock, only
+        below `end` (already flushed); the shared log handle is touched
+        under _cond only, and stays open while this worker runs.
+        """
+        offset = self._read_offset
+        with open(self.spill_path, "rb") as f:
+            f.seek(offset)
+            for _ in range(max_records):
+                if offset + _RECORD_HEADER.size > end:
+                    break
+                topic_len, payload_len = _RECORD_HEADER.unpack(f.read(_RECORD_HEADER.size))
+                topic = f.read(topic_len).decode()
+                payload = f.read(payload_len)
+                offset += _RECORD_HEADER.size + topic_len + payload_len
+                self._handle(topic, payload)
+                self.replayed += 1
+
+        with self._cond:
+            self._read_offset = offset
+            if self._read_offset >= self._write_offset:
+                # Caught up: empty the log and go back to the in-memory queue
+                self._log.seek(0)
+                self._log.truncate()
+                self._write_offset = self._read_offset = 0
+                self._spilling = False
+                self._commit(force=True)
+            else:
+                self._commit()
+
+    def _commit_path(self):
+        return self.spill_path + ".offset"
+
+    def _read_commit(self):
+        try:
+            with open(self._commit_path()) as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _commit(self, force=False):
+        """Persists the read offset (atomically), at most every commit_interval_s unless forced."""
+        now = time.monotonic()
+        if not force and now - self._last_commit < self.commit_interval_s:
+            return
+        tmp_path = self._commit_path() + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self._read_offset))
+        os.replace(tmp_path, self._commit_path())
+        self._last_commit = now
+
+    def stats(self):
+        return {
+            "policy": self.policy,
+            "maxsize": self.maxsize,
+            "depth": len(self._items),
+            "spill_backlog_bytes": self.spill_backlog_bytes(),
+            "received": self.received,
+            "handled": self.handled,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "replayed": self.replayed,
+            "errors": self.errors,
+            "blocked_seconds": self.blocked_seconds,
+        }
@@ -0,0 +1,189 @@
+# app/metrics.py
+
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Sharded:
+    """Per-thread value storage: writers never share a slot, so updates need no lock.
+
+    Each thread gets its own list on first use (the only locked step); readers
+    sum over all shards. Shards of threads that have exited are folded into a
+    base total (on scrape, and when a new thread registers), so short-lived
+    threads such as retrains do not grow the list. A scrape may miss an
+    update that is in flight, never one that completed.
+    """
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._base = [0] * size # Totals of threads that have exited
+        self._shards = [] # (thread, shard) of live writers
+        self._shards_lock = threading.Lock()
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = [0] * self._size
+            with self._shards_lock:
+                self._fold_dead()
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _fold_dead(self):
+        """Moves the shards of exited threads into the base total (with _shards_lock held)."""
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                self._base = [a + b for a, b in zip(self._base, shard)] # Its thread can no longer write to it
+        self._shards = live
+
+    def _totals(self):
+        with self._shards_lock:
+            self._fold_dead()
+            shards = [self._base] + [shard for _, shard in self._shards]
+        return [sum(values) for values in zip(*shards)]
+
+
+class Counter(_Sharded):
+    """Monotonically increasing count (e.g. messages received).
+
+    With `fn` the count is read from an existing total at scrape time instead.
+    """
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, fn=None):
+        super().__init__(1)
+        self.name = name
+        self.documentation = documentation
+        self._fn = fn
+
+    def inc(self, amount=1):
+        self._shard()[0] += amount
+
+    def value(self):
+        return self._fn() if self._fn is not None else self._totals()[0]
+
+    def samples(self):
+        return [(self.name, self.value())]
+
+
+class Gauge:
+    """Current value; either `set()` by the service or computed by `fn` at scrape time."""
+
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, fn=None):
+        self.name = name
+        self.documentation = documentation
+        self._fn = fn
+        self._value = 0.0
+
+    def set(self, value):
+        self._value = value # A single reference assignment
+
+    def value(self):
+        return self._fn() if self._fn is not None else self._value
+
+    def samples(self):
+        value = self.value()
+        return [(self.name, value)] if value is not None else []
+
+
+class Histogram(_Sharded):
+    """Distribution of observations in cumulative buckets, plus their sum and count."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        # Shard layout: one slot per bucket, +Inf, sum, count
+        super().__init__(len(self.buckets) + 3)
+        self.name = name
+        self.documentation = documentation
+
+    def observe(self, value):
+        shard = self._shard()
+        shard[bisect.bisect_left(self.buckets, value)] += 1
+        shard[-2] += value
+        shard[-1] += 1
+
+    def count(self):
+        return self._totals()[-1]
+
+    def samples(self):
+        totals = self._totals()
+        samples, cumulative = [], 0
+        for bound, n in zip(self.buckets + (float("inf"),), totals):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            samples.append((f'{self.name}_bucket{{le="{le}"}}', cumulative))
+        samples.append((f"{self.name}_sum", totals[-2]))
+        samples.append((f"{self.name}_count", totals[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    """Ordered collection of metrics rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, fn=None):
+        return self.register(Counter(name, documentation, fn))
+
+    def gauge(self, name, documentation, fn=None):
+        return self.register(Gauge(name, documentation, fn))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                # A broken gauge callback must not take the whole scrape down
+                print(f"Metrics: Could not collect {metric.name}: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(f"{name} {float(value)!r}" for name, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+def start_metrics_server(registry, port, host="0.0.0.0"):
+    """Serves `registry` at http://<host>:<port>/metrics from a daemon thread. Returns the server."""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # One line per scrape would drown the service's own logs
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
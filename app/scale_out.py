@@ -0,0 +1,115 @@
+# app/scale_out.py
+
+import json
+import threading
+import time
+from common.partitioning import PARTITION_TOPIC, assign_partitions
+
+
+class PartitionMembership:
+    """Splits the partitioned sensor topics between edge replicas over MQTT.
+
+    Each replica announces itself with a retained message on
+    `<group>/members/<replica_id>`, which its will clears if it dies, and
+    watches the others. From the same member set every replica computes the
+    same rendezvous assignment and subscribes to its own partitions through
+    MQTT v5 shared subscriptions (`$share/<group>-pNNN/+/sensors/pNNN`), so
+    a device's readings, and its lag state, stay on one replica. While a
+    partition is handed over both replicas are briefly in its share group;
+    the broker still delivers each message to only one of them.
+
+    After connecting, a replica takes no partitions until it has seen the
+    others: the broker sends the retained presences on subscribe, before the
+    echo of this replica's own announcement, so the first assignment waits
+    for that echo (or `settle_s`, whichever comes first) instead of briefly
+    claiming every partition.
+    """
+
+    def __init__(self, replica_id, n_partitions, group="edge", qos=0, settle_s=2.0):
+        self.replica_id = replica_id
+        self.n_partitions = n_partitions
+        self.group = group
+        self.qos = qos
+        self.settle_s = settle_s
+        self.members = {replica_id}
+        self.owned = set()
+        self.rebalances = 0
+        self._client = None
+        self._lock = threading.Lock()
+        self._settled = False
+        self._announcement = None # Payload of this session's presence, to recognise its echo
+        self._settle_timer = None
+
+    @property
+    def presence_topic(self):
+        return f"{self.group}/members/{self.replica_id}"
+
+    def share_topic(self, partition):
+        return f"$share/{self.group}-p{partition:03d}/{PARTITION_TOPIC.format(partition)}"
+
+    def attach(self, client):
+        """Sets the presence-clearing will and the membership callback. Call before connect()."""
+        self._client = client
+        client.will_set(self.presence_topic, b"", qos=1, retain=True)
+        client.message_callback_add(f"{self.group}/members/+", self._on_member_message)
+
+    def on_connect(self, client):
+        """Announces this replica and subscribes to its partitions. Call from on_connect."""
+        presence = json.dumps({"replica": self.replica_id, "since": time.time()})
+        with self._lock:
+            self.owned = set() # A clean start drops the old subscriptions
+            self._settled = False
+            self._announcement = presence.encode()
+        client.subscribe(f"{self.group}/members/+", qos=1)
+        client.publish(self.presence_topic, presence, qos=1, retain=True)
+        if self._settle_timer is not None:
+            self._settle_timer.cancel()
+        self._settle_timer = threading.Timer(self.settle_s, self._settle)
+        self._settle_timer.daemon = True
+        self._settle_timer.start()
+
+    def leave(self, client):
+        """Disconnects so that the broker publishes the will: the others take over at once."""
+        from paho.mqtt.packettypes import PacketTypes
+        from paho.mqtt.reasoncodes import ReasonCode
+        client.disconnect(reasoncode=ReasonCode(PacketTypes.DISCONNECT, "Disconnect with will message"))
+
+    def _on_member_message(self, client, userdata, msg):
+        replica_id = msg.topic.rsplit("/", 1)[1]
+        with self._lock:
+            if msg.payload:
+                self.members.add(replica_id)
+            elif replica_id != self.replica_id:
+                self.members.discard(replica_id)
+            echo = replica_id == self.replica_id and msg.payload == self._announcement
+        if echo:
+            self._settle()
+        else:
+            self._rebalance()
+
+    def _settle(self):
+        """Ends the settle period and takes this replica's share of the partitions."""
+        with self._lock:
+            if self._settled:
+                return
+            self._settled = True
+        self._rebalance()
+
+    def _rebalance(self):
+        """Subscribes to newly owned partitions and drops the ones now owned by others."""
+        with self._lock:
+            if not self._settled:
+                return # Membership still arriving; _settle() does the first assignment
+            owned = set(assign_partitions(self.members, self.n_partitions)[self.replica_id])
+            added, removed = sorted(owned - self.owned), sorted(self.owned - owned)
+            self.owned = owned
+        if not added and not removed:
+            return
+        client = self._client
+        if added:
+            client.subscribe([(self.share_topic(p), self.qos) for p in added])
+        if removed:
+            client.unsubscribe([self.share_topic(p) for p in removed])
+        self.rebalances += 1
+        print(f"Edge: {len(self.members)} replica(s); now owning {len(owned)}/{self.n_partitions} partitions "
+              f"(+{len(added)} -{len(removed)})")
@@ -0,0 +1,85 @@
+# app/shadow.py
+
+import time
+import numpy as np
+from app.error_stats import RollingErrorStats
+
+
+class ShadowEvaluator:
+    """Scores a candidate model against the active one on identical traffic.
+
+    Both models predict the same feature rows, so each reading gives a paired
+    difference of squared errors, d = e_candidate^2 - e_active^2. Once
+    `min_samples` readings are in, the candidate is promoted as soon as the
+    mean of d is confidently (by `z` standard errors) at most `tolerance`
+    times the active model's MSE, and rejected as soon as it is confidently
+    above it. At `max_samples` or `timeout_s` the point estimate decides; a
+    candidate that saw fewer than `min_samples` readings by then is rejected.
+
+    `candidate_errors` holds the candidate's rolling errors, so a promoted
+    model starts with a warm error buffer instead of an empty one.
+    """
+
+    def __init__(self, model, version, error_window, min_samples=200, max_samples=2000, timeout_s=600.0,
+                 tolerance=0.0, z=2.0):
+        self.model = model
+        self.version = version
+        self.min_samples = min_samples
+        self.max_samples = max(max_samples, min_samples)
+        self.timeout_s = timeout_s
+        self.tolerance = tolerance
+        self.z = z
+        self.active_errors = RollingErrorStats(error_window)
+        self.candidate_errors = RollingErrorStats(error_window)
+        self.started = time.monotonic()
+        self.n = 0
+        self._sum_d = 0.0
+        self._sum_d2 = 0.0
+        self._sum_active_sq = 0.0
+
+    def observe(self, actuals, active_predictions, candidate_predictions, now=None):
+        """Adds one batch of paired predictions. Returns "promote", "reject" or None (keep going)."""
+        actuals = np.asarray(actuals, dtype=np.float64)
+        active_sq = (actuals - np.asarray(active_predictions, dtype=np.float64)) ** 2
+        candidate_sq = (actuals - np.asarray(candidate_predictions, dtype=np.float64)) ** 2
+        d = candidate_sq - active_sq
+        self.n += len(d)
+        self._sum_d += float(d.sum())
+        self._sum_d2 += float(np.dot(d, d))
+        self._sum_active_sq += float(active_sq.sum())
+        for actual, active, candidate in zip(actuals, active_predictions, candidate_predictions):
+            self.active_errors.update(actual, active)
+            self.candidate_errors.update(actual, candidate)
+        return self.decide(now)
+
+    def _estimates(self):
+        """(mean of d, its standard error, allowed mean of d)."""
+        mean_d = self._sum_d / self.n
+        var_d = max(self._sum_d2 / self.n - mean_d * mean_d, 0.0)
+        std_err = np.sqrt(var_d / max(self.n - 1, 1))
+        return mean_d, std_err, self.tolerance * self._sum_active_sq / self.n
+
+    def decide(self, now=None):
+        now = time.monotonic() if now is None else now
+        out_of_time = now - self.started >= self.timeout_s
+        if self.n < self.min_samples:
+            return "reject" if out_of_time else None
+        mean_d, std_err, allowed = self._estimates()
+        if mean_d + self.z * std_err <= allowed:
+            return "promote"
+        if mean_d - self.z * std_err > allowed:
+            return "reject"
+        if self.n >= self.max_samples or out_of_time:
+            return "promote" if mean_d <= allowed else "reject"
+        return None
+
+    def stats(self):
+        active_mse = self._sum_active_sq / self.n if self.n else None
+        return {
+            "version": self.version,
+            "samples": self.n,
+            "elapsed_s": round(time.monotonic() - self.started, 1),
+            "active_rmse": round(self.active_errors.rmse(), 3) if len(self.active_errors) else None,
+            "candidate_rmse": round(self.candidate_errors.rmse(), 3) if len(self.candidate_errors) else None,
+            "mse_change": round(self._sum_d / self.n / active_mse, 4) if active_mse else None, # Relative to the active model
+        }
@@ -0,0 +1,125 @@
+# app/state_writer.py
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+
+class StateWriter:
+    """Publishes the pipeline state for the dashboard without slowing the hot path.
+
+    Updates are coalesced: `publish()` writes at most once every `interval_s`
+    and otherwise only records that a newer state is pending, which the
+    background thread (see `start()`) writes once the interval has passed.
+    Files are written to a temp file and renamed over the target so readers
+    never see torn JSON. If `socket_path` is set, the latest state is also
+    served over a local UNIX socket so readers can skip the disk entirely.
+    """
+
+    def __init__(self, path, interval_s=1.0, socket_path=None):
+        self.path = path
+        self.interval_s = interval_s
+        self.socket_path = socket_path
+        self._tmp_path = f"{path}.{os.getpid()}.tmp"
+        self._lock = threading.Lock()
+        self._pending_fn = None
+        self._last_write_ts = 0.0
+        self._latest_bytes = b"{}"
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._server = None
+        self.writes = 0
+        self._dir_ready = False
+
+    def publish(self, build_state):
+        """Writes `build_state()` now if the interval has passed, else defers it.
+
+        `build_state` is only called when a write actually happens.
+        """
+        with self._lock:
+            if time.monotonic() - self._last_write_ts >= self.interval_s:
+                self._write_locked(build_state())
+            else:
+                self._pending_fn = build_state
+
+    def flush(self):
+        """Writes the pending state, if any, immediately."""
+        with self._lock:
+            if self._pending_fn is not None:
+                self._write_locked(self._pending_fn())
+
+    def _write_locked(self, state):
+        data = json.dumps(state, default=float).encode()
+        if not self._dir_ready:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._dir_ready = True
+        with open(self._tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(self._tmp_path, self.path)
+        self._latest_bytes = data
+        self._pending_fn = None
+        self._last_write_ts = time.monotonic()
+        self.writes += 1
+
+    def latest_bytes(self):
+        return self._latest_bytes
+
+    def start(self):
+        """Starts the trailing-write thread and, if configured, the socket endpoint."""
+        if self._thread is None:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+            self._thread.start()
+        if self.socket_path and self._server is None:
+            self._start_socket_server()
+
+    def stop(self):
+        """Stops background threads and writes any pending state."""
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+        self.flush()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval_s):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"StateWriter: Error writing state: {e}")
+
+    def _start_socket_server(self):
+        writer = self
+
+        class _Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                self.request.sendall(writer.latest_bytes())
+
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path) # Stale socket from a previous run
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, _Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="state-socket", daemon=True).start()
+
+
+def read_state_socket(socket_path, timeout=0.5):
+    """Reads the latest state from a StateWriter socket endpoint."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b"".join(chunks))
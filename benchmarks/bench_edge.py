@@ -0,0 +1,482 @@
+# benchmarks/bench_edge.py
+"""Load-generation benchmark for the edge inference service.
+
+Drives `app/edge_infer.py`'s `on_message` with synthetic sensor readings from
+many devices and reports throughput, end-to-end latency (publish -> drift
+check), retrain latency (drift detected -> new model serving) and memory.
+
+Transports:
+  direct  call on_message from the load generator thread (pure handler cost)
+  fake    in-process broker with its own delivery thread, like paho's loop
+  mqtt    a real broker, e.g. a local Mosquitto (--broker host:port)
+
+Drift patterns: none (stable signal), step (level shift at --drift-at) and
+ramp (growing offset from --drift-at). Usage:
+  python benchmarks/bench_edge.py --devices 100 --rate 2000 --duration 10 --output results.json
+"""
+
+import argparse
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common.features import build_training_matrix
+
+TOPIC_TEMPLATE = "dev{:05d}/sensors"
+RETRAIN_TIMEOUT_S = 120
+# Edge module globals replaced during a run and restored afterwards
+EDGE_GLOBALS = (
+    "MODEL_DIR", "RETRAIN_COMMAND", "model_registry", "model", "model_version", "model_generation", "shadow",
+    "prediction_buffer", "buffer_generation", "rollback_watch", "drift_monitor", "device_store", "state_writer",
+    "inference_batcher", "handle_predictions", "trigger_retrain", "swap_model",
+)
+
+
+# --- Synthetic Load ---
+
+class LoadGenerator:
+    """Round-robin readings for `devices` sensors following a drift pattern.
+
+    Each device reports a noisy cycle around its own base level. Readings
+    requested with `drifting=True` get the pattern applied: `step` adds a
+    constant offset and `ramp` one that grows from the first drifting step.
+    """
+
+    def __init__(self, devices, pattern="none", seed=0):
+        if pattern not in ("none", "step", "ramp"):
+            raise ValueError(f"Unknown drift pattern {pattern!r}")
+        rng = np.random.default_rng(seed)
+        self.devices = devices
+        self.pattern = pattern
+        self.base = rng.uniform(120, 180, devices)
+        self.phase = rng.uniform(0, 2 * np.pi, devices)
+        self.rng = rng
+        self.sent = 0
+        self.drift_step = None
+
+    def voc(self, device, step, drifting):
+        value = self.base[device] + 40 * np.sin(2 * np.pi * step / 60 + self.phase[device]) + self.rng.normal(0, 5)
+        if drifting and self.pattern == "step":
+            value += 200
+        elif drifting and self.pattern == "ramp":
+            value += 0.5 * (step - self.drift_step)
+        return round(float(value), 2)
+
+    def series(self, device, n):
+        """`n` drift-free readings for one device (training data)."""
+        return np.array([self.voc(device, step, False) for step in range(n)])
+
+    def next(self, drifting=False):
+        """Returns (device index, topic, payload bytes) for the next reading."""
+        device = self.sent % self.devices
+        step = self.sent // self.devices
+        if drifting and self.drift_step is None:
+            self.drift_step = step
+        self.sent += 1
+        payload = {
+            "timestamp": datetime.now().isoformat(),
+            "temp_c": 22.5,
+            "humidity": 50.0,
+            "voc_ppb": self.voc(device, step, drifting),
+        }
+        return device, TOPIC_TEMPLATE.format(device), json.dumps(payload).encode()
+
+
+def train_model(model_dir, devices=20, n_per_device=300, seed=1):
+    """Trains a small model on drift-free synthetic data and registers it in `model_dir`."""
+    import joblib
+    import lightgbm as lgb
+    from app.edge_infer import FEATURE_SPEC, SHADOW_MIN_SAMPLES
+    from common.compiled_model import export_compiled_model
+    from common.model_registry import ModelRegistry
+
+    generator = LoadGenerator(devices, seed=seed)
+    matrices = [build_training_matrix({"voc_ppb": generator.series(d, n_per_device)}, FEATURE_SPEC)
+                for d in range(devices)]
+    X = np.concatenate([m[0] for m in matrices])
+    y = np.concatenate([m[1] for m in matrices])
+    model = lgb.LGBMRegressor(n_estimators=100, random_state=42, verbose=-1).fit(X, y)
+    model.feature_spec_ = FEATURE_SPEC.to_dict()
+
+    os.makedirs(model_dir, exist_ok=True)
+    version = f"bench_{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+    model_path = os.path.join(model_dir, f"{version}.joblib")
+    compiled_path = os.path.join(model_dir, f"{version}.npz")
+    joblib.dump(model, model_path)
+    export_compiled_model(model.booster_, compiled_path, FEATURE_SPEC.to_dict())
+    # Like cloud/train.py: a retrained version is a candidate until the edge promotes it
+    registry = ModelRegistry(model_dir)
+    registry.register(model_path, compiled_path=compiled_path, train_mode="benchmark",
+                      make_current=SHADOW_MIN_SAMPLES <= 0 or registry.current() is None)
+    return model_path
+
+
+# --- Transports ---
+
+class FakeMessage:
+    """The attributes of paho's MQTTMessage that the edge reads."""
+
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class FakeBroker:
+    """In-process stand-in for an MQTT broker.
+
+    `publish` enqueues; one delivery thread hands messages to the subscriber's
+    `on_message` in order, like a client's network loop. Only the '+' and '#'
+    wildcards of subscription filters are supported.
+    """
+
+    def __init__(self, maxsize=0):
+        self._queue = queue.Queue(maxsize)
+        self._subscriptions = []
+        self._thread = None
+        self.delivered = 0
+
+    def subscribe(self, topic_filter, on_message):
+        self._subscriptions.append((topic_filter.split("/"), on_message))
+
+    @staticmethod
+    def matches(filter_parts, topic):
+        topic_parts = topic.split("/")
+        for i, part in enumerate(filter_parts):
+            if part == "#":
+                return True
+            if i >= len(topic_parts) or part not in ("+", topic_parts[i]):
+                return False
+        return len(filter_parts) == len(topic_parts)
+
+    def publish(self, topic, payload):
+        self._queue.put(FakeMessage(topic, payload))
+
+    def backlog(self):
+        """Messages published but not yet fully handled."""
+        return self._queue.unfinished_tasks
+
+    def start(self):
+        self._thread = threading.Thread(target=self._deliver, name="fake-broker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _deliver(self):
+        while True:
+            msg = self._queue.get()
+            if msg is None:
+                self._queue.task_done()
+                return
+            for filter_parts, on_message in self._subscriptions:
+                if self.matches(filter_parts, msg.topic):
+                    on_message(None, None, msg)
+            self.delivered += 1
+            self._queue.task_done()
+
+
+class DirectTransport:
+    def __init__(self, on_message):
+        self.on_message = on_message
+
+    def publish(self, topic, payload):
+        self.on_message(None, None, FakeMessage(topic, payload))
+
+    def drain(self, timeout):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeBrokerTransport:
+    def __init__(self, on_message, topic_filter):
+        self.broker = FakeBroker()
+        self.broker.subscribe(topic_filter, on_message)
+        self.broker.start()
+
+    def publish(self, topic, payload):
+        self.broker.publish(topic, payload)
+
+    def drain(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self.broker.backlog() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        self.broker.stop()
+
+
+class MqttTransport:
+    """Publishes through a real broker; the edge subscribes with its own client."""
+
+    def __init__(self, on_message, topic_filter, host, port):
+        import paho.mqtt.client as mqtt
+        self.subscribed = threading.Event()
+        self.delivered = 0
+
+        def deliver(client, userdata, msg):
+            on_message(client, userdata, msg)
+            self.delivered += 1
+
+        self.edge_client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench_edge_{os.getpid()}")
+        self.edge_client.on_message = deliver
+        self.edge_client.on_subscribe = lambda *args: self.subscribed.set()
+        self.edge_client.connect(host, port)
+        self.edge_client.subscribe(topic_filter, qos=0)
+        self.edge_client.loop_start()
+        if not self.subscribed.wait(10):
+            raise RuntimeError(f"No SUBACK from broker {host}:{port}")
+
+        self.publisher = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"bench_publisher_{os.getpid()}")
+        self.publisher.max_queued_messages_set(0)
+        self.publisher.connect(host, port)
+        self.publisher.loop_start()
+        self.published = 0
+
+    def publish(self, topic, payload):
+        self.publisher.publish(topic, payload)
+        self.published += 1
+
+    def drain(self, timeout):
+        deadline = time.monotonic() + timeout
+        while self.delivered < self.published and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        for client in (self.publisher, self.edge_client):
+            client.loop_stop()
+            client.disconnect()
+
+
+# --- Measurement ---
+
+def memory_kb():
+    """Current and peak resident set size of this process, in KB."""
+    rss = {}
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    rss[line.split(":")[0]] = int(line.split()[1])
+    except OSError:
+        import resource
+        rss["VmHWM"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"rss_kb": rss.get("VmRSS"), "peak_rss_kb": rss.get("VmHWM")}
+
+
+def percentiles_ms(latencies):
+    if not latencies:
+        return {"p50": None, "p99": None, "max": None}
+    values = np.array(latencies) * 1000.0
+    return {"p50": float(np.percentile(values, 50)), "p99": float(np.percentile(values, 99)),
+            "max": float(values.max())}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_edge(edge, work_dir, devices, batch_size, batch_latency_ms):
+    """Points the edge module's globals at a scratch directory and fresh state."""
+    from app.batching import MicroBatcher
+    from app.device_state import DeviceStateStore
+    from app.drift import DriftMonitor
+    from app.error_stats import RollingErrorStats
+    from app.state_writer import StateWriter
+    from common.model_registry import ModelRegistry
+
+    model_dir = os.path.join(work_dir, "models")
+    edge.MODEL_DIR = model_dir
+    edge.model_registry = ModelRegistry(model_dir)
+    edge.model_cache.clear()
+    edge.model, edge.model_version, edge.shadow = None, "N/A", None
+    edge.prediction_buffer = RollingErrorStats(edge.PREDICTION_BUFFER_SIZE)
+    edge.drift_monitor = DriftMonitor.from_names(edge.DRIFT_DETECTORS, edge.DRIFT_DETECTOR_PARAMS,
+                                                 cooldown_s=edge.RETRAIN_COOLDOWN_S)
+    edge.device_store = DeviceStateStore(edge.FEATURE_SPEC.history_length, edge.PREDICTION_BUFFER_SIZE,
+                                         max_devices=max(devices, 1), n_channels=len(edge.FEATURE_SPEC.feature_cols),
+                                         on_evict=lambda device_id: edge.drift_monitor.forget(device_id))
+    edge.state_writer = StateWriter(os.path.join(work_dir, "state.json"), interval_s=edge.STATE_WRITE_INTERVAL_S)
+    edge.RETRAIN_COMMAND = f"{sys.executable} {os.path.abspath(__file__)} --train-only --model-dir {model_dir}"
+    edge.inference_batcher = None
+    if batch_size > 1:
+        edge.inference_batcher = MicroBatcher(
+            edge.predict_batch, edge.on_batch_predictions, edge.FEATURE_SPEC.n_features,
+            max_batch_size=batch_size, max_latency_ms=batch_latency_ms,
+        )
+        edge.inference_batcher.start()
+    if not edge.load_latest_model():
+        raise RuntimeError("Benchmark model failed to load")
+
+
+def run_benchmark(devices=100, rate=0.0, duration=5.0, pattern="none", drift_at=0.5, transport="fake",
+                  broker="localhost:1883", batch_size=64, batch_latency_ms=5.0, work_dir=None, seed=0):
+    """Runs one load test and returns the results as a dict.
+
+    `rate` is the total messages/sec across devices (0 = as fast as possible);
+    drift starts after `drift_at` of `duration` has elapsed.
+    """
+    import app.edge_infer as edge
+
+    own_work_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="bench_edge_")
+    train_model(os.path.join(work_dir, "models"))
+    memory_before = memory_kb()
+    saved_globals = {name: getattr(edge, name) for name in EDGE_GLOBALS}
+
+    # Publish times of messages that will be predicted, FIFO per device (the
+    # first history_length readings of a device only fill its lag window)
+    sent_times = defaultdict(deque)
+    latencies = []
+    retrain_started, retrain_latencies = [], []
+    original_handle, original_trigger, original_swap = edge.handle_predictions, edge.trigger_retrain, edge.swap_model
+
+    def timed_handle(contexts, predictions, shadow_scores=None):
+        original_handle(contexts, predictions, shadow_scores)
+        now = time.perf_counter()
+        for device_id, _ in contexts:
+            pending = sent_times.get(device_id)
+            if pending:
+                latencies.append(now - pending.popleft())
+
+    def timed_trigger():
+        started = original_trigger()
+        if started:
+            retrain_started.append(time.perf_counter())
+        return started
+
+    def timed_swap(new_model, new_version):
+        original_swap(new_model, new_version)
+        if retrain_started:
+            retrain_latencies.append(time.perf_counter() - retrain_started[-1])
+
+    try:
+        configure_edge(edge, work_dir, devices, batch_size, batch_latency_ms)
+        edge.handle_predictions, edge.trigger_retrain, edge.swap_model = timed_handle, timed_trigger, timed_swap
+        if transport == "direct":
+            sink = DirectTransport(edge.on_message)
+        elif transport == "fake":
+            sink = FakeBrokerTransport(edge.on_message, edge.MQTT_TOPIC_SENSORS)
+        elif transport == "mqtt":
+            host, _, port = broker.partition(":")
+            sink = MqttTransport(edge.on_message, edge.MQTT_TOPIC_SENSORS, host, int(port or 1883))
+        else:
+            raise ValueError(f"Unknown transport {transport!r}")
+
+        generator = LoadGenerator(devices, pattern, seed=seed)
+        history_length = edge.FEATURE_SPEC.history_length
+        interval = 1.0 / rate if rate > 0 else 0.0
+        start = time.perf_counter()
+        deadline = start + duration
+        drift_time = start + drift_at * duration
+        next_send = start
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if interval and now < next_send:
+                time.sleep(min(next_send - now, 0.001))
+                continue
+            device, topic, payload = generator.next(drifting=pattern != "none" and now >= drift_time)
+            if (generator.sent - 1) // devices >= history_length:
+                sent_times[topic.split("/", 1)[0]].append(time.perf_counter())
+            sink.publish(topic, payload)
+            next_send += interval
+        publish_elapsed = time.perf_counter() - start
+
+        sink.drain(timeout=30)
+        if edge.inference_batcher is not None:
+            edge.inference_batcher.flush()
+        processed_elapsed = time.perf_counter() - start
+        edge.wait_for_retrain(RETRAIN_TIMEOUT_S)
+        sink.close()
+
+        memory_after = memory_kb()
+        results = {
+            "commit": git_commit(),
+            "timestamp": datetime.now().isoformat(),
+            "config": {
+                "devices": devices, "rate": rate, "duration_s": duration, "pattern": pattern,
+                "drift_at": drift_at, "transport": transport, "batch_size": batch_size,
+                "batch_latency_ms": batch_latency_ms, "model_format": edge.MODEL_FORMAT,
+            },
+            "messages": generator.sent,
+            "predictions": len(latencies),
+            "publish_rate": generator.sent / publish_elapsed,
+            "throughput": generator.sent / processed_elapsed,
+            "latency_ms": percentiles_ms(latencies),
+            "retrains": len(retrain_started),
+            "retrain_latency_s": [round(t, 3) for t in retrain_latencies],
+            "memory": {
+                "before_kb": memory_before,
+                "after_kb": memory_after,
+                "device_state_bytes": edge.device_store.memory_bytes(),
+            },
+        }
+        if edge.inference_batcher is not None:
+            results["inference"] = edge.inference_batcher.stats()
+        return results
+    finally:
+        if edge.inference_batcher is not None:
+            edge.inference_batcher.stop()
+        for name, value in saved_globals.items():
+            setattr(edge, name, value)
+        edge.model_cache.clear()
+        if own_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=0.0, help="Total messages/sec; 0 = unthrottled")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load")
+    parser.add_argument("--pattern", choices=("none", "step", "ramp"), default="none")
+    parser.add_argument("--drift-at", type=float, default=0.5, help="Fraction of the run before drift starts")
+    parser.add_argument("--transport", choices=("direct", "fake", "mqtt"), default="fake")
+    parser.add_argument("--broker", default="localhost:1883", help="host:port for --transport mqtt")
+    parser.add_argument("--batch-size", type=int, default=64, help="1 disables micro-batching")
+    parser.add_argument("--batch-latency-ms", type=float, default=5.0)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--train-only", action="store_true", help="Train and register a model, then exit")
+    parser.add_argument("--model-dir", help="Model directory for --train-only")
+    args = parser.parse_args()
+
+    if args.train_only:
+        # Used as the edge's retrain command during the benchmark
+        train_model(args.model_dir, seed=int(time.time()))
+        return
+
+    results = run_benchmark(
+        devices=args.devices, rate=args.rate, duration=args.duration, pattern=args.pattern,
+        drift_at=args.drift_at, transport=args.transport, broker=args.broker,
+        batch_size=args.batch_size, batch_latency_ms=args.batch_latency_ms,
+    )
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# benchmarks/bench_model_format.py
+"""Compares the pickled (joblib) and compiled (NumPy) model artifacts.
+
+Reports cold-start time and peak RSS of a fresh interpreter that loads the
+model and predicts one row, plus in-process per-row latency for a few batch
+sizes. Usage: python benchmarks/bench_model_format.py [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from common.compiled_model import CompiledTreeModel, export_compiled_model
+
+COLD_START_SNIPPET = """
+import resource, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {root!r})
+import numpy as np
+if {fmt!r} == "joblib":
+    import joblib
+    model = joblib.load({path!r})
+else:
+    from common.compiled_model import CompiledTreeModel
+    model = CompiledTreeModel.load({path!r})
+model.predict(np.zeros((1, {n_features})))
+elapsed = time.perf_counter() - start
+# VmHWM resets on exec; ru_maxrss can include the parent's pre-exec peak
+peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+try:
+    with open("/proc/self/status") as f:
+        peak_kb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+except (OSError, StopIteration):
+    pass
+print(elapsed, peak_kb)
+"""
+
+
+def train_model(n_rows, n_features, n_estimators):
+    import lightgbm as lgb
+    rng = np.random.default_rng(42)
+    X = rng.uniform(50, 300, size=(n_rows, n_features))
+    y = X @ rng.uniform(0, 0.3, n_features) + rng.normal(0, 5, n_rows)
+    return lgb.LGBMRegressor(n_estimators=n_estimators, random_state=42, verbose=-1).fit(X, y)
+
+
+def cold_start(fmt, path, n_features, repeats):
+    """Median seconds and max RSS (KB) to import, load and predict in a new process."""
+    code = COLD_START_SNIPPET.format(root=ROOT, fmt=fmt, path=path, n_features=n_features)
+    times, rss = [], []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+        t, kb = out.split()
+        times.append(float(t))
+        rss.append(int(kb))
+    return {"cold_start_s": float(np.median(times)), "max_rss_kb": max(rss)}
+
+
+def per_row_latency(model, n_features, batch_size, min_rows=20000):
+    """Microseconds per predicted row at the given batch size."""
+    X = np.random.default_rng(0).uniform(50, 300, size=(batch_size, n_features))
+    model.predict(X) # Warm-up
+    n_calls = max(min_rows // batch_size, 50)
+    start = time.perf_counter()
+    for _ in range(n_calls):
+        model.predict(X)
+    return (time.perf_counter() - start) / (n_calls * batch_size) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n-features", type=int, default=5)
+    parser.add_argument("--n-estimators", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--batch-sizes", default="1,64,1024")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    import joblib
+    model = train_model(5000, args.n_features, args.n_estimators)
+    with tempfile.TemporaryDirectory() as tmp:
+        joblib_path = os.path.join(tmp, "model.joblib")
+        compiled_path = os.path.join(tmp, "model.npz")
+        joblib.dump(model, joblib_path)
+        export_compiled_model(model.booster_, compiled_path)
+        compiled = CompiledTreeModel.load(compiled_path)
+
+        results = {"n_features": args.n_features, "n_estimators": args.n_estimators, "formats": {}}
+        for fmt, path, loaded in (("joblib", joblib_path, model), ("compiled", compiled_path, compiled)):
+            entry = cold_start(fmt, path, args.n_features, args.repeats)
+            entry["artifact_bytes"] = os.path.getsize(path)
+            entry["us_per_row"] = {
+                int(b): per_row_latency(loaded, args.n_features, int(b)) for b in args.batch_sizes.split(",")
+            }
+            results["formats"][fmt] = entry
+
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
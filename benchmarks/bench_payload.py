@@ -0,0 +1,82 @@
+# benchmarks/bench_payload.py
+"""Compares the JSON and packed binary sensor payloads.
+
+For a few readings-per-message batch sizes, reports bytes per message and
+per reading, and microseconds per reading to encode (publisher side) and to
+decode into the edge's feature values. Usage:
+  python benchmarks/bench_payload.py [--batch-sizes 1,50,500] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from common.payload import decode_binary
+from devices.simulator import SensorSimulator, encode_readings
+
+FEATURE_COLS = ("voc_ppb",)
+
+
+def decode_json(payload):
+    """What the edge does per JSON message: parse, then pull out the feature values."""
+    data = json.loads(payload.decode())
+    readings = data if isinstance(data, list) else (data,)
+    return [[r[c] for c in FEATURE_COLS] for r in readings], [r.get("device_id") for r in readings]
+
+
+def decode_packed(payload):
+    device_ids, records = decode_binary(payload)
+    values = np.column_stack([records[c] for c in FEATURE_COLS]).astype(np.float64)
+    return values, device_ids
+
+
+def time_per_reading(fn, n_readings, min_seconds=0.2):
+    """Microseconds per reading for `fn()` handling `n_readings` readings per call."""
+    fn() # Warm-up
+    calls, start = 0, time.perf_counter()
+    while time.perf_counter() - start < min_seconds:
+        fn()
+        calls += 1
+    return (time.perf_counter() - start) / (calls * n_readings) * 1e6
+
+
+def measure(batch_size, payload_format):
+    simulator = SensorSimulator(batch_size, seed=0)
+    temp_c, humidity, voc_ppb = simulator.step(0.0)
+    timestamp = datetime(2025, 1, 1, 12).isoformat()
+    args = (timestamp, simulator.device_ids, temp_c, humidity, voc_ppb, batch_size, payload_format)
+    (_, payload), = encode_readings(*args)
+    payload = payload if isinstance(payload, bytes) else payload.encode()
+    decode = decode_packed if payload_format == "binary" else decode_json
+    return {
+        "bytes_per_message": len(payload),
+        "bytes_per_reading": len(payload) / batch_size,
+        "encode_us_per_reading": time_per_reading(lambda: list(encode_readings(*args)), batch_size),
+        "decode_us_per_reading": time_per_reading(lambda: decode(payload), batch_size),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-sizes", default="1,50,500")
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = {}
+    for batch_size in (int(b) for b in args.batch_sizes.split(",")):
+        results[batch_size] = {fmt: measure(batch_size, fmt) for fmt in ("json", "binary")}
+
+    print(json.dumps(results, indent=4))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+# cloud/mlflow_spool.py
+
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+# Make the project root importable when run as `python cloud/mlflow_spool.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.model_registry import ModelRegistry
+
+RECORD_NAME = "run.json"
+ARTIFACT_DIR = "artifacts"
+MAX_ATTEMPTS = 10 # A record refused this often is set aside as .failed-<id>
+FAILED_PREFIX = ".failed-"
+FAILED_RETRY_S = 3600.0 # Set-aside records get one more attempt per drain at most this often
+FAILED_RETENTION_S = 7 * 24 * 3600.0 # ...and are deleted, artifacts included, after this long
+# Disk cap for the whole spool: an outage may keep records pending for long (see _enforce_limit)
+MAX_SPOOL_BYTES = int(os.environ.get("MLFLOW_SPOOL_MAX_BYTES", 1 << 30))
+# MLflow's per-request limits for log_batch
+MAX_METRICS_PER_BATCH = 1000
+MAX_PARAMS_PER_BATCH = 100
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _write_record(record_dir, record):
+    tmp_path = os.path.join(record_dir, RECORD_NAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(record, f, indent=4)
+    os.replace(tmp_path, os.path.join(record_dir, RECORD_NAME))
+
+
+class SpooledRun:
+    """Collects what a training run logs to MLflow, for `drain()` to upload later.
+
+    Params, metrics (with their original timestamps and steps), tags and
+    artifacts are staged locally and published to `<spool_dir>/<record_id>/`
+    by `commit()`; nothing here talks to the tracking server, so a slow or
+    unreachable MLflow never delays the model. Use as a context manager to
+    commit on exit (a run that raised is uploaded with status FAILED).
+    """
+
+    def __init__(self, spool_dir, experiment, run_name=None):
+        self.spool_dir = spool_dir
+        # Time-prefixed so records sort, and upload, in creation order
+        self.record_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f_") + uuid.uuid4().hex[:6]
+        self._staging = os.path.join(spool_dir, ".tmp-" + self.record_id)
+        os.makedirs(self._staging)
+        self.record = {
+            "experiment": experiment,
+            "run_name": run_name,
+            "start_time": _now_ms(),
+            "end_time": None,
+            "status": "FINISHED",
+            "params": {},
+            "metrics": [], # [key, value, timestamp_ms, step]
+            "tags": {"spool_id": self.record_id},
+            "model": None,
+            "registry": None,
+            "run_id": None, # Set once the run exists on the server, so retries reuse it
+            "uploaded": [], # Upload steps already done
+            "attempts": 0,
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.record["status"] = "FAILED"
+        self.commit()
+
+    def log_param(self, key, value):
+        self.record["params"][key] = str(value) # MLflow stores params as strings
+
+    def log_params(self, params):
+        for key, value in params.items():
+            self.log_param(key, value)
+
+    def log_metric(self, key, value, step=0):
+        self.record["metrics"].append([key, float(value), _now_ms(), step])
+
+    def set_tag(self, key, value):
+        self.record["tags"][key] = str(value)
+
+    def log_dict(self, dictionary, artifact_file):
+        path = os.path.join(self._staging, ARTIFACT_DIR, artifact_file)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(dictionary, f, indent=4, default=str)
+
+    def log_model(self, model_path, artifact_path="model", registered_model_name=None, flavor="sklearn"):
+        """Spools a joblib model for `mlflow.<flavor>.log_model` (copied: retention may delete the original)."""
+        file_name = os.path.basename(model_path)
+        shutil.copy2(model_path, os.path.join(self._staging, file_name))
+        self.record["model"] = {"file": file_name, "artifact_path": artifact_path,
+                                "registered_model_name": registered_model_name, "flavor": flavor}
+
+    def link_registry(self, model_dir, version):
+        """After upload, the registry entry of `version` gets the MLflow run id."""
+        self.record["registry"] = {"model_dir": model_dir, "version": version}
+
+    def commit(self):
+        """Publishes the record atomically, then trims the spool to MAX_SPOOL_BYTES; returns its directory."""
+        self.record["end_time"] = _now_ms()
+        _write_record(self._staging, self.record)
+        record_dir = os.path.join(self.spool_dir, self.record_id)
+        os.rename(self._staging, record_dir)
+        with _spool_lock(self.spool_dir) as locked:
+            if locked: # Else a drain is running and trims it
+                _enforce_limit(self.spool_dir)
+        return record_dir
+
+
+def pending_records(spool_dir):
+    """Committed record directories, oldest first."""
+    try:
+        names = sorted(os.listdir(spool_dir))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(spool_dir, n) for n in names
+            if not n.startswith(".") and os.path.exists(os.path.join(spool_dir, n, RECORD_NAME))]
+
+
+@contextmanager
+def _spool_lock(spool_dir):
+    """Yields True if this process now holds the spool's drain lock, False if another holder has it."""
+    os.makedirs(spool_dir, exist_ok=True)
+    with open(os.path.join(spool_dir, ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+
+def _dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _drop_artifacts(record_dir):
+    """Deletes a record's model copy and logged artifacts, keeping its params and metrics; returns the bytes freed."""
+    before = _dir_bytes(record_dir)
+    path = os.path.join(record_dir, RECORD_NAME)
+    with open(path) as f:
+        record = json.load(f)
+    if record["model"] is not None:
+        os.remove(os.path.join(record_dir, record["model"]["file"]))
+        record["model"] = None
+    shutil.rmtree(os.path.join(record_dir, ARTIFACT_DIR), ignore_errors=True)
+    record["tags"]["spool_artifacts_dropped"] = "true"
+    _write_record(record_dir, record)
+    return before - _dir_bytes(record_dir)
+
+
+def _enforce_limit(spool_dir, max_bytes=None):
+    """Keeps the committed records under `max_bytes` (with the spool lock held).
+
+    Over the cap, space is freed oldest first: set-aside records are deleted,
+    then pending records lose their model and artifact copies (their params
+    and metrics still upload), and only then are whole pending records
+    deleted. Returns the bytes freed.
+    """
+    max_bytes = MAX_SPOOL_BYTES if max_bytes is None else max_bytes
+    failed, pending = failed_records(spool_dir), pending_records(spool_dir)
+    total = sum(_dir_bytes(r) for r in failed + pending)
+    excess = total - max_bytes
+    if excess <= 0:
+        return 0
+    freed = dropped_failed = 0
+    for record_dir in failed:
+        if freed >= excess:
+            break
+        freed += _dir_bytes(record_dir)
+        shutil.rmtree(record_dir, ignore_errors=True)
+        dropped_failed += 1
+    compacted = 0
+    for record_dir in pending:
+        if freed >= excess:
+            break
+        released = _drop_artifacts(record_dir)
+        freed += released
+        compacted += released > 0
+    deleted = 0
+    for record_dir in pending:
+        if freed >= excess:
+            break
+        freed += _dir_bytes(record_dir)
+        shutil.rmtree(record_dir, ignore_errors=True)
+        deleted += 1
+    print(f"Trainer: MLflow spool was {total / 1e6:.1f} MB (cap {max_bytes / 1e6:.1f} MB); freed {freed / 1e6:.1f} MB "
+          f"by dropping {dropped_failed} set-aside run(s), the artifacts of {compacted} pending run(s) "
+          f"and {deleted} whole pending run(s).")
+    return freed
+
+
+def upload_record(record_dir, client):
+    """Uploads one spooled run, then deletes the record.
+
+    Progress is saved in the record after each step, so a retry after a
+    failure continues on the same MLflow run instead of duplicating it.
+    """
+    import mlflow
+    from mlflow.entities import Metric, Param, RunTag
+
+    with open(os.path.join(record_dir, RECORD_NAME)) as f:
+        record = json.load(f)
+
+    if record["run_id"] is None:
+        experiment = client.get_experiment_by_name(record["experiment"])
+        experiment_id = experiment.experiment_id if experiment else client.create_experiment(record["experiment"])
+        tags = dict(record["tags"], **({"mlflow.runName": record["run_name"]} if record["run_name"] else {}))
+        run = client.create_run(experiment_id, start_time=record["start_time"], tags=tags)
+        record["run_id"] = run.info.run_id
+        _write_record(record_dir, record)
+    run_id = record["run_id"]
+
+    def step(name, fn):
+        if name not in record["uploaded"]:
+            fn()
+            record["uploaded"].append(name)
+            _write_record(record_dir, record)
+
+    def log_data():
+        params = [Param(k, v) for k, v in record["params"].items()]
+        metrics = [Metric(*m) for m in record["metrics"]]
+        for i in range(0, len(params), MAX_PARAMS_PER_BATCH):
+            client.log_batch(run_id, params=params[i:i + MAX_PARAMS_PER_BATCH])
+        for i in range(0, len(metrics), MAX_METRICS_PER_BATCH):
+            client.log_batch(run_id, metrics=metrics[i:i + MAX_METRICS_PER_BATCH])
+        client.log_batch(run_id, tags=[RunTag(k, v) for k, v in record["tags"].items()])
+
+    def log_artifacts():
+        artifact_dir = os.path.join(record_dir, ARTIFACT_DIR)
+        if os.path.isdir(artifact_dir):
+            client.log_artifacts(run_id, artifact_dir)
+
+    def log_model():
+        import importlib
+        import joblib
+        spec = record["model"]
+        if spec is None:
+            return
+        flavor = importlib.import_module(f"mlflow.{spec.get('flavor', 'sklearn')}") # Boosters use mlflow.lightgbm
+        model = joblib.load(os.path.join(record_dir, spec["file"]))
+        with mlflow.start_run(run_id=run_id):
+            flavor.log_model(model, spec["artifact_path"], registered_model_name=spec["registered_model_name"])
+
+    def link_registry():
+        link = record["registry"]
+        if link is None:
+            return
+        try:
+            ModelRegistry(link["model_dir"]).annotate(link["version"], mlflow_run_id=run_id)
+        except KeyError:
+            pass # Already removed by retention
+
+    step("data", log_data)
+    step("artifacts", log_artifacts)
+    step("model", log_model)
+    step("registry", link_registry)
+    client.set_terminated(run_id, record["status"], record["end_time"])
+    shutil.rmtree(record_dir)
+    return run_id
+
+
+def _counts_as_attempt(exc):
+    """True if `exc` means the server answered and refused the record, or the record itself is bad.
+
+    An unreachable or overloaded server (connection errors, timeouts, 5xx,
+    429) is an outage, not a fault of the record, and uses up no attempts.
+    """
+    import requests
+    from mlflow.exceptions import MlflowException
+    if isinstance(exc, (ConnectionError, TimeoutError, requests.exceptions.RequestException)):
+        return False
+    if isinstance(exc, MlflowException):
+        # Includes the client's own "API request failed" wrapper around connection errors (a 500)
+        status = exc.get_http_status_code()
+        return 400 <= status < 500 and status != 429
+    return True
+
+
+def _record_failure(record_dir, exc):
+    """Counts a refused attempt; past MAX_ATTEMPTS the record is set aside so it cannot block the rest."""
+    if not _counts_as_attempt(exc):
+        return
+    path = os.path.join(record_dir, RECORD_NAME)
+    with open(path) as f:
+        record = json.load(f)
+    record["attempts"] += 1
+    if record["attempts"] >= MAX_ATTEMPTS:
+        record["failed_at"] = time.time()
+    _write_record(record_dir, record)
+    if record["attempts"] >= MAX_ATTEMPTS:
+        head, name = os.path.split(record_dir)
+        os.rename(record_dir, os.path.join(head, FAILED_PREFIX + name))
+        print(f"Trainer: Gave up uploading {name} after {MAX_ATTEMPTS} attempts.")
+
+
+def failed_records(spool_dir):
+    """Record directories set aside after MAX_ATTEMPTS, oldest first."""
+    try:
+        names = sorted(os.listdir(spool_dir))
+    except FileNotFoundError:
+        return []
+    return [os.path.join(spool_dir, n) for n in names
+            if n.startswith(FAILED_PREFIX) and os.path.exists(os.path.join(spool_dir, n, RECORD_NAME))]
+
+
+def _retry_failed(spool_dir, client, now=None):
+    """Gives each set-aside record one attempt if FAILED_RETRY_S has passed since its last one.
+
+    Records set aside longer than FAILED_RETENTION_S are deleted with their
+    artifacts and model copy. Returns the number of runs uploaded.
+    """
+    now = time.time() if now is None else now
+    uploaded = 0
+    for record_dir in failed_records(spool_dir):
+        path = os.path.join(record_dir, RECORD_NAME)
+        with open(path) as f:
+            record = json.load(f)
+        name = os.path.basename(record_dir)[len(FAILED_PREFIX):]
+        if now - record.get("failed_at", os.path.getmtime(path)) > FAILED_RETENTION_S:
+            shutil.rmtree(record_dir, ignore_errors=True)
+            print(f"Trainer: Deleted spooled run {name}, which could not be uploaded for {FAILED_RETENTION_S / 86400:.0f} days.")
+            continue
+        if now - os.path.getmtime(path) < FAILED_RETRY_S:
+            continue
+        try:
+            upload_record(record_dir, client)
+            uploaded += 1
+        except Exception as e:
+            os.utime(path) # Next retry no sooner than FAILED_RETRY_S from now
+            print(f"Trainer: Set-aside run {name} still fails to upload ({e}).")
+    return uploaded
+
+
+def drain(spool_dir, tracking_uri, timeout_s=600.0, retry_s=5.0, max_retry_s=60.0):
+    """Uploads spooled runs oldest first until the spool is empty or `timeout_s` runs out.
+
+    Failures are retried with exponential backoff; whatever is left stays
+    spooled for the next drain. Only a record the server refused MAX_ATTEMPTS
+    times is set aside; those get one more attempt per FAILED_RETRY_S once
+    the spool is empty. Only one process drains a spool at a time (another
+    caller returns 0 at once). Returns the number of runs uploaded.
+    """
+    with _spool_lock(spool_dir) as locked:
+        if not locked:
+            return 0
+        _enforce_limit(spool_dir)
+        import mlflow
+        mlflow.set_tracking_uri(tracking_uri)
+        client = mlflow.tracking.MlflowClient(tracking_uri)
+        deadline = time.monotonic() + timeout_s
+        delay, uploaded = retry_s, 0
+        while True:
+            records = pending_records(spool_dir)
+            if not records:
+                uploaded += _retry_failed(spool_dir, client)
+                break
+            try:
+                upload_record(records[0], client)
+                uploaded += 1
+                delay = retry_s
+            except Exception as e:
+                _record_failure(records[0], e)
+                if time.monotonic() + delay > deadline:
+                    print(f"Trainer: MLflow upload failed ({e}); {len(records)} run(s) left in {spool_dir} for the next attempt.")
+                    break
+                print(f"Trainer: MLflow upload failed ({e}); retrying in {delay:.0f}s.")
+                time.sleep(delay)
+                delay = min(delay * 2, max_retry_s)
+    if uploaded:
+        print(f"Trainer: Uploaded {uploaded} spooled run(s) to MLflow.")
+    return uploaded
+
+
+def start_background_upload(spool_dir, tracking_uri, timeout_s=600.0):
+    """Drains the spool from a detached process, so the caller can exit right away."""
+    return subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--spool-dir", spool_dir,
+         "--tracking-uri", tracking_uri, "--timeout", str(timeout_s)],
+        start_new_session=True, # Outlives the trainer (and the edge's wait on it)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload spooled training runs to MLflow.")
+    parser.add_argument("--spool-dir", required=True)
+    parser.add_argument("--tracking-uri", required=True)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    args = parser.parse_args()
+    drain(args.spool_dir, args.tracking_uri, args.timeout)
@@ -0,0 +1,157 @@
+# cloud/out_of_core.py
+
+import os
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+from common.features import build_training_matrix
+
+
+class StreamingFeatureBuilder:
+    """Builds training rows chunk by chunk, with lags that reach across chunk boundaries.
+
+    For every device the last `history_length` readings of the previous
+    chunks are carried over and prepended to its next readings, so the rows
+    match what `build_training_matrix` gives on the device's whole history
+    while only one chunk (plus the small per-device carry) is in memory.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.columns = list(dict.fromkeys(spec.feature_cols + (spec.target_col,)))
+        self._carry = {} # device_id -> (timestamps, {column: values}) of its latest readings
+
+    def process(self, chunk):
+        """Returns (X, y, target timestamps) for the readings in `chunk`, ordered by target time."""
+        h = self.spec.history_length
+        groups = [(None, chunk)] if "device_id" not in chunk.columns else chunk.groupby("device_id", sort=False)
+        parts = []
+        for device_id, group in groups:
+            times = pd.to_datetime(group["timestamp"]).to_numpy()
+            values = {c: group[c].to_numpy(dtype=np.float64) for c in self.columns}
+            carry = self._carry.get(device_id)
+            if carry is not None:
+                times = np.concatenate([carry[0], times])
+                values = {c: np.concatenate([carry[1][c], values[c]]) for c in self.columns}
+            X, y = build_training_matrix(values, self.spec)
+            if len(y):
+                parts.append((X, y, times[h:]))
+            self._carry[device_id] = (times[-h:], {c: v[-h:] for c, v in values.items()})
+        if not parts:
+            return np.empty((0, self.spec.n_features)), np.empty(0), np.empty(0, dtype="datetime64[ns]")
+        X, y, times = (np.concatenate([p[i] for p in parts]) for i in range(3))
+        order = np.argsort(times, kind="stable")
+        return X[order], y[order], times[order]
+
+
+class FeatureFile:
+    """Appends (X, y, timestamps) chunks to flat files under `directory` and maps them back read-only."""
+
+    def __init__(self, directory, n_features):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.n_features = n_features
+        self.n_rows = 0
+        self._files = {name: open(self._path(name), "wb") for name in ("X", "y", "t")}
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.bin")
+
+    def append(self, X, y, times):
+        self._files["X"].write(np.ascontiguousarray(X, dtype=np.float64).tobytes())
+        self._files["y"].write(np.ascontiguousarray(y, dtype=np.float64).tobytes())
+        self._files["t"].write(np.asarray(times, dtype="datetime64[ns]").tobytes())
+        self.n_rows += len(y)
+
+    def finish(self):
+        """Closes the files and returns (X, y, times) as memory-mapped arrays."""
+        for f in self._files.values():
+            f.close()
+        if self.n_rows == 0:
+            return np.empty((0, self.n_features)), np.empty(0), np.empty(0, dtype="datetime64[ns]")
+        X = np.memmap(self._path("X"), dtype=np.float64, mode="r", shape=(self.n_rows, self.n_features))
+        y = np.memmap(self._path("y"), dtype=np.float64, mode="r", shape=(self.n_rows,))
+        times = np.memmap(self._path("t"), dtype="datetime64[ns]", mode="r", shape=(self.n_rows,))
+        return X, y, times
+
+
+def build_feature_file(chunks, spec, directory, sample_fraction=1.0, seed=42):
+    """Streams raw chunks through the lag builder into a FeatureFile; returns the mapped (X, y, times).
+
+    With `sample_fraction` < 1 a random share of the rows is kept (after the
+    lags are built, so every kept row still has its true history).
+    """
+    builder = StreamingFeatureBuilder(spec)
+    features = FeatureFile(directory, spec.n_features)
+    rng = np.random.default_rng(seed)
+    for chunk in chunks:
+        X, y, times = builder.process(chunk)
+        if sample_fraction < 1.0 and len(y):
+            keep = rng.random(len(y)) < sample_fraction
+            X, y, times = X[keep], y[keep], times[keep]
+        features.append(X, y, times)
+    return features.finish()
+
+
+class ArraySequence(lgb.Sequence):
+    """Row-range view of a 2-D array that LightGBM reads batch by batch.
+
+    Rows of a np.memmap are read from its file with pread instead of
+    through the mapping: pages touched through a mapping stay in the
+    process's RSS until the kernel needs them, which for a large feature
+    file would grow with its size.
+    """
+
+    def __init__(self, array, start=0, stop=None, batch_size=65536):
+        self.array = array
+        self.start = start
+        self.stop = len(array) if stop is None else stop
+        self.batch_size = batch_size
+        self._fd = None
+        if isinstance(array, np.memmap) and array.filename:
+            self._fd = os.open(array.filename, os.O_RDONLY)
+            self._row_bytes = array.dtype.itemsize * int(np.prod(array.shape[1:]))
+
+    def __del__(self):
+        if self._fd is not None:
+            os.close(self._fd)
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def _read(self, start, stop):
+        if self._fd is None:
+            return np.asarray(self.array[start:stop])
+        offset = self.array.offset + start * self._row_bytes
+        data = os.pread(self._fd, (stop - start) * self._row_bytes, offset)
+        return np.frombuffer(data, dtype=self.array.dtype).reshape((stop - start,) + self.array.shape[1:])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            return self._read(self.start + start, self.start + stop)[::step]
+        if isinstance(idx, (int, np.integer)):
+            return self._read(self.start + idx, self.start + idx + 1)[0]
+        return np.stack([self[int(i)] for i in idx])
+
+
+def train_booster(X, y, params=None, n_rows=None, init_model=None, batch_rows=65536):
+    """Trains LightGBM on the first `n_rows` rows of a mapped X/y without loading X into memory.
+
+    `params` uses the LGBMRegressor names (n_estimators is the number of
+    boosting rounds). LightGBM bins the rows as it reads them, so only
+    its compact binned copy of X is resident.
+    """
+    params = dict(params or {})
+    n_rows = len(y) if n_rows is None else n_rows
+    num_boost_round = params.pop("n_estimators", 100)
+    train_params = {"objective": "regression", "seed": params.pop("random_state", 42), "verbose": -1, **params}
+    dataset = lgb.Dataset(ArraySequence(X, 0, n_rows, batch_rows), label=np.asarray(y[:n_rows]), params=train_params)
+    return lgb.train(train_params, dataset, num_boost_round=num_boost_round, init_model=init_model)
+
+
+def predict_in_chunks(model, X, start=0, stop=None, chunk_rows=65536):
+    """Predictions for rows start:stop of a mapped X, one chunk in memory at a time."""
+    rows = ArraySequence(X, start, stop)
+    return np.concatenate([model.predict(rows[i:i + chunk_rows]) for i in range(0, len(rows), chunk_rows)]
+                          or [np.empty(0)])
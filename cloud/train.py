@@ -88,88 +88,387 @@
 
 import pandas as pd
 import numpy as np
-from sklearn.metrics import mean_squared_error
-import joblib
-import mlflow
-import mlflow.sklearn
 import os
-from datetime import datetime
-import lightgbm as lgb
+import argparse
+import json
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+import sys
 import time
 
+# Make the project root importable when run as `python cloud/train.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.compiled_model import export_compiled_model
+from common.features import FeatureSpec, build_training_matrix
+from common.model_registry import ModelRegistry
+from cloud.mlflow_spool import SpooledRun, drain, start_background_upload
+from cloud.tuning import PARAM_GRID, best_trial, run_search, sample_configs, time_series_folds
+
 # --- Configuration ---
+RAW_DATA_FORMAT = os.environ.get("RAW_DATA_FORMAT", "parquet") # "parquet" or legacy "csv"
+RAW_STORE_DIR = "data/raw"
 RAW_DATA_PATH = "data/raw.csv"
 MODEL_DIR = "models"
 MODEL_NAME = "voc_predictor"
+MODEL_RETENTION = int(os.environ.get("MODEL_RETENTION", 10)) # Model versions kept on disk
+# The edge vets new versions in shadow and makes them current itself (app/edge_infer.py)
+SHADOW_EVALUATION = int(os.environ.get("EDGE_SHADOW_MIN_SAMPLES", 200)) > 0
 N_LAGS = 5
-MLFLOW_TRACKING_URI = "http://mlflow:5001"
+FEATURE_SPEC = FeatureSpec(target_col="voc_ppb", feature_cols=("voc_ppb",), n_lags=N_LAGS) # Must match app/edge_infer.py
+MLFLOW_TRACKING_URI = os.environ.get("MLFLOW_TRACKING_URI", "http://mlflow:5001")
+MLFLOW_EXPERIMENT = "IoT VOC Prediction"
+MLFLOW_SPOOL_DIR = os.environ.get("MLFLOW_SPOOL_DIR", "data/mlflow_spool") # Runs waiting for upload
+MLFLOW_UPLOAD = os.environ.get("MLFLOW_UPLOAD", "background") # "background", "inline" or "off"
+MLFLOW_UPLOAD_TIMEOUT_S = float(os.environ.get("MLFLOW_UPLOAD_TIMEOUT_S", 600)) # Retry window per upload
+
+# --- Incremental (warm-start) Training ---
+TRAIN_MODE = os.environ.get("TRAIN_MODE", "auto") # "auto", "full" or "incremental"
+TRAIN_STATE_PATH = os.path.join(MODEL_DIR, "train_state.json") # Watermark of the last training
+INCREMENTAL_ROUNDS = 50 # Boosting rounds added per incremental run
+MIN_INCREMENTAL_ROWS = 20 # Fewer new rows than this falls back to a full retrain
+FULL_RETRAIN_EVERY = 10 # Incremental runs before a scheduled full retrain
+FULL_RETRAIN_INTERVAL_S = 6 * 3600
+INCREMENTAL_LOOKBACK = timedelta(hours=1) # History read before the watermark to rebuild lags
+
+# --- Hyperparameter Search ---
+TUNE = os.environ.get("TRAIN_TUNE", "0") == "1" # Search LightGBM settings on full retrains
+TUNE_TRIALS = int(os.environ.get("TUNE_TRIALS", 20))
+TUNE_LAGS = [int(n) for n in os.environ.get("TUNE_LAGS", str(N_LAGS)).split(",")] # Lag counts compared
+TUNE_FOLDS = int(os.environ.get("TUNE_FOLDS", 3)) # Expanding-window time-series folds
+TUNE_WORKERS = int(os.environ.get("TUNE_WORKERS", 0)) or None # 0 = one process per CPU
+TUNE_BUDGET_S = float(os.environ.get("TUNE_BUDGET_S", 300)) # Wall-clock cap, so drift retrains stay bounded
+
+# --- Out-of-core Training ---
+TRAIN_STREAMING = os.environ.get("TRAIN_STREAMING", "auto") # "auto" (by data size), "on" or "off"
+STREAMING_MIN_ROWS = int(os.environ.get("TRAIN_STREAMING_MIN_ROWS", 2_000_000)) # "auto" streams from this size
+TRAIN_CHUNK_ROWS = int(os.environ.get("TRAIN_CHUNK_ROWS", 200_000)) # Raw rows in memory at a time
+TRAIN_WINDOW_HOURS = float(os.environ.get("TRAIN_WINDOW_HOURS", 0)) # Train on the latest hours only (0 = all)
+TRAIN_SAMPLE_FRACTION = float(os.environ.get("TRAIN_SAMPLE_FRACTION", 1.0)) # Share of training rows kept
+FEATURE_CACHE_DIR = os.path.join("data", "train_cache") # Memory-mapped feature files, deleted after training
+CSV_BYTES_PER_ROW = 64 # Rough size of a raw CSV line, for the size estimate
+
+def load_raw_data(since=None):
+    """Loads the raw sensor history (optionally only rows at/after `since`) from the configured store."""
+    if RAW_DATA_FORMAT == "parquet":
+        from common.raw_store import RawDataReader # pyarrow: only loaded for the Parquet store
+        # Columnar read: only the columns training needs are decoded
+        columns = list(dict.fromkeys(["timestamp", "device_id"] + list(FEATURE_SPEC.feature_cols)))
+        reader = RawDataReader(RAW_STORE_DIR)
+        if since is not None:
+            return reader.read_range(start=since, columns=columns)
+        return reader.read_all(columns=columns)
+    df = pd.read_csv(RAW_DATA_PATH)
+    if since is not None:
+        df = df[pd.to_datetime(df["timestamp"]) >= since]
+    return df
+
+def iter_raw_chunks(since=None):
+    """Yields the raw history (optionally from `since`) as time-ordered chunks of TRAIN_CHUNK_ROWS rows."""
+    columns = list(dict.fromkeys(["timestamp", "device_id"] + list(FEATURE_SPEC.feature_cols)))
+    if RAW_DATA_FORMAT == "parquet":
+        from common.raw_store import RawDataReader
+        yield from RawDataReader(RAW_STORE_DIR).iter_batches(start=since, columns=columns, batch_rows=TRAIN_CHUNK_ROWS)
+        return
+    # The CSV is appended in time order, so its chunks already are; legacy files have no device_id
+    for chunk in pd.read_csv(RAW_DATA_PATH, usecols=lambda c: c in columns, parse_dates=["timestamp"],
+                             chunksize=TRAIN_CHUNK_ROWS):
+        if since is not None:
+            chunk = chunk[chunk["timestamp"] >= since]
+        if len(chunk):
+            yield chunk
+
+def raw_row_estimate():
+    """Approximate number of raw rows (Parquet footers, or the CSV's size), without reading the data."""
+    if RAW_DATA_FORMAT == "parquet":
+        from common.raw_store import RawDataReader
+        return RawDataReader(RAW_STORE_DIR).row_count()
+    try:
+        return os.path.getsize(RAW_DATA_PATH) // CSV_BYTES_PER_ROW
+    except FileNotFoundError:
+        return 0
+
+def use_streaming(requested=None):
+    requested = requested or TRAIN_STREAMING
+    return requested == "on" or (requested == "auto" and raw_row_estimate() >= STREAMING_MIN_ROWS)
+
+def sample_rows(X, y, times, fraction, seed=42):
+    """Keeps a random `fraction` of the training rows (all of them at 1.0), in their order."""
+    if fraction >= 1.0:
+        return X, y, times
+    keep = np.random.default_rng(seed).random(len(y)) < fraction
+    return X[keep], y[keep], times[keep]
+
+def next_watermark(times, split_index):
+    """Watermark after training on rows [:split_index]: just before the earliest held-out row.
+
+    The next incremental run then boosts on every row this run only
+    evaluated on, instead of skipping past the newest 20% for good.
+    """
+    return pd.Timestamp(np.min(times[split_index:])) - pd.Timedelta(1, "ns")
+
+def build_dataset(df, spec, since=None, return_times=False):
+    """Builds (X, y) with the shared feature builder, keeping each device's lags separate.
+
+    Rows are ordered by the time of their target reading across all devices,
+    so a positional split holds out the most recent window. If `since` is
+    given, only rows whose target reading is newer than it are kept; earlier
+    readings still serve as lag history. With `return_times` the target
+    timestamps are returned as a third array.
+    """
+    groups = [df] if "device_id" not in df.columns else [g for _, g in df.groupby("device_id", sort=False)]
+    parts = []
+    for group in groups:
+        X, y = build_training_matrix(group, spec)
+        target_ts = pd.to_datetime(group["timestamp"]).to_numpy()[spec.history_length:][:len(y)]
+        if since is not None:
+            keep = target_ts > np.datetime64(since)
+            X, y, target_ts = X[keep], y[keep], target_ts[keep]
+        parts.append((X, y, target_ts))
+    if len(parts) == 1:
+        X, y, times = parts[0]
+    else:
+        X, y, times = (np.concatenate([p[i] for p in parts]) for i in range(3))
+        order = np.argsort(times, kind="stable")
+        X, y, times = X[order], y[order], times[order]
+    return (X, y, times) if return_times else (X, y)
+
+def load_train_state():
+    try:
+        with open(TRAIN_STATE_PATH) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_train_state(state):
+    tmp_path = TRAIN_STATE_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(tmp_path, TRAIN_STATE_PATH)
+
+def latest_model_path():
+    """Returns the current model artifact (registry first, then newest file in MODEL_DIR), or None."""
+    registry = ModelRegistry(MODEL_DIR)
+    if registry.exists():
+        entry = registry.current()
+        return registry.path_of(entry) if entry else None
+    try:
+        model_files = [f for f in os.listdir(MODEL_DIR) if f.endswith(".joblib")]
+    except FileNotFoundError:
+        return None
+    if not model_files:
+        return None
+    return os.path.join(MODEL_DIR, max(model_files, key=lambda f: os.path.getctime(os.path.join(MODEL_DIR, f))))
+
+def choose_mode(requested, state, now=None):
+    """Resolves the training mode; incremental runs fall back to full when due or impossible."""
+    if requested == "full":
+        return "full"
+    now = now or datetime.now()
+    if not state.get("watermark") or not state.get("last_full_train") or latest_model_path() is None:
+        return "full"
+    if requested == "auto":
+        if state.get("incremental_runs", 0) >= FULL_RETRAIN_EVERY:
+            return "full"
+        if (now - datetime.fromisoformat(state["last_full_train"])).total_seconds() >= FULL_RETRAIN_INTERVAL_S:
+            return "full"
+    return "incremental"
+
+def tune_hyperparameters(df, lag_candidates=None, n_trials=None, n_workers=None, budget_s=None, before=None):
+    """Cross-validates sampled configurations on `df` and returns (best trial or None, all trials).
+
+    With `before`, only rows whose target reading is older than it are used,
+    so the test slice held out after it plays no part in choosing settings.
+    Only configurations with FEATURE_SPEC's lag count can be promoted, since
+    the edge rejects models built on other features; other lag counts are
+    compared so the spec can be changed deliberately.
+    """
+    lag_candidates = lag_candidates or TUNE_LAGS
+    datasets = {}
+    for n_lags in lag_candidates:
+        spec = FeatureSpec(FEATURE_SPEC.target_col, FEATURE_SPEC.feature_cols, n_lags, FEATURE_SPEC.rolling_windows)
+        X, y, times = build_dataset(df, spec, return_times=True)
+        if before is not None:
+            keep = times < np.datetime64(before)
+            X, y, times = X[keep], y[keep], times[keep]
+        datasets[n_lags] = (X, y, time_series_folds(times, TUNE_FOLDS))
+    configs = sample_configs(PARAM_GRID, lag_candidates, n_trials or TUNE_TRIALS)
+    start = time.time()
+    trials = run_search(datasets, configs, n_workers or TUNE_WORKERS, budget_s or TUNE_BUDGET_S)
+    complete = sum(t["complete"] for t in trials)
+    print(f"Trainer: Ran {len(trials)}/{len(configs)} trials ({complete} complete) in {time.time() - start:.1f}s.")
+
+    best = best_trial(trials, n_lags=FEATURE_SPEC.n_lags)
+    overall = best_trial(trials)
+    if overall is not None and overall is not best:
+        print(f"Trainer: {overall['n_lags']} lags scored better (CV RMSE {overall['cv_rmse']:.4f}); "
+              f"change N_LAGS on the trainer and the edge to use it.")
+    return best, trials
+
+def log_trials(run, trials):
+    """Logs every trial's CV RMSE (step = trial number; uploaded in batches) plus the full trial table."""
+    for t in trials:
+        if t["cv_rmse"] is not None:
+            run.log_metric("cv_rmse", t["cv_rmse"], step=t["trial"])
+    run.log_dict({"trials": trials}, "tuning/trials.json")
 
 def create_lag_features(df, target_col, n_lags):
-    df_lags = df.copy()
-    for i in range(1, n_lags + 1):
-        df_lags[f'{target_col}_lag_{i}'] = df_lags[target_col].shift(i)
-    df_lags = df_lags.dropna()
+    """DataFrame view of the shared lag builder: the target plus its lag columns."""
+    spec = FeatureSpec(target_col=target_col, feature_cols=(target_col,), n_lags=n_lags)
+    X, y = build_training_matrix(df, spec)
+    df_lags = pd.DataFrame(X, columns=spec.feature_names(), index=df.index[spec.history_length:])
+    df_lags.insert(0, target_col, y)
     return df_lags
 
 # --- Main Training Logic ---
 if __name__ == "__main__":
-    # MOVED CONNECTION LOGIC HERE (Protected from Pytest)
-    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
-    connected_to_mlflow = False
-    while not connected_to_mlflow:
-        try:
-            mlflow.search_experiments()
-            print("Trainer: Connected to MLflow Tracking Server.")
-            connected_to_mlflow = True
-        except Exception as e:
-            print(f"Trainer: MLflow server not ready ({e}). Retrying in 5 seconds...")
-            time.sleep(5)
-            
-    mlflow.set_experiment("IoT VOC Prediction")
-    
-    print("Starting model training process...")
+    # Loaded here so importing this module (e.g. for create_lag_features) stays free of LightGBM/sklearn
+    import joblib
+    import lightgbm as lgb
+    from cloud.out_of_core import build_feature_file, predict_in_chunks, train_booster
+
+    parser = argparse.ArgumentParser(description="Train the VOC predictor.")
+    parser.add_argument("--mode", choices=["auto", "full", "incremental"], default=TRAIN_MODE)
+    parser.add_argument("--tune", action="store_true", default=TUNE, help="Search hyperparameters on a full retrain.")
+    args = parser.parse_args()
+
+    train_state = load_train_state()
+    mode = choose_mode(args.mode, train_state)
+    model_params = train_state.get("params", {}) # Best settings of the last search, if any
+    print(f"Starting model training process (mode: {mode})...")
+
+    init_model, streaming, cache_dir = None, False, None
+    if mode == "incremental":
+        # Continue boosting from the deployed model on data since the watermark only
+        watermark = pd.Timestamp(train_state["watermark"])
+        df = load_raw_data(since=watermark - INCREMENTAL_LOOKBACK)
+        X, y, times = build_dataset(df, FEATURE_SPEC, since=watermark, return_times=True)
+        if len(X) < MIN_INCREMENTAL_ROWS:
+            print(f"Only {len(X)} new rows since {watermark}; falling back to a full retrain.")
+            mode = "full"
+        else:
+            init_path = latest_model_path()
+            init_model = joblib.load(init_path)
+            if getattr(init_model, "feature_spec_", None) != FEATURE_SPEC.to_dict():
+                print(f"{init_path} was trained on different features; falling back to a full retrain.")
+                init_model, mode = None, "full"
+            else:
+                print(f"Warm-starting from {init_path} with {len(X)} new rows.")
+
+    # The streamed feature files are removed however the run ends
     try:
-        df = pd.read_csv(RAW_DATA_PATH)
-        if len(df) < N_LAGS + 10:
-            print(f"Not enough data to train. Need at least {N_LAGS + 10} rows, but found {len(df)}.")
-            exit()
-    except FileNotFoundError:
-        print(f"Error: Data file not found at {RAW_DATA_PATH}. Run the publisher first.")
-        exit()
+        if mode == "full":
+            window_start = datetime.now() - timedelta(hours=TRAIN_WINDOW_HOURS) if TRAIN_WINDOW_HOURS else None
+            try:
+                streaming = use_streaming()
+                if streaming:
+                    # Out-of-core: features go chunk by chunk to memory-mapped files
+                    os.makedirs(FEATURE_CACHE_DIR, exist_ok=True)
+                    cache_dir = tempfile.mkdtemp(dir=FEATURE_CACHE_DIR)
+                    X, y, times = build_feature_file(iter_raw_chunks(since=window_start), FEATURE_SPEC, cache_dir,
+                                                     sample_fraction=TRAIN_SAMPLE_FRACTION)
+                    print(f"Streamed {len(y)} training rows to {cache_dir} in chunks of {TRAIN_CHUNK_ROWS}.")
+                    n_rows, min_rows = len(y), 10
+                else:
+                    df = load_raw_data(since=window_start)
+                    n_rows, min_rows = len(df), FEATURE_SPEC.history_length + 10
+                if n_rows < min_rows:
+                    print(f"Not enough data to train. Need at least {min_rows} rows, but found {n_rows}.")
+                    sys.exit(0)
+            except FileNotFoundError:
+                print(f"Error: Data file not found at {RAW_DATA_PATH}. Run the publisher first.")
+                sys.exit(1)
+            if not streaming:
+                X, y, times = sample_rows(*build_dataset(df, FEATURE_SPEC, return_times=True), TRAIN_SAMPLE_FRACTION)
+
+        # MLflow calls go to a local spool; the upload happens after the model is out
+        os.makedirs(MLFLOW_SPOOL_DIR, exist_ok=True)
+        with SpooledRun(MLFLOW_SPOOL_DIR, MLFLOW_EXPERIMENT) as run:
+            print(f"MLflow spool record: {run.record_id}")
+
+            split_index = int(len(X) * 0.8)
+            X_train, X_test = X[:split_index], X[split_index:]
+            y_train, y_test = y[:split_index], y[split_index:]
+
+            run.log_param("n_lags", N_LAGS)
+            run.log_param("feature_cols", ",".join(FEATURE_SPEC.feature_cols))
+            run.log_param("rolling_windows", ",".join(map(str, FEATURE_SPEC.rolling_windows)))
+            run.log_param("train_test_split_ratio", 0.8)
+            run.log_param("train_mode", mode)
+            run.log_param("train_rows", len(X_train))
+            run.log_param("streaming", streaming)
+            run.log_param("window_hours", TRAIN_WINDOW_HOURS)
+            run.log_param("sample_fraction", TRAIN_SAMPLE_FRACTION)
 
-    with mlflow.start_run() as run:
-        run_id = run.info.run_id
-        print(f"MLflow Run ID: {run_id}")
+            if mode == "full" and args.tune and streaming:
+                print("Trainer: Skipping the hyperparameter search on out-of-core data; using the current settings.")
+            elif mode == "full" and args.tune:
+                best, trials = tune_hyperparameters(df, before=np.min(times[split_index:])) # Training rows only
+                log_trials(run, trials)
+                if best is not None:
+                    model_params = best["params"]
+                    run.log_metric("best_cv_rmse", best["cv_rmse"])
+                    print(f"Trainer: Promoting trial {best['trial']} {model_params} (CV RMSE {best['cv_rmse']:.4f}).")
+                else:
+                    print("Trainer: No trial finished within the budget; keeping the current settings.")
+            run.log_params({f"lgbm_{k}": v for k, v in model_params.items()})
 
-        df_featured = create_lag_features(df, 'voc_ppb', N_LAGS)
-        features = [f'voc_ppb_lag_{i}' for i in range(1, N_LAGS + 1)]
-        target = 'voc_ppb'
-        X = df_featured[features]
-        y = df_featured[target]
+            # Fit on plain arrays so the edge can predict on NumPy rows without name checks
+            if init_model is not None:
+                model = lgb.LGBMRegressor(random_state=42, **dict(model_params, n_estimators=INCREMENTAL_ROUNDS))
+                model.fit(X_train, y_train, init_model=getattr(init_model, "booster_", init_model))
+            elif streaming:
+                # A LightGBM Booster: the rows are read from the mapped files in batches, never as one array
+                model = train_booster(X, y, dict(model_params, random_state=42), n_rows=split_index)
+            else:
+                model = lgb.LGBMRegressor(random_state=42, **model_params)
+                model.fit(X_train, y_train)
+            model.feature_spec_ = FEATURE_SPEC.to_dict() # Lets the edge verify it builds the same features
 
-        split_index = int(len(X) * 0.8)
-        X_train, X_test = X[:split_index], X[split_index:]
-        y_train, y_test = y[:split_index], y[split_index:]
+            predictions = predict_in_chunks(model, X, split_index) if streaming else model.predict(X_test)
+            rmse = np.sqrt(np.mean((np.asarray(y_test) - predictions) ** 2))
+            print(f"Model RMSE on test set: {rmse:.4f}")
 
-        mlflow.log_param("n_lags", N_LAGS)
-        mlflow.log_param("train_test_split_ratio", 0.8)
+            run.log_metric("rmse", rmse)
+            run.log_param("model_type", model.__class__.__name__)
 
-        model = lgb.LGBMRegressor(random_state=42)
-        model.fit(X_train, y_train)
+            os.makedirs(MODEL_DIR, exist_ok=True)
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            model_filename = f"{MODEL_NAME}-v{timestamp}.joblib"
+            model_path = os.path.join(MODEL_DIR, model_filename)
+            joblib.dump(model, model_path)
+            print(f"Model saved to: {model_path}")
 
-        predictions = model.predict(X_test)
-        rmse = np.sqrt(mean_squared_error(y_test, predictions))
-        print(f"Model RMSE on test set: {rmse:.4f}")
+            # Compiled NumPy copy for fast edge start-up and prediction
+            compiled_path = model_path.replace(".joblib", ".npz")
+            export_compiled_model(getattr(model, "booster_", model), compiled_path, FEATURE_SPEC.to_dict())
+            print(f"Compiled model saved to: {compiled_path}")
 
-        mlflow.log_metric("rmse", rmse)
-        mlflow.log_param("model_type", model.__class__.__name__)
+            # Index the new version; artifacts beyond MODEL_RETENTION are deleted. Under shadow
+            # evaluation it is only a candidate until the edge promotes it (the first model excepted)
+            registry = ModelRegistry(MODEL_DIR, keep=MODEL_RETENTION)
+            registry.register(
+                model_path, metrics={"rmse": float(rmse)}, compiled_path=compiled_path,
+                make_current=not SHADOW_EVALUATION or registry.current() is None,
+                train_mode=mode, mlflow_spool_id=run.record_id,
+            )
+            run.log_model(model_path, "model", registered_model_name=MODEL_NAME, flavor="lightgbm" if streaming else "sklearn")
+            run.link_registry(MODEL_DIR, os.path.splitext(model_filename)[0])
 
-        os.makedirs(MODEL_DIR, exist_ok=True)
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        model_filename = f"{MODEL_NAME}-v{timestamp}.joblib"
-        model_path = os.path.join(MODEL_DIR, model_filename)
-        joblib.dump(model, model_path)
-        print(f"Model saved to: {model_path}")
+            # Advance the watermark past the training slice; the held-out rows are trained on next time
+            save_train_state({
+                "watermark": next_watermark(times, split_index).isoformat(),
+                "last_full_train": datetime.now().isoformat() if mode == "full" else train_state["last_full_train"],
+                "incremental_runs": 0 if mode == "full" else train_state.get("incremental_runs", 0) + 1,
+                "model_path": model_path,
+                "params": model_params,
+            })
+    finally:
+        if cache_dir is not None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    print("Training process finished successfully.")
 
-        mlflow.sklearn.log_model(model, "model", registered_model_name=MODEL_NAME)
-    print("Training process finished successfully.")
\ No newline at end of file
+    if MLFLOW_UPLOAD == "inline":
+        drain(MLFLOW_SPOOL_DIR, MLFLOW_TRACKING_URI, MLFLOW_UPLOAD_TIMEOUT_S)
+    elif MLFLOW_UPLOAD == "background":
+        start_background_upload(MLFLOW_SPOOL_DIR, MLFLOW_TRACKING_URI, MLFLOW_UPLOAD_TIMEOUT_S)
@@ -0,0 +1,128 @@
+# cloud/tuning.py
+
+import itertools
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+
+# LightGBM settings searched; DEFAULT_PARAMS (LightGBM's own defaults) is always tried first
+PARAM_GRID = {
+    "n_estimators": [100, 200, 400],
+    "learning_rate": [0.03, 0.1],
+    "num_leaves": [15, 31, 63],
+    "min_child_samples": [10, 20, 40],
+}
+DEFAULT_PARAMS = {"n_estimators": 100, "learning_rate": 0.1, "num_leaves": 31, "min_child_samples": 20}
+
+# Per-process data set by _init_worker, so each worker receives the matrices once, not per trial
+_DATASETS = {}
+_N_THREADS = 1
+
+
+def sample_configs(param_grid, lag_candidates, n_trials, seed=42, default_params=DEFAULT_PARAMS):
+    """Returns up to `n_trials` distinct {"n_lags", "params"} configs, defaults first, the rest random."""
+    candidates = [{"n_lags": n, "params": dict(zip(param_grid, values))}
+                  for n in lag_candidates for values in itertools.product(*param_grid.values())]
+    random.Random(seed).shuffle(candidates)
+    configs = [{"n_lags": n, "params": dict(default_params)} for n in lag_candidates]
+    for config in candidates:
+        if config not in configs:
+            configs.append(config)
+    return configs[:n_trials]
+
+
+def time_series_folds(times, n_folds=3, min_train_frac=0.5):
+    """Expanding-window folds over target timestamps: (train_idx, test_idx) pairs.
+
+    Fold k trains on every row before boundary k and tests on the rows up to
+    boundary k+1, so a model is never scored on readings older than the
+    ones it learned from, whichever device they came from.
+    """
+    times = np.asarray(times).astype("datetime64[ns]").astype(np.int64)
+    boundaries = np.quantile(times, np.linspace(min_train_frac, 1.0, n_folds + 1))
+    folds = []
+    for k in range(n_folds):
+        train_idx = np.flatnonzero(times < boundaries[k])
+        last = k == n_folds - 1
+        test_mask = (times >= boundaries[k]) & ((times <= boundaries[k + 1]) if last else (times < boundaries[k + 1]))
+        test_idx = np.flatnonzero(test_mask)
+        if len(train_idx) and len(test_idx):
+            folds.append((train_idx, test_idx))
+    return folds
+
+
+def evaluate_config(params, X, y, folds, n_threads=1, deadline=None, random_state=42):
+    """RMSE of LightGBM with `params` on each fold; stops early once `deadline` (epoch seconds) passes."""
+    import lightgbm as lgb
+    scores = []
+    for train_idx, test_idx in folds:
+        if deadline is not None and time.time() >= deadline:
+            break
+        model = lgb.LGBMRegressor(random_state=random_state, n_jobs=n_threads, verbose=-1, **params)
+        model.fit(X[train_idx], y[train_idx])
+        errors = model.predict(X[test_idx]) - y[test_idx]
+        scores.append(float(np.sqrt(np.mean(errors ** 2))))
+    return scores
+
+
+def _init_worker(datasets, n_threads):
+    global _DATASETS, _N_THREADS
+    _DATASETS, _N_THREADS = datasets, n_threads
+
+
+def _run_trial(trial, config, deadline):
+    start = time.time()
+    X, y, folds = _DATASETS[config["n_lags"]]
+    result = {"trial": trial, "n_lags": config["n_lags"], "params": config["params"]}
+    try:
+        scores = evaluate_config(config["params"], X, y, folds, _N_THREADS, deadline)
+        result.update(fold_rmse=scores, complete=len(scores) == len(folds) > 0,
+                      cv_rmse=float(np.mean(scores)) if scores else None)
+    except Exception as e:
+        result.update(fold_rmse=[], complete=False, cv_rmse=None, error=str(e))
+    result["seconds"] = time.time() - start
+    return result
+
+
+def run_search(datasets, configs, n_workers=None, budget_s=300.0):
+    """Cross-validates `configs` in a process pool within `budget_s` seconds.
+
+    `datasets` maps n_lags -> (X, y, folds). Workers split the CPUs between
+    them (LightGBM's n_jobs) instead of each starting one thread per core.
+    No trial starts after the budget, and running ones stop between folds;
+    their results are marked incomplete. Returns one result per trial run.
+    """
+    cpus = os.cpu_count() or 1
+    n_workers = max(1, min(n_workers or cpus, len(configs)))
+    n_threads = max(1, cpus // n_workers)
+    deadline = time.time() + budget_s
+    todo = list(enumerate(configs))[::-1]
+    results = []
+    if n_workers == 1:
+        _init_worker(datasets, n_threads)
+        while todo and time.time() < deadline:
+            results.append(_run_trial(*todo.pop(), deadline))
+        return results
+
+    # Spawned, not forked: a forked child can hang in LightGBM's OpenMP pool
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(n_workers, mp_context=context, initializer=_init_worker,
+                             initargs=(datasets, n_threads)) as pool:
+        running = set()
+        while todo or running:
+            while todo and len(running) < n_workers and time.time() < deadline:
+                running.add(pool.submit(_run_trial, *todo.pop(), deadline))
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            results.extend(f.result() for f in done)
+    return sorted(results, key=lambda r: r["trial"])
+
+
+def best_trial(results, n_lags=None):
+    """The complete trial with the lowest CV RMSE (optionally only with `n_lags` lags), or None."""
+    eligible = [r for r in results if r["complete"] and (n_lags is None or r["n_lags"] == n_lags)]
+    return min(eligible, key=lambda r: r["cv_rmse"]) if eligible else None
@@ -0,0 +1,135 @@
+# common/compiled_model.py
+
+import json
+import numpy as np
+
+COMPILED_FORMAT_VERSION = 1
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+_MISSING_CODES = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+_ZERO_THRESHOLD = 1e-35 # LightGBM's kZeroThreshold
+
+
+def compile_booster(model_dump):
+    """Flattens a LightGBM `Booster.dump_model()` dict into NumPy arrays.
+
+    All trees share one node table. Leaves are nodes too: their threshold is
+    +inf and both children point back at the leaf, so after `max_depth`
+    steps every (row, tree) pair rests on a leaf without any masking.
+    """
+    split_feature, threshold, default_left, missing_type = [], [], [], []
+    children, leaf_value, roots = [], [], []
+    max_depth = 0
+
+    def add(node, depth):
+        nonlocal max_depth
+        idx = len(split_feature)
+        children.append([idx, idx])
+        if "leaf_value" in node or "split_index" not in node:
+            split_feature.append(0)
+            threshold.append(np.inf)
+            default_left.append(True)
+            missing_type.append(MISSING_NONE)
+            leaf_value.append(node.get("leaf_value", 0.0))
+            max_depth = max(max_depth, depth)
+            return idx
+        if node.get("decision_type", "<=") != "<=":
+            raise ValueError(f"Unsupported split type {node['decision_type']!r} (categorical features)")
+        split_feature.append(node["split_feature"])
+        threshold.append(node["threshold"])
+        default_left.append(node.get("default_left", True))
+        missing_type.append(_MISSING_CODES[node.get("missing_type", "None")])
+        leaf_value.append(0.0)
+        children[idx] = [add(node["left_child"], depth + 1), add(node["right_child"], depth + 1)]
+        return idx
+
+    for tree in model_dump["tree_info"]:
+        roots.append(add(tree["tree_structure"], 0))
+
+    return {
+        "split_feature": np.array(split_feature, dtype=np.int32),
+        "threshold": np.array(threshold, dtype=np.float64),
+        "default_left": np.array(default_left, dtype=bool),
+        "missing_type": np.array(missing_type, dtype=np.int8),
+        "children": np.array(children, dtype=np.int32).ravel(), # [left, right] per node
+        "leaf_value": np.array(leaf_value, dtype=np.float64),
+        "roots": np.array(roots, dtype=np.int32),
+        "max_depth": np.array(max_depth, dtype=np.int32),
+    }
+
+
+def export_compiled_model(booster, path, feature_spec=None):
+    """Writes a booster as a compiled `.npz` artifact loadable without LightGBM."""
+    model_dump = booster.dump_model()
+    if model_dump.get("objective", "regression").split()[0] not in ("regression", "regression_l1", "huber", "fair", "quantile"):
+        raise ValueError(f"Only identity-link objectives can be compiled, got {model_dump['objective']!r}")
+    arrays = compile_booster(model_dump)
+    meta = {
+        "format_version": COMPILED_FORMAT_VERSION,
+        "num_features": model_dump["max_feature_idx"] + 1,
+        "num_trees": len(arrays["roots"]),
+        "feature_spec": feature_spec,
+    }
+    with open(path, "wb") as f:
+        np.savez(f, meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8), **arrays)
+
+
+class CompiledTreeModel:
+    """Evaluates a compiled tree ensemble with vectorized NumPy.
+
+    All (row, tree) pairs descend one level per step, so a batch costs
+    `max_depth` rounds of array operations regardless of batch size or
+    tree count.
+    """
+
+    def __init__(self, arrays, meta):
+        self.split_feature = arrays["split_feature"]
+        self.threshold = arrays["threshold"]
+        self.default_left = arrays["default_left"]
+        self.missing_type = arrays["missing_type"]
+        self.children = arrays["children"]
+        self.leaf_value = arrays["leaf_value"]
+        self.roots = arrays["roots"]
+        self.max_depth = int(arrays["max_depth"])
+        self.num_features = meta["num_features"]
+        self.feature_spec_ = meta.get("feature_spec")
+        self._has_zero_missing = bool((self.missing_type == MISSING_ZERO).any())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            meta = json.loads(data["meta"].tobytes().decode())
+            if meta["format_version"] != COMPILED_FORMAT_VERSION:
+                raise ValueError(f"Unsupported compiled model version {meta['format_version']}")
+            arrays = {k: data[k] for k in data.files if k != "meta"}
+        return cls(arrays, meta)
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.num_features:
+            raise ValueError(f"Expected X with shape (n, {self.num_features}), got {X.shape}")
+        # Flat index into X of each row's first feature, broadcast over trees
+        row_base = (np.arange(X.shape[0], dtype=np.intp) * self.num_features)[:, np.newaxis]
+        flat_X = X.ravel()
+        nodes = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))).astype(np.intp)
+        check_missing = self._has_zero_missing or np.isnan(flat_X).any()
+
+        for _ in range(self.max_depth):
+            values = flat_X[row_base + self.split_feature[nodes]]
+            go_right = ~(values <= self.threshold[nodes])
+            if check_missing:
+                go_right = self._missing_direction(nodes, values, go_right)
+            nodes = self.children[2 * nodes + go_right]
+
+        return self.leaf_value[nodes].sum(axis=1)
+
+    def _missing_direction(self, nodes, values, go_right):
+        """Applies LightGBM's missing-value rules to the split decisions."""
+        missing_type = self.missing_type[nodes]
+        is_nan = np.isnan(values)
+        # NaN compares as 0 when no missing values were seen in training
+        nan_as_zero = is_nan & (missing_type == MISSING_NONE)
+        go_right[nan_as_zero] = ~(0.0 <= self.threshold[nodes][nan_as_zero])
+        missing = (is_nan & (missing_type == MISSING_NAN)) | (
+            (missing_type == MISSING_ZERO) & (is_nan | (np.abs(values) <= _ZERO_THRESHOLD)))
+        go_right[missing] = ~self.default_left[nodes][missing]
+        return go_right
@@ -0,0 +1,96 @@
+# common/features.py
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class FeatureSpec:
+    """Describes the model's input features; shared by training and edge inference.
+
+    For every column in `feature_cols` the last `n_lags` readings are used
+    (lag_1 = most recent first). For every window in `rolling_windows` the
+    rolling mean and std of the target over that many past readings are added.
+    """
+
+    def __init__(self, target_col="voc_ppb", feature_cols=("voc_ppb",), n_lags=5, rolling_windows=()):
+        self.target_col = target_col
+        self.feature_cols = tuple(feature_cols)
+        self.n_lags = n_lags
+        self.rolling_windows = tuple(rolling_windows)
+        if target_col not in self.feature_cols and self.rolling_windows:
+            raise ValueError("rolling aggregates need the target in feature_cols")
+
+    @property
+    def history_length(self):
+        """Number of past readings needed to build one feature row."""
+        return max((self.n_lags,) + self.rolling_windows)
+
+    @property
+    def n_features(self):
+        return len(self.feature_cols) * self.n_lags + 2 * len(self.rolling_windows)
+
+    def feature_names(self):
+        names = [f"{col}_lag_{i}" for col in self.feature_cols for i in range(1, self.n_lags + 1)]
+        for w in self.rolling_windows:
+            names += [f"{self.target_col}_roll_mean_{w}", f"{self.target_col}_roll_std_{w}"]
+        return names
+
+    def to_dict(self):
+        return {
+            "target_col": self.target_col,
+            "feature_cols": list(self.feature_cols),
+            "n_lags": self.n_lags,
+            "rolling_windows": list(self.rolling_windows),
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["target_col"], d["feature_cols"], d["n_lags"], d.get("rolling_windows", ()))
+
+    def __eq__(self, other):
+        return isinstance(other, FeatureSpec) and self.to_dict() == other.to_dict()
+
+
+def _features_from_windows(windows, spec):
+    """Builds feature rows from history windows of shape (n, n_cols, history_length)."""
+    # Most recent reading is last in each window; lag_1 first
+    lag_slice = slice(-1, -spec.n_lags - 1, -1)
+    if len(spec.feature_cols) == 1 and not spec.rolling_windows:
+        return windows[:, 0, lag_slice] # Strided view, no copy
+
+    blocks = [windows[:, c, lag_slice] for c in range(len(spec.feature_cols))]
+    target = windows[:, spec.feature_cols.index(spec.target_col), :] if spec.rolling_windows else None
+    for w in spec.rolling_windows:
+        recent = target[:, -w:]
+        blocks.append(recent.mean(axis=1, keepdims=True))
+        blocks.append(recent.std(axis=1, keepdims=True))
+    return np.concatenate(blocks, axis=1)
+
+
+def build_training_matrix(columns, spec):
+    """Builds (X, y) for one device's time-ordered history.
+
+    `columns` maps column name -> 1-D array (a DataFrame works). Row i of X
+    holds the features for predicting y[i] from the `history_length`
+    readings before it.
+    """
+    arrays = [np.asarray(columns[c], dtype=np.float64) for c in spec.feature_cols]
+    values = arrays[0][:, np.newaxis] if len(arrays) == 1 else np.column_stack(arrays)
+    target = np.asarray(columns[spec.target_col], dtype=np.float64)
+    h = spec.history_length
+    if len(target) <= h:
+        return np.empty((0, spec.n_features)), np.empty(0)
+
+    # (n, n_cols, h) view over values[:-1]: window i ends just before target i + h
+    windows = sliding_window_view(values[:-1], h, axis=0)
+    return _features_from_windows(windows, spec), target[h:]
+
+
+def build_feature_row(history, spec):
+    """Builds the feature row for the next reading from `history`.
+
+    `history` has shape (history_length, n_cols), oldest reading first,
+    exactly as the edge service keeps it per device.
+    """
+    history = np.asarray(history, dtype=np.float64).reshape(spec.history_length, len(spec.feature_cols))
+    return _features_from_windows(history.T[np.newaxis], spec)[0]
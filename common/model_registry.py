@@ -0,0 +1,168 @@
+# common/model_registry.py
+
+import fcntl
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from datetime import datetime
+
+MANIFEST_NAME = "manifest.json"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """Index of model versions kept in `<model_dir>/manifest.json`.
+
+    The manifest lists every retained version (file names, metrics, creation
+    time, sha256) plus a `current` pointer, so finding the model to serve is
+    a single stat + cached read instead of a directory scan. Only the newest
+    `keep` versions are retained; older artifacts are deleted on register.
+    """
+
+    def __init__(self, model_dir, keep=10):
+        self.model_dir = model_dir
+        self.keep = keep
+        self.manifest_path = os.path.join(model_dir, MANIFEST_NAME)
+        self._cache_key = None
+        self._cache = None
+
+    def _empty(self):
+        return {"current": None, "versions": []}
+
+    def read(self):
+        """Returns the manifest, re-reading the file only when it was replaced or modified."""
+        try:
+            st = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return self._empty()
+        key = (st.st_ino, st.st_mtime_ns, st.st_size) # Writes replace the file, so the inode changes too
+        if key != self._cache_key:
+            with open(self.manifest_path) as f:
+                self._cache = json.load(f)
+            self._cache_key = key
+        return self._cache
+
+    def exists(self):
+        return os.path.exists(self.manifest_path)
+
+    @contextmanager
+    def _locked(self):
+        # Serializes read-modify-write between concurrent trainers
+        os.makedirs(self.model_dir, exist_ok=True)
+        with open(self.manifest_path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp_path, self.manifest_path)
+
+    def entries(self):
+        """All retained versions, oldest first."""
+        return list(self.read()["versions"])
+
+    def get(self, version):
+        for entry in self.read()["versions"]:
+            if entry["version"] == version:
+                return entry
+        return None
+
+    def current(self):
+        """The entry the edge should serve, or None."""
+        manifest = self.read()
+        return self.get(manifest["current"]) if manifest["current"] else None
+
+    def path_of(self, entry, key="path"):
+        return os.path.join(self.model_dir, entry[key]) if entry.get(key) else None
+
+    def register(self, model_path, metrics=None, compiled_path=None, make_current=True, **extra):
+        """Adds a freshly saved artifact to the manifest and applies retention."""
+        version = os.path.splitext(os.path.basename(model_path))[0]
+        entry = {
+            "version": version,
+            "path": os.path.basename(model_path),
+            "compiled_path": os.path.basename(compiled_path) if compiled_path else None,
+            "sha256": file_sha256(model_path),
+            "compiled_sha256": file_sha256(compiled_path) if compiled_path else None,
+            "created_at": datetime.now().isoformat(),
+            "metrics": metrics or {},
+        }
+        entry.update(extra)
+        with self._locked():
+            self._cache_key = None
+            manifest = self.read()
+            manifest["versions"] = [e for e in manifest["versions"] if e["version"] != version] + [entry]
+            if make_current:
+                manifest["current"] = version
+            removed = self._apply_retention(manifest)
+            self._write(manifest)
+        self._delete_artifacts(removed)
+        return entry
+
+    def set_current(self, version):
+        """Points `current` at a retained version (e.g. for a rollback)."""
+        with self._locked():
+            self._cache_key = None
+            manifest = self.read()
+            if not any(e["version"] == version for e in manifest["versions"]):
+                raise KeyError(f"Unknown model version {version!r}")
+            manifest["current"] = version
+            self._write(manifest)
+
+    def annotate(self, version, **fields):
+        """Adds `fields` to a retained version's entry (e.g. its MLflow run id once uploaded)."""
+        with self._locked():
+            self._cache_key = None
+            manifest = self.read()
+            entry = next((e for e in manifest["versions"] if e["version"] == version), None)
+            if entry is None:
+                raise KeyError(f"Unknown model version {version!r}")
+            entry.update(fields)
+            self._write(manifest)
+
+    def verify(self, file_name):
+        """Raises ValueError if `file_name` is a registered artifact whose contents no longer match its sha256."""
+        for entry in self.read()["versions"]:
+            for key, digest_key in (("path", "sha256"), ("compiled_path", "compiled_sha256")):
+                if entry.get(key) == file_name and entry.get(digest_key):
+                    if file_sha256(os.path.join(self.model_dir, file_name)) != entry[digest_key]:
+                        raise ValueError(f"{file_name} does not match the sha256 in {MANIFEST_NAME}")
+                    return
+
+    def previous(self, version):
+        """The retained version registered just before `version`, or None."""
+        versions = [e["version"] for e in self.read()["versions"]]
+        if version not in versions:
+            return None
+        i = versions.index(version)
+        return self.get(versions[i - 1]) if i > 0 else None
+
+    def _apply_retention(self, manifest):
+        versions = manifest["versions"]
+        if len(versions) <= self.keep:
+            return []
+        removable = [e for e in versions if e["version"] != manifest["current"]]
+        removed = removable[:len(versions) - self.keep]
+        removed_ids = {e["version"] for e in removed}
+        manifest["versions"] = [e for e in versions if e["version"] not in removed_ids]
+        return removed
+
+    def _delete_artifacts(self, entries):
+        for entry in entries:
+            for key in ("path", "compiled_path"):
+                path = self.path_of(entry, key)
+                if path and os.path.exists(path):
+                    os.remove(path)
@@ -0,0 +1,40 @@
+# common/partitioning.py
+
+import hashlib
+import zlib
+
+# Partitioned topics: '<device_id>/sensors/p<NNN>'. Publishers and every edge
+# replica must agree on the partition count (SENSOR_PARTITIONS); both default to this.
+DEFAULT_PARTITIONS = 64
+PARTITION_TOPIC = "+/sensors/p{:03d}"
+
+
+def device_partition(device_id, n_partitions):
+    """Stable partition of a device (the same in every process, unlike hash())."""
+    return zlib.crc32(device_id.encode()) % n_partitions
+
+
+def partition_topic(device_id, n_partitions):
+    return f"{device_id}/sensors/p{device_partition(device_id, n_partitions):03d}"
+
+
+def _weight(member, partition):
+    digest = hashlib.blake2b(f"{member}/{partition}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def assign_partitions(members, n_partitions):
+    """Maps each member to the partitions it owns, by rendezvous hashing.
+
+    Every partition goes to the member with the highest hash weight for it,
+    so all replicas compute the same assignment from the same member set,
+    and adding or removing one member only moves that member's share.
+    """
+    members = sorted(members)
+    owned = {m: [] for m in members}
+    if not members:
+        return owned
+    for partition in range(n_partitions):
+        owner = max(members, key=lambda m: _weight(m, partition))
+        owned[owner].append(partition)
+    return owned
@@ -0,0 +1,93 @@
+# common/payload.py
+
+import struct
+from datetime import datetime, timedelta, timezone
+import numpy as np
+
+# Binary sensor message, little-endian:
+#   header   magic "SR", version u8, flags u8, n_readings u16, n_device_ids u16
+#   ids      n_device_ids x (u8 length + UTF-8 bytes); none means "device from topic"
+#   readings n_readings x READING_DTYPE
+PAYLOAD_MAGIC = b"SR"
+PAYLOAD_VERSION = 1
+_HEADER = struct.Struct("<2sBBHH")
+READING_DTYPE = np.dtype([
+    ("timestamp_ms", "<i8"), # Epoch milliseconds
+    ("device", "<u2"), # Index into the id table
+    ("temp_c", "<f4"),
+    ("humidity", "<f4"),
+    ("voc_ppb", "<f4"),
+])
+MAX_READINGS = 0xFFFF
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_epoch_ms(ts):
+    """Converts a datetime or ISO string to epoch milliseconds.
+
+    Naive timestamps are taken as wall-clock time, matching how pandas
+    stores them, so they round-trip unchanged.
+    """
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return (ts - EPOCH) // timedelta(milliseconds=1)
+
+
+def is_binary(payload):
+    return payload[:2] == PAYLOAD_MAGIC
+
+
+def encode_binary(timestamp_ms, device_ids, temp_c, humidity, voc_ppb, include_ids=True):
+    """Packs readings into one binary message.
+
+    `timestamp_ms` is one epoch-ms value for all readings or one per reading.
+    With `include_ids=False` the id table is left out and the receiver takes
+    the device from the topic (single-device messages).
+    """
+    n = len(device_ids)
+    if n > MAX_READINGS:
+        raise ValueError(f"At most {MAX_READINGS} readings per message, got {n}")
+    records = np.empty(n, dtype=READING_DTYPE)
+    records["timestamp_ms"] = timestamp_ms
+    records["temp_c"] = temp_c
+    records["humidity"] = humidity
+    records["voc_ppb"] = voc_ppb
+
+    id_table = b""
+    n_ids = 0
+    if include_ids:
+        index = {}
+        codes = [index.setdefault(d, len(index)) for d in device_ids]
+        records["device"] = codes
+        encoded = [d.encode() for d in index]
+        id_table = b"".join(bytes([len(e)]) + e for e in encoded)
+        n_ids = len(encoded)
+    else:
+        records["device"] = 0
+    return _HEADER.pack(PAYLOAD_MAGIC, PAYLOAD_VERSION, 0, n, n_ids) + id_table + records.tobytes()
+
+
+def decode_binary(payload):
+    """Unpacks a binary message into (device_ids, records).
+
+    `device_ids` is the id table (None if the message has none) and `records`
+    a READING_DTYPE array viewing the payload; `records["device"]` indexes
+    into the id table.
+    """
+    magic, version, _, n, n_ids = _HEADER.unpack_from(payload)
+    if magic != PAYLOAD_MAGIC:
+        raise ValueError("Not a binary sensor payload")
+    if version != PAYLOAD_VERSION:
+        raise ValueError(f"Unsupported payload version {version}")
+    offset = _HEADER.size
+    device_ids = None
+    if n_ids:
+        device_ids = []
+        for _ in range(n_ids):
+            length = payload[offset]
+            device_ids.append(bytes(payload[offset + 1:offset + 1 + length]).decode())
+            offset += 1 + length
+    records = np.frombuffer(payload, dtype=READING_DTYPE, count=n, offset=offset)
+    return device_ids, records
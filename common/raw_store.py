@@ -0,0 +1,325 @@
+# common/raw_store.py
+
+import fcntl
+import glob
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from common.payload import EPOCH, to_epoch_ms
+
+RAW_COLUMNS = ["timestamp", "device_id", "temp_c", "humidity", "voc_ppb"]
+RAW_SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("ms")),
+    ("device_id", pa.string()),
+    ("temp_c", pa.float64()),
+    ("humidity", pa.float64()),
+    ("voc_ppb", pa.float64()),
+])
+PARTITION_FORMAT = "%Y%m%d%H" # One partition directory per hour
+PARTITION_MS = 3600 * 1000
+ABSORBED_KEY = b"absorbed" # Footer metadata of a compact segment: names of the segments it replaced
+_absorbed_cache = {} # compact segment path -> names it absorbed (segments are immutable)
+_num_rows_cache = {} # segment path -> row count from its footer
+
+
+def _partition_of(epoch_ms):
+    return (EPOCH + timedelta(milliseconds=epoch_ms)).strftime(PARTITION_FORMAT)
+
+
+def _partition_start_ms(partition_dir):
+    """Epoch ms at which a `dt=<YYYYMMDDHH>` partition's hour starts."""
+    return to_epoch_ms(datetime.strptime(os.path.basename(partition_dir)[len("dt="):], PARTITION_FORMAT))
+
+
+def _num_rows(path):
+    if path not in _num_rows_cache:
+        _num_rows_cache[path] = pq.ParquetFile(path).metadata.num_rows
+    return _num_rows_cache[path]
+
+
+def _segment_name(kind, min_ms, max_ms):
+    # The random suffix keeps concurrent writers from ever producing the same name
+    return f"{kind}-{min_ms}-{max_ms}-{uuid.uuid4().hex[:12]}.parquet"
+
+
+def _segment_range(path):
+    """(min_ms, max_ms) from a segment's file name."""
+    fields = os.path.basename(path)[:-len(".parquet")].split("-")
+    return int(fields[1]), int(fields[2])
+
+
+def _absorbed(path):
+    if path not in _absorbed_cache:
+        metadata = pq.read_metadata(path).metadata or {}
+        _absorbed_cache[path] = set(json.loads(metadata.get(ABSORBED_KEY, b"[]")))
+    return _absorbed_cache[path]
+
+
+def live_segments(partition_dir):
+    """Segment paths of a partition, leaving out those a compact segment has already absorbed."""
+    compacts = glob.glob(os.path.join(partition_dir, "compact-*.parquet"))
+    paths = compacts + glob.glob(os.path.join(partition_dir, "part-*.parquet"))
+    hidden = set()
+    for path in compacts:
+        try:
+            hidden |= _absorbed(path)
+        except FileNotFoundError:
+            pass # Replaced by a newer compaction meanwhile
+    return [p for p in paths if os.path.basename(p) not in hidden]
+
+
+@contextmanager
+def _partition_lock(partition_dir):
+    """Serializes compactions of one partition across writer processes."""
+    with open(os.path.join(partition_dir, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _write_table_atomic(table, path):
+    tmp_path = f"{path}.{uuid.uuid4().hex[:12]}.tmp"
+    pq.write_table(table, tmp_path, compression="zstd", write_statistics=True)
+    os.replace(tmp_path, path)
+
+
+class RawDataWriter:
+    """Buffers sensor rows and writes them as time-partitioned Parquet segments.
+
+    Layout: `<root>/dt=<YYYYMMDDHH>/part-<min_ms>-<max_ms>-<id>.parquet`. The
+    time range in each file name lets readers skip segments without opening
+    them, and the Parquet footer carries per-column min/max statistics. A
+    segment is written when `flush_rows` rows are buffered, the oldest
+    buffered row is older than `flush_interval_s`, or the hour changes;
+    finished hours are compacted into a single segment. A segment that lands
+    in an hour another writer already compacted is compacted in right away.
+    """
+
+    def __init__(self, root, flush_rows=1000, flush_interval_s=10.0):
+        self.root = root
+        self.flush_rows = flush_rows
+        self.flush_interval_s = flush_interval_s
+        self._columns = {name: [] for name in RAW_COLUMNS}
+        self._first_append_ts = None
+        self._partition = None
+        os.makedirs(root, exist_ok=True)
+
+    def __len__(self):
+        return len(self._columns["timestamp"])
+
+    def append(self, timestamp, device_id, temp_c, humidity, voc_ppb):
+        """Buffers one reading, flushing a segment when a limit is reached."""
+        ts_ms = to_epoch_ms(timestamp)
+        self._switch_partition(ts_ms)
+
+        cols = self._columns
+        cols["timestamp"].append(ts_ms)
+        cols["device_id"].append(device_id)
+        cols["temp_c"].append(temp_c)
+        cols["humidity"].append(humidity)
+        cols["voc_ppb"].append(voc_ppb)
+        self._maybe_flush()
+
+    def append_many(self, timestamp, device_ids, temp_c, humidity, voc_ppb):
+        """Buffers a batch of readings taken at one `timestamp` (e.g. a simulator tick)."""
+        ts_ms = to_epoch_ms(timestamp)
+        self._switch_partition(ts_ms)
+
+        cols = self._columns
+        cols["timestamp"].extend([ts_ms] * len(device_ids))
+        cols["device_id"].extend(device_ids)
+        cols["temp_c"].extend(temp_c)
+        cols["humidity"].extend(humidity)
+        cols["voc_ppb"].extend(voc_ppb)
+        self._maybe_flush()
+
+    def _switch_partition(self, ts_ms):
+        # A new hour finishes the previous partition: write and compact it
+        partition = _partition_of(ts_ms)
+        if self._partition is not None and partition != self._partition:
+            finished = self._partition
+            self.flush()
+            compact_partition(os.path.join(self.root, f"dt={finished}"))
+        self._partition = partition
+
+    def _maybe_flush(self):
+        if self._first_append_ts is None:
+            self._first_append_ts = time.monotonic()
+        if len(self) >= self.flush_rows or time.monotonic() - self._first_append_ts >= self.flush_interval_s:
+            self.flush()
+
+    def flush(self):
+        """Writes buffered rows as one segment. Returns the segment path, or None."""
+        if not len(self):
+            return None
+        table = pa.Table.from_pydict(self._columns, schema=RAW_SCHEMA)
+        ts = self._columns["timestamp"]
+        partition_dir = os.path.join(self.root, f"dt={self._partition}")
+        os.makedirs(partition_dir, exist_ok=True)
+        path = os.path.join(partition_dir, _segment_name("part", min(ts), max(ts)))
+        _write_table_atomic(table, path)
+
+        self._columns = {name: [] for name in RAW_COLUMNS}
+        self._first_append_ts = None
+        if glob.glob(os.path.join(partition_dir, "compact-*.parquet")):
+            compact_partition(partition_dir) # A late segment for an hour that is already finished
+        return path
+
+    def close(self):
+        self.flush()
+
+
+def compact_partition(partition_dir):
+    """Merges the live segments of a finished partition into one `compact-*` segment.
+
+    The new segment lists the segments it absorbed in its footer, so readers
+    hide exactly those (and not parts written later by another writer) even
+    before they are deleted. Runs when a partition has two or more parts, or
+    parts next to an earlier compact segment.
+    """
+    with _partition_lock(partition_dir):
+        existing = glob.glob(os.path.join(partition_dir, "*.parquet"))
+        live = sorted(live_segments(partition_dir))
+        n_parts = sum(1 for p in live if os.path.basename(p).startswith("part-"))
+        if n_parts == 0 or len(live) < 2:
+            return None
+        table = pa.concat_tables(pq.read_table(p, schema=RAW_SCHEMA) for p in live)
+        table = table.sort_by("timestamp")
+        ts = table.column("timestamp").cast(pa.int64())
+        absorbed = [os.path.basename(p) for p in live]
+        table = table.replace_schema_metadata({ABSORBED_KEY: json.dumps(absorbed)})
+        path = os.path.join(partition_dir, _segment_name("compact", pc.min(ts).as_py(), pc.max(ts).as_py()))
+        _write_table_atomic(table, path)
+        # Absorbed segments are hidden from readers already. Segments hidden before are leftovers of a
+        # compaction interrupted before this step. Parts written since the listing above are kept.
+        for p in set(existing) | set(live):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+            _absorbed_cache.pop(p, None)
+            _num_rows_cache.pop(p, None)
+    return path
+
+
+class RawDataReader:
+    """Reads the segments written by RawDataWriter, touching only what a query needs."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def partitions(self, start_ms=None, end_ms=None):
+        """Partition directories overlapping [start_ms, end_ms), oldest first, chosen by name alone."""
+        partitions = sorted(glob.glob(os.path.join(self.root, "dt=*")))
+        if start_ms is None and end_ms is None:
+            return partitions
+        keep = []
+        for partition_dir in partitions:
+            hour_ms = _partition_start_ms(partition_dir)
+            if (start_ms is None or hour_ms + PARTITION_MS > start_ms) and (end_ms is None or hour_ms < end_ms):
+                keep.append(partition_dir)
+        return keep
+
+    def segments(self, start_ms=None, end_ms=None):
+        """Returns (min_ms, max_ms, path) for every live segment, oldest first.
+
+        With `start_ms`/`end_ms`, partitions whose hour lies outside the range
+        are skipped without listing their segments.
+        """
+        segments = []
+        for partition_dir in self.partitions(start_ms, end_ms):
+            segments.extend(self._partition_segments(partition_dir))
+        return segments
+
+    def _partition_segments(self, partition_dir):
+        # A segment holds rows of its partition's hour only, so sorting per partition sorts overall
+        return sorted((*_segment_range(path), path) for path in live_segments(partition_dir))
+
+    def row_count(self):
+        """Total rows, from Parquet footers only (read once per segment)."""
+        return sum(_num_rows(path) for _, _, path in self.segments())
+
+    def _read(self, paths, columns=None, filters=None):
+        if not paths:
+            return pd.DataFrame(columns=columns or RAW_COLUMNS)
+        tables = [pq.read_table(p, columns=columns, filters=filters, schema=RAW_SCHEMA) for p in paths]
+        df = pa.concat_tables(tables).to_pandas()
+        if "timestamp" in df.columns:
+            # Segments from concurrent writers may interleave in time
+            df = df.sort_values("timestamp", kind="stable", ignore_index=True)
+        return df
+
+    def _with_retry(self, read_fn):
+        # A segment can disappear under us if its partition is compacted mid-read
+        try:
+            return read_fn()
+        except FileNotFoundError:
+            return read_fn()
+
+    def read_all(self, columns=None):
+        return self._with_retry(lambda: self._read([p for _, _, p in self.segments()], columns))
+
+    def read_last(self, n_rows, columns=None):
+        """Returns the newest `n_rows` rows, walking partitions and segments newest-first until enough are found."""
+        def _read_last():
+            paths, total = [], 0
+            for partition_dir in reversed(self.partitions()):
+                for _, _, path in reversed(self._partition_segments(partition_dir)):
+                    paths.append(path)
+                    total += _num_rows(path)
+                    if total >= n_rows:
+                        break
+                if total >= n_rows:
+                    break
+            df = self._read(paths[::-1], columns)
+            return df.tail(n_rows).reset_index(drop=True)
+        return self._with_retry(_read_last)
+
+    def read_range(self, start=None, end=None, columns=None):
+        """Returns rows with start <= timestamp < end.
+
+        Partitions and segments outside the range are skipped by name, and row
+        groups inside the remaining segments are pruned with footer statistics.
+        """
+        start_ms = to_epoch_ms(start) if start is not None else None
+        end_ms = to_epoch_ms(end) if end is not None else None
+        filters = []
+        if start_ms is not None:
+            filters.append(("timestamp", ">=", pd.Timestamp(start_ms, unit="ms")))
+        if end_ms is not None:
+            filters.append(("timestamp", "<", pd.Timestamp(end_ms, unit="ms")))
+
+        def _read_range():
+            paths = [p for lo, hi, p in self.segments(start_ms, end_ms)
+                     if (start_ms is None or hi >= start_ms) and (end_ms is None or lo < end_ms)]
+            return self._read(paths, columns, filters or None)
+        return self._with_retry(_read_range)
+
+    def iter_batches(self, start=None, columns=None, batch_rows=100_000):
+        """Yields the rows at/after `start` as DataFrames of at most `batch_rows`, oldest segment first.
+
+        Only one batch is in memory at a time. Rows are time-ordered within
+        a batch; segments from concurrent writers can overlap in time, so
+        readings of different devices may arrive slightly out of order
+        across batches (each device's own readings come from one writer).
+        """
+        start_ms = to_epoch_ms(start) if start is not None else None
+        start_ts = pd.Timestamp(start_ms, unit="ms") if start_ms is not None else None
+        for lo, hi, path in self.segments(start_ms):
+            if start_ms is not None and hi < start_ms:
+                continue
+            for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows, columns=columns):
+                df = batch.to_pandas()
+                if start_ts is not None and lo < start_ms:
+                    df = df[df["timestamp"] >= start_ts]
+                if len(df):
+                    yield df.sort_values("timestamp", kind="stable", ignore_index=True)
@@ -0,0 +1,184 @@
+# common/rollups.py
+
+import argparse
+import glob
+import json
+import os
+import sys
+import numpy as np
+
+# Make the project root importable when run as `python common/rollups.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.payload import to_epoch_ms
+
+# (label, bucket seconds, buckets kept): a week of minutes and ~13 months of hours
+RESOLUTIONS = (("1m", 60, 7 * 24 * 60), ("1h", 3600, 400 * 24))
+SENSOR_METRICS = ("voc_ppb", "temp_c", "humidity")
+PREDICTION_METRICS = ("abs_error", "sq_error") # Per-bucket MAE, and RMSE as sqrt of the mean
+
+
+def _bucket_dtype(n_metrics):
+    return np.dtype([("start_ms", "<i8"), ("count", "<i8"), ("sum", "<f8", (n_metrics,)),
+                     ("min", "<f8", (n_metrics,)), ("max", "<f8", (n_metrics,))])
+
+
+class _Ring:
+    """One resolution: a fixed number of buckets in a memory-mapped file, slot = bucket index % capacity."""
+
+    def __init__(self, path, bucket_s, capacity, n_metrics, reset=False):
+        self.bucket_ms = bucket_s * 1000
+        self.capacity = capacity
+        exists = os.path.exists(path) and not reset
+        self.data = np.memmap(path, dtype=_bucket_dtype(n_metrics), mode="r+" if exists else "w+", shape=(capacity,))
+        if not exists:
+            self.data["start_ms"] = -1
+        # Field views, taken once: indexing fields of a structured memmap is slow next to the update itself
+        self.start, self.count = self.data["start_ms"], self.data["count"]
+        self.sum, self.min, self.max = self.data["sum"], self.data["min"], self.data["max"]
+
+    def merge(self, start_ms, count, sums, mins, maxs):
+        slot = (start_ms // self.bucket_ms) % self.capacity
+        current = self.start[slot]
+        if current > start_ms:
+            return # Older than the ring retains
+        if current != start_ms:
+            # Reuse the slot of a bucket that fell out of retention
+            self.count[slot] = 0
+            self.sum[slot] = 0.0
+            self.min[slot] = np.inf
+            self.max[slot] = -np.inf
+            self.start[slot] = start_ms
+        self.count[slot] += count
+        self.sum[slot] += sums
+        np.minimum(self.min[slot], mins, out=self.min[slot])
+        np.maximum(self.max[slot], maxs, out=self.max[slot])
+
+
+class RollupWriter:
+    """Maintains count/sum/min/max per time bucket for a few metrics, as readings arrive.
+
+    Each resolution in `resolutions` is a ring of fixed size under
+    `<directory>/<name>.<label>.bin`, so memory and disk use stay constant
+    however long the service runs, and an update touches one bucket per
+    resolution. Writers in different processes use different names (e.g.
+    one per edge replica); `read_rollups` merges all names with a prefix.
+    """
+
+    def __init__(self, directory, name, metrics, resolutions=RESOLUTIONS, reset=False):
+        os.makedirs(directory, exist_ok=True)
+        self.metrics = tuple(metrics)
+        meta_path = os.path.join(directory, f"{name}.json")
+        meta = {"metrics": list(self.metrics), "resolutions": [list(r) for r in resolutions]}
+        if os.path.exists(meta_path) and not reset:
+            with open(meta_path) as f:
+                reset = json.load(f) != meta # A changed layout starts over
+        self._rings = [_Ring(os.path.join(directory, f"{name}.{label}.bin"), bucket_s, capacity, len(self.metrics),
+                             reset=reset) for label, bucket_s, capacity in resolutions]
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def add(self, timestamp, values):
+        """Adds readings: `values` has one row per reading (columns = metrics).
+
+        `timestamp` is one datetime/ISO string/epoch-ms value for all rows
+        (e.g. a simulator tick or a prediction batch), or an array of
+        epoch-ms values, one per row.
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(self.metrics))
+        if not len(values):
+            return
+        if np.ndim(timestamp) == 0:
+            ts_ms = timestamp if isinstance(timestamp, (int, np.integer)) else to_epoch_ms(timestamp)
+            sums, mins, maxs = values.sum(axis=0), values.min(axis=0), values.max(axis=0)
+            for ring in self._rings:
+                ring.merge(ts_ms - ts_ms % ring.bucket_ms, len(values), sums, mins, maxs)
+            return
+        ts_ms = np.asarray(timestamp, dtype=np.int64)
+        for ring in self._rings:
+            starts, inverse = np.unique(ts_ms - ts_ms % ring.bucket_ms, return_inverse=True)
+            counts = np.bincount(inverse, minlength=len(starts))
+            sums = np.zeros((len(starts), values.shape[1]))
+            mins = np.full_like(sums, np.inf)
+            maxs = np.full_like(sums, -np.inf)
+            np.add.at(sums, inverse, values)
+            np.minimum.at(mins, inverse, values)
+            np.maximum.at(maxs, inverse, values)
+            for i, start_ms in enumerate(starts.tolist()):
+                ring.merge(start_ms, counts[i], sums[i], mins[i], maxs[i])
+
+    def flush(self):
+        for ring in self._rings:
+            ring.data.flush()
+
+
+def read_rollups(directory, prefix, resolution, start=None, end=None):
+    """Buckets of `resolution` (e.g. "1m") from every writer whose name starts with `prefix`, oldest first.
+
+    Returns a DataFrame with `timestamp`, `count` and `<metric>_mean`,
+    `<metric>_min`, `<metric>_max` columns. Buckets from several writers
+    are merged. Only the ring files are read, whatever the time range.
+    """
+    import pandas as pd # Only readers need it; writers run in the edge and publisher hot paths
+    frames, metrics = [], None
+    for meta_path in sorted(glob.glob(os.path.join(directory, f"{prefix}*.json"))):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        layout = {label: (bucket_s, capacity) for label, bucket_s, capacity in meta["resolutions"]}
+        path = meta_path[:-len(".json")] + f".{resolution}.bin"
+        if resolution not in layout or not os.path.exists(path):
+            continue
+        metrics = metrics or meta["metrics"]
+        if meta["metrics"] != metrics:
+            continue
+        data = np.array(np.memmap(path, dtype=_bucket_dtype(len(metrics)), mode="r", shape=(layout[resolution][1],)))
+        keep = (data["start_ms"] >= 0) & (data["count"] > 0)
+        if start is not None:
+            keep &= data["start_ms"] >= to_epoch_ms(start)
+        if end is not None:
+            keep &= data["start_ms"] < to_epoch_ms(end)
+        data = data[keep]
+        frame = pd.DataFrame({"start_ms": data["start_ms"], "count": data["count"]})
+        for j, metric in enumerate(metrics):
+            frame[f"{metric}_sum"] = data["sum"][:, j]
+            frame[f"{metric}_min"] = data["min"][:, j]
+            frame[f"{metric}_max"] = data["max"][:, j]
+        frames.append(frame)
+
+    columns = ["timestamp", "count"] + [f"{m}_{s}" for m in (metrics or []) for s in ("mean", "min", "max")]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    merged = pd.concat(frames, ignore_index=True)
+    if len(frames) > 1:
+        aggs = {c: ("min" if c.endswith("_min") else "max" if c.endswith("_max") else "sum")
+                for c in merged.columns if c != "start_ms"}
+        merged = merged.groupby("start_ms", as_index=False).agg(aggs)
+    merged = merged.sort_values("start_ms", ignore_index=True)
+    merged["timestamp"] = pd.to_datetime(merged["start_ms"], unit="ms")
+    for metric in metrics:
+        merged[f"{metric}_mean"] = merged[f"{metric}_sum"] / merged["count"]
+    return merged[columns]
+
+
+def backfill_sensor_rollups(raw_root, directory, name="sensors", batch_rows=200_000):
+    """Rebuilds the sensor rollups from the whole raw store (e.g. history recorded before rollups existed).
+
+    Run it while no publisher writes `name`: the rings are recreated.
+    """
+    from common.raw_store import RawDataReader
+    writer = RollupWriter(directory, name, SENSOR_METRICS, reset=True)
+    rows = 0
+    for batch in RawDataReader(raw_root).iter_batches(columns=["timestamp"] + list(SENSOR_METRICS), batch_rows=batch_rows):
+        ts_ms = batch["timestamp"].to_numpy(dtype="datetime64[ms]").astype(np.int64)
+        writer.add(ts_ms, batch[list(SENSOR_METRICS)].to_numpy(dtype=np.float64))
+        rows += len(batch)
+    writer.flush()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the dashboard's sensor rollups from the raw store.")
+    parser.add_argument("--raw-dir", default="data/raw")
+    parser.add_argument("--rollup-dir", default="data/rollups")
+    args = parser.parse_args()
+    print(f"Rollups: Aggregated {backfill_sensor_rollups(args.raw_dir, args.rollup_dir)} raw rows.")
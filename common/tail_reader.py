@@ -0,0 +1,93 @@
+# common/tail_reader.py
+
+import io
+import os
+import pandas as pd
+
+
+class CsvTailReader:
+    """Keeps the last `window_rows` rows of a growing CSV file in memory.
+
+    Each `refresh()` only reads the bytes appended since the previous call.
+    The file is re-opened from its tail if it is replaced (inode changes) or
+    truncated (size shrinks below the last offset). A trailing line without
+    a newline is left for the next refresh, so half-written rows are never
+    parsed.
+    """
+
+    def __init__(self, path, window_rows, date_columns=("timestamp",)):
+        self.path = path
+        self.window_rows = window_rows
+        self.date_columns = list(date_columns)
+        self._reset()
+
+    def _reset(self):
+        self._file_id = None
+        self._offset = 0
+        self._header = None
+        self._window = None
+        self.bytes_read = 0
+
+    def refresh(self):
+        """Reads newly appended rows and returns the current window as a DataFrame."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._reset()
+            return self._empty()
+
+        file_id = (st.st_dev, st.st_ino)
+        if file_id != self._file_id or st.st_size < self._offset or self._header is None:
+            # First read, rotation or truncation: start over from the tail
+            self._reset()
+            self._file_id = file_id
+            with open(self.path, "rb") as f:
+                self._read_initial_tail(f, st.st_size)
+        elif st.st_size > self._offset:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                self._consume(f.read(st.st_size - self._offset), self._offset)
+        return self._window if self._window is not None else self._empty()
+
+    def _read_initial_tail(self, f, size):
+        header = f.readline()
+        if not header.endswith(b"\n"):
+            return # Header not fully written yet
+        self._header = header
+        header_end = len(header)
+
+        # Read backwards in growing blocks until the window is covered
+        block = max(self.window_rows * 64, 4096)
+        while True:
+            start = max(header_end, size - block)
+            f.seek(start)
+            data = f.read(size - start)
+            if start > header_end:
+                data = data[data.find(b"\n") + 1:] # Drop the partial first line
+                start = size - len(data)
+            if start == header_end or data.count(b"\n") >= self.window_rows:
+                break
+            block *= 2
+        self._offset = start
+        self._consume(data, start)
+
+    def _consume(self, data, start):
+        """Parses complete lines from `data` (which begins at byte `start`)."""
+        end = data.rfind(b"\n") + 1
+        self._offset = start + end
+        self.bytes_read += end
+        if end == 0 or self._header is None:
+            return
+        chunk = pd.read_csv(io.BytesIO(self._header + data[:end]))
+        if chunk.empty:
+            return
+        for col in self.date_columns:
+            if col in chunk.columns:
+                chunk[col] = pd.to_datetime(chunk[col]) # New rows only
+        if self._window is not None:
+            chunk = pd.concat([self._window, chunk], ignore_index=True)
+        self._window = chunk.iloc[-self.window_rows:].reset_index(drop=True)
+
+    def _empty(self):
+        columns = self._header.decode().strip().split(",") if self._header else self.date_columns
+        return pd.DataFrame(columns=columns)
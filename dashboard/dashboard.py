@@ -2,13 +2,30 @@ import streamlit as st
 import pandas as pd
 import json
 import os
-from datetime import datetime
+import sys
+from datetime import datetime, timedelta
 import time
 
+# Make the project root importable when run via `streamlit run dashboard/dashboard.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.state_writer import read_state_socket
+from common.rollups import read_rollups
+from common.tail_reader import CsvTailReader
+
 # --- Configuration ---
-STATE_FILE = "data/state.json"
+STATE_FILE = os.environ.get("EDGE_STATE_FILE", "data/state.json") # Written by the edge service
+STATE_SOCKET = os.environ.get("EDGE_STATE_SOCKET") or None # Served by the edge service when enabled
+RAW_DATA_FORMAT = os.environ.get("RAW_DATA_FORMAT", "parquet") # "parquet" or legacy "csv"
+RAW_STORE_DIR = "data/raw"
 RAW_DATA_FILE = "data/raw.csv"
 NUM_ROWS_TO_DISPLAY = 200 # Number of recent data points to show on the chart
+ROLLUP_DIR = "data/rollups" # Per-minute/hour aggregates kept by the publisher and edge
+HISTORY_VIEWS = { # label -> (rollup resolution, hours shown); None shows the latest raw rows
+    f"Latest {NUM_ROWS_TO_DISPLAY} readings": None,
+    "Last 6 hours (1-minute buckets)": ("1m", 6),
+    "Last 7 days (1-hour buckets)": ("1h", 24 * 7),
+    "Last 90 days (1-hour buckets)": ("1h", 24 * 90),
+}
 
 # --- Page Setup ---
 st.set_page_config(
@@ -20,8 +37,13 @@ st.set_page_config(
 st.title("🤖 Live IoT Edge MLOps Pipeline")
 
 # --- Helper Functions ---
-def load_json_state(file_path):
-    """Safely loads a JSON file."""
+def load_json_state(file_path, socket_path=None):
+    """Safely loads the pipeline state, preferring the edge socket over the JSON file."""
+    if socket_path:
+        try:
+            return read_state_socket(socket_path)
+        except (OSError, json.JSONDecodeError):
+            pass # Edge service not serving yet; fall back to the file
     try:
         with open(file_path, 'r') as f:
             return json.load(f)
@@ -35,25 +57,51 @@ def load_json_state(file_path):
             "last_updated": "Never"
         }
 
-def load_csv_data(file_path, n_rows):
-    """Loads the last N rows of a CSV file."""
-    if not os.path.exists(file_path):
-        return pd.DataFrame(columns=["timestamp", "voc_ppb"]) # Return empty df if no file
+csv_tail = CsvTailReader(RAW_DATA_FILE, NUM_ROWS_TO_DISPLAY)
+
+def load_csv_data(tail_reader):
+    """Returns the last N rows of the CSV, reading only bytes appended since the last refresh."""
+    try:
+        df = tail_reader.refresh()
+        if df.empty:
+            return pd.DataFrame(columns=["timestamp", "voc_ppb"]) # Return empty df if no file
+        return df
+    except Exception as e:
+        st.error(f"Error loading data: {e}")
+        return pd.DataFrame(columns=["timestamp", "voc_ppb"])
+
+def load_store_data(store_dir, n_rows):
+    """Loads the last N rows from the Parquet store, touching only the newest segments."""
     try:
-        df = pd.read_csv(file_path)
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        return df.tail(n_rows)
+        from common.raw_store import RawDataReader # pyarrow: loaded after the page shell has rendered
+        return RawDataReader(store_dir).read_last(n_rows, columns=["timestamp", "voc_ppb"])
     except Exception as e:
         st.error(f"Error loading data: {e}")
         return pd.DataFrame(columns=["timestamp", "voc_ppb"])
 
+def load_rollups(prefix, resolution, hours):
+    """Loads pre-aggregated buckets; cost depends on the ring size, not on how much history they cover."""
+    try:
+        return read_rollups(ROLLUP_DIR, prefix, resolution, start=datetime.now() - timedelta(hours=hours))
+    except Exception as e:
+        st.error(f"Error loading {prefix} history: {e}")
+        return pd.DataFrame()
+
 # --- Dashboard Layout ---
+history_view = st.selectbox("Sensor history", list(HISTORY_VIEWS))
 placeholder = st.empty()
 
 # --- Main Loop to Auto-Refresh ---
 while True:
-    state = load_json_state(STATE_FILE)
-    df_raw = load_csv_data(RAW_DATA_FILE, NUM_ROWS_TO_DISPLAY)
+    state = load_json_state(STATE_FILE, STATE_SOCKET)
+    view = HISTORY_VIEWS[history_view]
+    if view is not None:
+        df_sensors = load_rollups("sensors", *view)
+        df_errors = load_rollups("predictions", *view)
+    elif RAW_DATA_FORMAT == "parquet":
+        df_raw = load_store_data(RAW_STORE_DIR, NUM_ROWS_TO_DISPLAY)
+    else:
+        df_raw = load_csv_data(csv_tail)
 
     with placeholder.container():
         st.header("Pipeline Health & Status")
@@ -97,7 +145,18 @@ while True:
         st.markdown("---")
 
         st.header("Live Sensor Data (VOC)")
-        if not df_raw.empty:
+        if view is not None:
+            if not df_sensors.empty:
+                st.line_chart(df_sensors.set_index('timestamp')[['voc_ppb_mean', 'voc_ppb_min', 'voc_ppb_max']])
+            else:
+                st.warning("No sensor history yet. Is the publisher running?")
+            st.header("Prediction Error")
+            if not df_errors.empty:
+                df_errors['rmse'] = df_errors['sq_error_mean'] ** 0.5
+                st.line_chart(df_errors.set_index('timestamp')[['rmse', 'abs_error_mean']].rename(columns={'abs_error_mean': 'mae'}))
+            else:
+                st.info("No predictions recorded in this range.")
+        elif not df_raw.empty:
             st.line_chart(df_raw.rename(columns={'timestamp':'index'}).set_index('index')['voc_ppb'])
         else:
             st.warning("No sensor data found. Is the publisher running?")
@@ -3,23 +3,73 @@ import json
 import time
 import random
 import csv
+import numpy as np
+import pandas as pd
 import os
+import sys
 from datetime import datetime
 
+# Make the project root importable when run as `python devices/publisher.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.partitioning import DEFAULT_PARTITIONS, device_partition, partition_topic
+from common.payload import encode_binary, to_epoch_ms
+from common.raw_store import RawDataReader, RawDataWriter
+from common.rollups import SENSOR_METRICS, RollupWriter
+from devices.simulator import SensorSimulator, encode_readings
+
 # --- Configuration ---
 MQTT_BROKER = "broker"
 MQTT_PORT = 1883
 MQTT_TOPIC = "roomA/sensors"
-DATA_FILE = "data/raw.csv"
+CLIENT_ID = os.environ.get("PUBLISHER_CLIENT_ID", "sensor_publisher") # Must be unique per running publisher
+DEVICE_ID = MQTT_TOPIC.split("/")[0]
+RAW_DATA_FORMAT = os.environ.get("RAW_DATA_FORMAT", "parquet") # "parquet" or legacy "csv"
+RAW_STORE_DIR = "data/raw" # Parquet segments
+DATA_FILE = "data/raw.csv" # Legacy CSV
+ROLLUP_DIR = "data/rollups" # Per-minute/hour aggregates of the recorded readings (dashboard history)
 PUBLISH_INTERVAL_S = 2
+# "single": one device every PUBLISH_INTERVAL_S; "simulate": many virtual devices; "replay": a recorded dataset
+PUBLISHER_MODE = os.environ.get("PUBLISHER_MODE", "single")
+SIM_DEVICES = int(os.environ.get("SIM_DEVICES", 1000))
+SIM_RATE_HZ = float(os.environ.get("SIM_RATE_HZ", 1.0)) # Readings per device per second
+SIM_BATCH_SIZE = int(os.environ.get("SIM_BATCH_SIZE", 50)) # Readings per MQTT message
+SIM_QOS = int(os.environ.get("SIM_QOS", 0))
+SIM_MAX_INFLIGHT = int(os.environ.get("SIM_MAX_INFLIGHT", 1000)) # Unacknowledged QoS>0 messages
+SIM_MAX_QUEUED = int(os.environ.get("SIM_MAX_QUEUED", 100000)) # Queued QoS>0 messages; beyond this publishes are dropped and counted
+SIM_CYCLE_S = float(os.environ.get("SIM_CYCLE_S", 3600))
+SIM_SEED = int(os.environ.get("SIM_SEED", 42)) # Same seed, same readings
+SIM_DRIFT_FRACTION = float(os.environ.get("SIM_DRIFT_FRACTION", 0.0)) # Share of devices that drift
+SIM_DRIFT_KIND = os.environ.get("SIM_DRIFT_KIND", "step") # "step" or "ramp"
+SIM_DRIFT_MAGNITUDE = float(os.environ.get("SIM_DRIFT_MAGNITUDE", 150))
+SIM_DRIFT_AFTER_S = float(os.environ.get("SIM_DRIFT_AFTER_S", 300))
+SIM_RECORD = os.environ.get("SIM_RECORD", "1") == "1" # Also write simulated readings to the raw store
+REPLAY_PATH = os.environ.get("REPLAY_PATH", RAW_STORE_DIR) # Parquet store dir or CSV file
+REPLAY_SPEED = float(os.environ.get("REPLAY_SPEED", 10)) # N x recorded speed; 0 = as fast as possible
+STATS_INTERVAL_S = 5
+SENSOR_PARTITIONS = int(os.environ.get("SENSOR_PARTITIONS", DEFAULT_PARTITIONS)) # '<device>/sensors/pNNN' topics; 0: '<device>/sensors'
+PAYLOAD_FORMAT = os.environ.get("PAYLOAD_FORMAT", "json") # "json" or packed "binary" (common/payload.py)
+
+# --- Raw Data Store Setup ---
+raw_writer = None
+if PUBLISHER_MODE == "simulate" and SIM_RECORD:
+    # Fewer, larger segments at simulator rates
+    raw_writer = RawDataWriter(RAW_STORE_DIR, flush_rows=max(1000, 10 * SIM_DEVICES))
+elif PUBLISHER_MODE != "single":
+    pass # Replayed readings are already recorded
+elif RAW_DATA_FORMAT == "parquet":
+    raw_writer = RawDataWriter(RAW_STORE_DIR)
+else:
+    CSV_HEADER = ["timestamp", "temp_c", "humidity", "voc_ppb"]
+    os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
+    if not os.path.exists(DATA_FILE) or os.path.getsize(DATA_FILE) == 0:
+        with open(DATA_FILE, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADER)
 
-# --- CSV File Setup ---
-CSV_HEADER = ["timestamp", "temp_c", "humidity", "voc_ppb"]
-os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-if not os.path.exists(DATA_FILE) or os.path.getsize(DATA_FILE) == 0:
-    with open(DATA_FILE, 'w', newline='') as f:
-        writer = csv.writer(f)
-        writer.writerow(CSV_HEADER)
+# Kept next to whatever records the readings (replayed ones already have theirs)
+sensor_rollups = None
+if PUBLISHER_MODE == "single" or (PUBLISHER_MODE == "simulate" and SIM_RECORD):
+    sensor_rollups = RollupWriter(ROLLUP_DIR, "sensors", SENSOR_METRICS)
 
 # --- Update to modern MQTT Callback API ---
 def on_connect(client, userdata, flags, reason_code, properties):
@@ -29,8 +79,11 @@ def on_connect(client, userdata, flags, reason_code, properties):
     else:
         print(f"Publisher: Failed to connect, return code {reason_code.rc}\n")
 
-client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id="sensor_publisher")
+client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=CLIENT_ID)
 client.on_connect = on_connect
+if PUBLISHER_MODE != "single":
+    client.max_inflight_messages_set(SIM_MAX_INFLIGHT)
+    client.max_queued_messages_set(SIM_MAX_QUEUED)
 
 # --- Connection retry logic ---
 connected = False
@@ -44,8 +97,35 @@ while not connected:
 
 client.loop_start()
 
-# --- Main Loop ---
-try:
+def sensor_topic(device_id):
+    return partition_topic(device_id, SENSOR_PARTITIONS) if SENSOR_PARTITIONS else f"{device_id}/sensors"
+
+def partition_groups(device_ids):
+    """Index lists of `device_ids` per partition, so no message mixes partitions (one group if unpartitioned)."""
+    if not SENSOR_PARTITIONS:
+        return [list(range(len(device_ids)))]
+    groups = {}
+    for i, device_id in enumerate(device_ids):
+        groups.setdefault(device_partition(device_id, SENSOR_PARTITIONS), []).append(i)
+    return list(groups.values())
+
+def publish_batch(device_ids, payload, stats):
+    """Queues one message on paho's network thread; counts it as dropped if the queue is full."""
+    topic = sensor_topic(device_ids[0]) # Stable per device group, so per-device order is kept
+    result = client.publish(topic, payload, qos=SIM_QOS)
+    if result.rc == mqtt.MQTT_ERR_SUCCESS:
+        stats["messages"] += 1
+        stats["readings"] += len(device_ids)
+    else:
+        stats["dropped"] += len(device_ids)
+
+def report_stats(stats, elapsed, lag_s):
+    print(f"Publisher: {stats['readings'] / elapsed:.0f} readings/s, {stats['messages'] / elapsed:.0f} msgs/s, "
+          f"{stats['dropped']} dropped, {lag_s:.2f}s behind schedule")
+
+def run_single():
+    """The original publisher: one random reading from DEVICE_ID every PUBLISH_INTERVAL_S."""
+    topic = sensor_topic(DEVICE_ID)
     while True:
         timestamp = datetime.now().isoformat()
         temp_c = round(random.uniform(20.0, 25.0), 2)
@@ -54,20 +134,127 @@ try:
 
         payload = {"timestamp": timestamp, "temp_c": temp_c, "humidity": humidity, "voc_ppb": voc_ppb}
         payload_json = json.dumps(payload)
+        if PAYLOAD_FORMAT == "binary":
+            message = encode_binary(to_epoch_ms(timestamp), [DEVICE_ID], [temp_c], [humidity], [voc_ppb], include_ids=False)
+        else:
+            message = payload_json
 
-        result = client.publish(MQTT_TOPIC, payload_json)
+        result = client.publish(topic, message)
         if result[0] == 0:
-            print(f"Published to `{MQTT_TOPIC}`: {payload_json}")
+            print(f"Published to `{topic}`: {payload_json}")
         else:
-            print(f"Failed to send message to topic {MQTT_TOPIC}")
+            print(f"Failed to send message to topic {topic}")
 
-        with open(DATA_FILE, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([timestamp, temp_c, humidity, voc_ppb])
+        if raw_writer is not None:
+            # Buffered; written as a Parquet segment every few seconds
+            raw_writer.append(timestamp, DEVICE_ID, temp_c, humidity, voc_ppb)
+        else:
+            with open(DATA_FILE, 'a', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow([timestamp, temp_c, humidity, voc_ppb])
+        sensor_rollups.add(timestamp, [voc_ppb, temp_c, humidity])
 
         time.sleep(PUBLISH_INTERVAL_S)
 
+def run_simulation():
+    """Publishes SIM_DEVICES virtual devices at SIM_RATE_HZ, generated one vectorized tick at a time."""
+    simulator = SensorSimulator(SIM_DEVICES, cycle_s=SIM_CYCLE_S, seed=SIM_SEED)
+    if SIM_DRIFT_FRACTION > 0:
+        simulator.inject_drift(SIM_DRIFT_FRACTION, SIM_DRIFT_KIND, SIM_DRIFT_MAGNITUDE, SIM_DRIFT_AFTER_S)
+    print(f"Publisher: Simulating {SIM_DEVICES} devices at {SIM_RATE_HZ} Hz, {SIM_BATCH_SIZE} readings/message "
+          f"({PAYLOAD_FORMAT}), QoS {SIM_QOS}")
+
+    groups = [(np.array(idx), [simulator.device_ids[k] for k in idx]) for idx in partition_groups(simulator.device_ids)]
+    interval = 1.0 / SIM_RATE_HZ
+    stats = {"messages": 0, "readings": 0, "dropped": 0}
+    start = time.monotonic()
+    last_report = start
+    tick = 0
+    while True:
+        t_s = tick * interval # Simulated time, so drift and cycles are reproducible
+        timestamp = datetime.now().isoformat()
+        temp_c, humidity, voc_ppb = simulator.step(t_s)
+        for idx, group_ids in groups:
+            for device_ids, payload in encode_readings(timestamp, group_ids, temp_c[idx], humidity[idx], voc_ppb[idx],
+                                                       SIM_BATCH_SIZE, PAYLOAD_FORMAT):
+                publish_batch(device_ids, payload, stats)
+        if raw_writer is not None:
+            raw_writer.append_many(timestamp, simulator.device_ids, temp_c.tolist(), humidity.tolist(), voc_ppb.tolist())
+            sensor_rollups.add(timestamp, np.column_stack([voc_ppb, temp_c, humidity]))
+
+        tick += 1
+        now = time.monotonic()
+        lag_s = now - (start + tick * interval)
+        if now - last_report >= STATS_INTERVAL_S:
+            report_stats(stats, now - start, max(lag_s, 0.0))
+            last_report = now
+        if lag_s < 0:
+            time.sleep(-lag_s)
+
+def load_replay_data(path):
+    if os.path.isdir(path):
+        df = RawDataReader(path).read_all()
+    else:
+        df = pd.read_csv(path, parse_dates=["timestamp"])
+    if "device_id" not in df.columns:
+        df["device_id"] = DEVICE_ID # Legacy single-device CSV
+    return df.dropna(subset=["voc_ppb"]).sort_values("timestamp", kind="stable", ignore_index=True)
+
+def run_replay():
+    """Re-publishes a recorded dataset REPLAY_SPEED times faster than it was recorded."""
+    df = load_replay_data(REPLAY_PATH)
+    if df.empty:
+        print(f"Publisher: Nothing to replay in {REPLAY_PATH}")
+        return
+    print(f"Publisher: Replaying {len(df)} readings from {REPLAY_PATH} at {REPLAY_SPEED}x")
+
+    timestamps = pd.to_datetime(df["timestamp"])
+    offsets_s = (timestamps - timestamps.iloc[0]).dt.total_seconds().to_numpy()
+    due_s = offsets_s / REPLAY_SPEED if REPLAY_SPEED > 0 else np.zeros(len(df))
+    iso = timestamps.dt.strftime("%Y-%m-%dT%H:%M:%S.%f").tolist()
+    device_ids = df["device_id"].astype(str).tolist()
+    temp_c, humidity, voc_ppb = (df[c].to_numpy() for c in ("temp_c", "humidity", "voc_ppb"))
+
+    stats = {"messages": 0, "readings": 0, "dropped": 0}
+    start = time.monotonic()
+    last_report = start
+    i = 0
+    while i < len(df):
+        elapsed = time.monotonic() - start
+        if due_s[i] > elapsed:
+            time.sleep(min(due_s[i] - elapsed, 0.05))
+            continue
+        # Everything that is due goes out now, batched per device
+        end = int(np.searchsorted(due_s, elapsed, side="right"))
+        due = sorted(range(i, end), key=device_ids.__getitem__) # Stable: keeps time order per device
+        for idx in partition_groups([device_ids[k] for k in due]):
+            order = [due[j] for j in idx]
+            batches = encode_readings([iso[k] for k in order], [device_ids[k] for k in order], temp_c[order],
+                                      humidity[order], voc_ppb[order], SIM_BATCH_SIZE, PAYLOAD_FORMAT)
+            for ids, payload in batches:
+                publish_batch(ids, payload, stats)
+        i = end
+        if time.monotonic() - last_report >= STATS_INTERVAL_S:
+            report_stats(stats, time.monotonic() - start, max(elapsed - due_s[i - 1], 0.0))
+            last_report = time.monotonic()
+    report_stats(stats, time.monotonic() - start, 0.0)
+
+# --- Main Loop ---
+try:
+    if PUBLISHER_MODE == "simulate":
+        run_simulation()
+    elif PUBLISHER_MODE == "replay":
+        run_replay()
+    else:
+        run_single()
+
 except KeyboardInterrupt:
     print("Publisher stopped.")
+
+finally:
+    if raw_writer is not None:
+        raw_writer.close()
+    if sensor_rollups is not None:
+        sensor_rollups.flush()
     client.loop_stop()
-    client.disconnect()
\ No newline at end of file
+    client.disconnect()
@@ -0,0 +1,107 @@
+# devices/simulator.py
+
+import json
+import numpy as np
+from common.payload import encode_binary, to_epoch_ms
+
+
+class SensorSimulator:
+    """Generates readings for many virtual devices at once with NumPy.
+
+    Every device follows a periodic cycle (period `cycle_s`, own phase) plus
+    AR(1) noise. Humidity moves against temperature and VOC rises with it, so
+    the channels are correlated like in a real room. `inject_drift` shifts the
+    VOC of a subset of devices from a given time on.
+    """
+
+    def __init__(self, n_devices, cycle_s=3600.0, noise_rho=0.9, seed=None, id_prefix="sim"):
+        rng = np.random.default_rng(seed)
+        self.rng = rng
+        self.n_devices = n_devices
+        self.cycle_s = cycle_s
+        self.noise_rho = noise_rho
+        self.device_ids = [f"{id_prefix}{i:05d}" for i in range(n_devices)]
+
+        self.base_temp = rng.uniform(20.0, 25.0, n_devices)
+        self.base_humidity = rng.uniform(40.0, 60.0, n_devices)
+        self.base_voc = rng.uniform(100.0, 200.0, n_devices)
+        self.phase = rng.uniform(0.0, 2 * np.pi, n_devices)
+        self.noise_scale = np.array([0.3, 1.5, 10.0]) # temp, humidity, voc
+        self._noise = rng.standard_normal((n_devices, 3)) * self.noise_scale
+
+        self.drift_kind = None
+        self.drift_mask = np.zeros(n_devices, dtype=bool)
+        self.drift_start_s = None
+        self.drift_magnitude = 0.0
+
+    def inject_drift(self, fraction=0.1, kind="step", magnitude=150.0, start_s=0.0):
+        """Drifts the VOC of a random `fraction` of devices from `start_s` on.
+
+        `step` adds `magnitude` ppb; `ramp` adds `magnitude` ppb per cycle.
+        """
+        if kind not in ("step", "ramp"):
+            raise ValueError(f"Unknown drift kind {kind!r}")
+        n = max(1, int(round(fraction * self.n_devices))) if fraction > 0 else 0
+        self.drift_mask[:] = False
+        self.drift_mask[self.rng.choice(self.n_devices, n, replace=False)] = True
+        self.drift_kind = kind
+        self.drift_start_s = start_s
+        self.drift_magnitude = magnitude
+
+    def step(self, t_s):
+        """Returns (temp_c, humidity, voc_ppb) arrays for all devices at `t_s` seconds."""
+        rho = self.noise_rho
+        innovation = self.rng.standard_normal((self.n_devices, 3)) * self.noise_scale
+        self._noise = rho * self._noise + np.sqrt(1 - rho ** 2) * innovation
+
+        cycle = np.sin(2 * np.pi * t_s / self.cycle_s + self.phase)
+        temp_offset = 1.5 * cycle + self._noise[:, 0]
+        temp_c = self.base_temp + temp_offset
+        humidity = np.clip(self.base_humidity - 2.0 * temp_offset + self._noise[:, 1], 0.0, 100.0)
+        voc_ppb = self.base_voc + 25.0 * cycle + 12.0 * temp_offset + self._noise[:, 2]
+
+        if self.drift_kind is not None and t_s >= self.drift_start_s:
+            shift = self.drift_magnitude
+            if self.drift_kind == "ramp":
+                shift = self.drift_magnitude * (t_s - self.drift_start_s) / self.cycle_s
+            voc_ppb = voc_ppb + np.where(self.drift_mask, shift, 0.0)
+
+        return temp_c.round(2), humidity.round(2), np.maximum(voc_ppb, 0.0).round(1)
+
+
+def encode_readings(timestamp, device_ids, temp_c, humidity, voc_ppb, batch_size, payload_format="json"):
+    """Packs readings into MQTT messages of up to `batch_size` readings.
+
+    Yields (device_ids, payload). JSON messages with `batch_size` 1 are the
+    classic single-reading dict; larger batches are JSON arrays whose
+    readings name their `device_id`. Binary messages (common/payload.py)
+    carry an id table unless they hold a single reading. `timestamp` is one
+    ISO string for all readings or a sequence with one per reading.
+    """
+    single_ts = isinstance(timestamp, str)
+    if payload_format == "binary":
+        ts_ms = to_epoch_ms(timestamp) if single_ts else np.array([to_epoch_ms(t) for t in timestamp])
+        temp_c, humidity, voc_ppb = (np.asarray(a) for a in (temp_c, humidity, voc_ppb))
+        for start in range(0, len(device_ids), batch_size):
+            end = min(start + batch_size, len(device_ids))
+            yield device_ids[start:end], encode_binary(
+                ts_ms if single_ts else ts_ms[start:end], device_ids[start:end],
+                temp_c[start:end], humidity[start:end], voc_ppb[start:end], include_ids=batch_size > 1,
+            )
+        return
+    if payload_format != "json":
+        raise ValueError(f"Unknown payload format {payload_format!r}")
+
+    temp_c, humidity, voc_ppb = (np.asarray(a).tolist() for a in (temp_c, humidity, voc_ppb))
+    for start in range(0, len(device_ids), batch_size):
+        end = min(start + batch_size, len(device_ids))
+        readings = [
+            {"timestamp": timestamp if single_ts else timestamp[i], "device_id": device_ids[i],
+             "temp_c": temp_c[i], "humidity": humidity[i], "voc_ppb": voc_ppb[i]}
+            for i in range(start, end)
+        ]
+        if batch_size == 1:
+            del readings[0]["device_id"] # Carried by the topic
+            yield device_ids[start:end], json.dumps(readings[0])
+        else:
+            yield device_ids[start:end], json.dumps(readings)
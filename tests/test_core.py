@@ -4,13 +4,14 @@ import sys
 import numpy as np
 import pandas as pd
 from unittest.mock import MagicMock, patch
-from collections import deque
 
 # Add project root to path so we can import app/ and cloud/
 sys.path.append(os.getcwd())
 
 # Import specific functions to test
 from app.edge_infer import calculate_rolling_rmse, on_message, PREDICTION_BUFFER_SIZE, N_LAGS
+from app.error_stats import RollingErrorStats
+from app.device_state import DeviceStateStore
 from cloud.train import create_lag_features
 
 # --- TEST 1: Logic Verification (RMSE Calculation) ---
@@ -19,11 +20,11 @@ def test_calculate_rolling_rmse_logic():
     Verifies that the Root Mean Square Error math is correct.
     """
     # We patch the global buffer inside edge_infer to control the test data
-    with patch("app.edge_infer.prediction_buffer", deque(maxlen=PREDICTION_BUFFER_SIZE)) as mock_buffer:
+    with patch("app.edge_infer.prediction_buffer", RollingErrorStats(PREDICTION_BUFFER_SIZE)) as mock_buffer:
         
         # Case 1: Perfect predictions (10 vs 10, 20 vs 20). RMSE should be 0.
-        mock_buffer.append((10, 10))
-        mock_buffer.append((20, 20))
+        mock_buffer.update(10, 10)
+        mock_buffer.update(20, 20)
         rmse = calculate_rolling_rmse()
         assert rmse == 0.0
 
@@ -32,8 +33,8 @@ def test_calculate_rolling_rmse_logic():
         # Actual=10, Pred=6  (Diff=4, Sq=16)
         # Mean Sq = 16. Sqrt(16) = 4.
         mock_buffer.clear()
-        mock_buffer.append((10, 14)) 
-        mock_buffer.append((10, 6))
+        mock_buffer.update(10, 14) 
+        mock_buffer.update(10, 6)
         rmse = calculate_rolling_rmse()
         assert rmse == 4.0
 
@@ -86,18 +87,24 @@ def test_drift_trigger_mechanism(mock_save, mock_load, mock_subprocess):
     
     # Patch the globals
     with patch("app.edge_infer.model", mock_model), \
-         patch("app.edge_infer.latest_voc_readings", deque(maxlen=N_LAGS)) as mock_readings, \
-         patch("app.edge_infer.prediction_buffer", deque(maxlen=PREDICTION_BUFFER_SIZE)) as mock_buffer:
+         patch("app.edge_infer.device_store", DeviceStateStore(N_LAGS, PREDICTION_BUFFER_SIZE, max_devices=4)), \
+         patch("app.edge_infer.prediction_buffer", RollingErrorStats(PREDICTION_BUFFER_SIZE)) as mock_buffer:
         
         # 2. Inject Data
-        # We need to send enough messages to fill the "N_LAGS" buffer before it predicts
-        for _ in range(N_LAGS + 1):
+        # We need N_LAGS readings of history before the first prediction,
+        # then 2 predictions for a rolling RMSE
+        for _ in range(N_LAGS + 2):
             # Payload simulates a high actual value vs the predicted 0
             payload = f'{{"voc_ppb": {huge_error_value}, "temp_c": 20, "humidity": 50, "timestamp": "2025-01-01"}}'
             mock_msg.payload.decode.return_value = payload
+            mock_msg.topic = "roomA/sensors"
             
             # Run the actual function
             on_message(mock_client, None, mock_msg)
+
+        # Retraining runs in the background; wait for it before asserting
+        from app.edge_infer import wait_for_retrain
+        wait_for_retrain(timeout=5)
             
         # 3. Assertions
         # Did it call subprocess?
@@ -106,4 +113,1175 @@ def test_drift_trigger_mechanism(mock_save, mock_load, mock_subprocess):
         # Did it try to run the specific training script?
         args, _ = mock_subprocess.call_args
         assert "cloud/train.py" in args[0]
-        print("\nTest passed: Drift detected and retraining triggered!")
\ No newline at end of file
+        print("\nTest passed: Drift detected and retraining triggered!")
+
+# --- TEST 4: Micro-batched Inference ---
+def test_micro_batcher_flushes_in_order():
+    """
+    Rows are predicted as one 2-D batch once the size limit is reached (or the
+    deadline passes), and predictions come back in submission order.
+    """
+    from app.batching import MicroBatcher
+
+    batch_shapes = []
+    received = []
+
+    def predict(features):
+        batch_shapes.append(features.shape)
+        return features.sum(axis=1)
+
+    batcher = MicroBatcher(predict, lambda ctx, preds: received.extend(zip(ctx, preds)),
+                           n_features=2, max_batch_size=3, max_latency_ms=0)
+
+    for i in range(4):
+        batcher.submit([i, i], i)
+
+    # First 3 rows flushed as one batch, the 4th is still pending
+    assert batch_shapes == [(3, 2)]
+    assert batcher.pending() == 1
+
+    # A zero latency budget means the pending row is already due
+    batcher.flush_if_due()
+    assert batch_shapes == [(3, 2), (1, 2)]
+    assert received == [(0, 0), (1, 2), (2, 4), (3, 6)]
+
+    stats = batcher.stats()
+    assert stats["rows_predicted"] == 4
+    assert stats["batches_flushed"] == 2
+
+    # Prediction runs outside the submit lock: rows keep queuing while a batch is being predicted
+    import threading
+    predicting, release, received = threading.Event(), threading.Event(), []
+    def slow_predict(features):
+        predicting.set()
+        release.wait(5)
+        return features.sum(axis=1)
+    batcher = MicroBatcher(slow_predict, lambda ctx, preds: received.extend(zip(ctx, preds)),
+                           n_features=2, max_batch_size=2, max_latency_ms=1000)
+    batcher.submit([0, 0], 0)
+    flusher = threading.Thread(target=batcher.submit, args=([1, 1], 1))
+    flusher.start()
+    assert predicting.wait(5)
+    submitted = threading.Thread(target=batcher.submit, args=([2, 2], 2))
+    submitted.start()
+    submitted.join(1)
+    assert not submitted.is_alive() and batcher.pending() == 1
+    release.set()
+    flusher.join(5)
+    batcher.flush()
+    assert received == [(0, 0), (1, 2), (2, 4)]
+
+
+# --- TEST 5: Background Retraining Guard ---
+@patch("app.edge_infer.load_latest_model")
+def test_repeated_drift_does_not_start_duplicate_retrains(mock_load):
+    """
+    While a retrain is running, further drift signals must not spawn another one.
+    """
+    import threading
+    from app.edge_infer import trigger_retrain, wait_for_retrain
+
+    release = threading.Event()
+    with patch("subprocess.run", side_effect=lambda *a, **kw: release.wait(5)) as mock_subprocess:
+        assert trigger_retrain() is True
+        assert trigger_retrain() is False  # Still running
+        release.set()
+        wait_for_retrain(timeout=5)
+
+    assert mock_subprocess.call_count == 1
+    mock_load.assert_called_once()
+
+    # Once finished, a new drift signal may retrain again
+    with patch("subprocess.run"):
+        assert trigger_retrain() is True
+        wait_for_retrain(timeout=5)
+
+
+# --- TEST 6: Streaming Error Statistics ---
+def test_rolling_error_stats_window():
+    """
+    The O(1) running sums must match a direct computation over the window,
+    including after old errors are evicted and the sums are re-summed.
+    """
+    rng = np.random.default_rng(0)
+    actuals = rng.normal(100, 30, size=250)
+    preds = rng.normal(100, 30, size=250)
+
+    stats = RollingErrorStats(window=50, resum_interval=7)
+    for a, p in zip(actuals, preds):
+        stats.update(a, p)
+
+    errors = actuals[-50:] - preds[-50:]
+    assert len(stats) == 50
+    assert stats.rmse() == pytest.approx(np.sqrt(np.mean(errors ** 2)))
+    assert stats.mae() == pytest.approx(np.mean(np.abs(errors)))
+    assert stats.bias() == pytest.approx(np.mean(errors))
+    assert stats.percentile(95) == pytest.approx(np.percentile(np.abs(errors), 95))
+
+    stats.clear()
+    assert len(stats) == 0 and stats.rmse() is None
+
+
+# --- TEST 7: Throttled, Atomic State Publishing ---
+def test_state_writer_coalesces_and_writes_atomically(tmp_path):
+    """
+    Only one write happens per interval, later updates are deferred until flushed,
+    and the file on disk is always complete JSON.
+    """
+    import json
+    from app.state_writer import StateWriter
+
+    state_path = tmp_path / "state.json"
+    writer = StateWriter(str(state_path), interval_s=60)
+    built = []
+
+    def build(i):
+        def _build():
+            built.append(i)
+            return {"seq": i}
+        return _build
+
+    for i in range(100):
+        writer.publish(build(i))
+
+    # First update written immediately; the other 99 coalesced and never built
+    assert writer.writes == 1
+    assert built == [0]
+    assert json.loads(state_path.read_text()) == {"seq": 0}
+
+    writer.flush()
+    assert built == [0, 99]
+    assert json.loads(state_path.read_text()) == {"seq": 99}
+    assert [p.name for p in tmp_path.iterdir()] == ["state.json"]  # No temp files left behind
+
+
+# --- TEST 8: Per-device Lag State ---
+def test_device_store_isolates_devices_and_evicts():
+    """
+    Each device gets its own lag window and error stats, and the store never
+    holds more than max_devices (least recently seen device is evicted).
+    """
+    store = DeviceStateStore(history_length=3, error_window=10, max_devices=2, idle_timeout_s=100)
+
+    # Interleave two devices; a history window is returned once a device has
+    # 3 past readings, and never includes the reading being predicted
+    assert store.push_reading("roomA", 1, now=1) is None
+    assert store.push_reading("roomB", 10, now=2) is None
+    assert store.push_reading("roomA", 2, now=3) is None
+    assert store.push_reading("roomA", 3, now=4) is None
+    assert store.push_reading("roomA", 4, now=5).ravel().tolist() == [1, 2, 3]
+
+    store.record_error("roomA", 10, 14)
+    store.record_error("roomA", 10, 6)
+    assert store.rmse("roomA") == 4.0
+    assert store.rmse("roomB") is None
+
+    # A third device evicts roomB, the least recently seen
+    store.push_reading("roomC", 7, now=6)
+    assert len(store) == 2
+    assert "roomB" not in store and "roomA" in store
+
+    # Idle devices are evicted on the next sweep
+    store.push_reading("roomC", 8, now=200)
+    assert "roomA" not in store
+
+
+# --- TEST 9: Columnar Raw Data Store ---
+def test_raw_store_segments_and_queries(tmp_path):
+    """
+    Rows are buffered into hourly Parquet segments; last-N and time-range reads
+    only return the requested rows, and finished hours are compacted.
+    """
+    from datetime import datetime, timedelta
+    from common.raw_store import RawDataWriter, RawDataReader
+
+    root = str(tmp_path / "raw")
+    writer = RawDataWriter(root, flush_rows=10, flush_interval_s=3600)
+    start = datetime(2025, 1, 1, 10, 0, 0)
+    for i in range(90):
+        # 90 readings one minute apart: spans the 10:00 and 11:00 partitions
+        writer.append(start + timedelta(minutes=i), "roomA", 21.0, 50.0, float(i))
+    writer.close()
+
+    reader = RawDataReader(root)
+    assert reader.row_count() == 90
+    # The 10:00 hour was compacted into one segment when 11:00 started
+    assert sum(1 for _, _, p in reader.segments() if "compact-" in p) == 1
+
+    last = reader.read_last(5)
+    assert last["voc_ppb"].tolist() == [85.0, 86.0, 87.0, 88.0, 89.0]
+    assert last["timestamp"].iloc[-1] == pd.Timestamp(start + timedelta(minutes=89))
+
+    window = reader.read_range(start + timedelta(minutes=58), start + timedelta(minutes=62), columns=["timestamp", "voc_ppb"])
+    assert window["voc_ppb"].tolist() == [58.0, 59.0, 60.0, 61.0]  # Crosses the partition boundary
+    assert list(window.columns) == ["timestamp", "voc_ppb"]
+
+    # A second writer flushes a 10:59 row after the first one compacted 10:00: it must stay visible
+    late = RawDataWriter(root, flush_rows=1000, flush_interval_s=3600)
+    late.append(start + timedelta(minutes=59, seconds=30), "roomB", 21.0, 50.0, -1.0)
+    late.close()
+    assert reader.row_count() == 91
+    assert -1.0 in reader.read_all()["voc_ppb"].tolist()
+    assert sum(1 for _, _, p in reader.segments() if "dt=2025010110" in p) == 1 # Compacted in right away
+    assert len(set(os.path.basename(p) for _, _, p in reader.segments())) == len(reader.segments())
+
+    # Partitions are chosen by name before any segment listing: newest-first for the tail, in range otherwise
+    from common import raw_store
+    with patch("common.raw_store.live_segments", side_effect=raw_store.live_segments) as listed:
+        assert reader.read_last(5)["voc_ppb"].tolist() == [85.0, 86.0, 87.0, 88.0, 89.0]
+        assert [os.path.basename(c.args[0]) for c in listed.call_args_list] == ["dt=2025010111"]
+        listed.reset_mock()
+        assert reader.read_range(start + timedelta(minutes=20), start + timedelta(minutes=22))["voc_ppb"].tolist() == [20.0, 21.0]
+        assert [os.path.basename(c.args[0]) for c in listed.call_args_list] == ["dt=2025010110"]
+        listed.reset_mock()
+        assert [len(b) for b in reader.iter_batches(start=start + timedelta(minutes=85))] == [5]
+        assert [os.path.basename(c.args[0]) for c in listed.call_args_list] == ["dt=2025010111"]
+
+
+# --- TEST 10: Incremental CSV Tail Loading ---
+def test_csv_tail_reader_reads_only_new_bytes(tmp_path):
+    """
+    Refreshes only parse appended bytes, hold back half-written lines, and
+    start over when the file is truncated or replaced.
+    """
+    from common.tail_reader import CsvTailReader
+
+    path = tmp_path / "raw.csv"
+    lines = ["timestamp,voc_ppb\n"] + [f"2025-01-01T00:00:{i:02d},{i}\n" for i in range(50)]
+    path.write_text("".join(lines))
+
+    reader = CsvTailReader(str(path), window_rows=10)
+    df = reader.refresh()
+    assert df["voc_ppb"].tolist() == list(range(40, 50))
+    assert str(df["timestamp"].dtype).startswith("datetime64")
+
+    # Append one full row and one half-written row
+    with open(path, "a") as f:
+        f.write("2025-01-01T00:00:50,50\n2025-01-01T00:00:51,5")
+    before = reader.bytes_read
+    df = reader.refresh()
+    assert df["voc_ppb"].tolist()[-1] == 50
+    assert reader.bytes_read - before == len("2025-01-01T00:00:50,50\n")
+
+    with open(path, "a") as f:
+        f.write("1\n")
+    assert reader.refresh()["voc_ppb"].tolist()[-1] == 51
+
+    # Truncation: the window is rebuilt from the new contents
+    path.write_text("timestamp,voc_ppb\n2025-01-02T00:00:00,7\n")
+    assert reader.refresh()["voc_ppb"].tolist() == [7]
+
+    # Rotation: a new file replaces the old one
+    rotated = tmp_path / "raw.csv.new"
+    rotated.write_text("timestamp,voc_ppb\n2025-01-03T00:00:00,8\n2025-01-03T00:00:01,9\n")
+    os.replace(rotated, path)
+    assert reader.refresh()["voc_ppb"].tolist() == [8, 9]
+
+
+# --- TEST 11: Shared Feature Builder ---
+def test_edge_and_training_features_match():
+    """
+    The feature row the edge builds from a device's history must equal the
+    training row for the same reading, including multi-column and rolling features.
+    """
+    from common.features import FeatureSpec, build_training_matrix, build_feature_row
+
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame({
+        "temp_c": rng.uniform(20, 25, 40),
+        "humidity": rng.uniform(40, 60, 40),
+        "voc_ppb": rng.integers(50, 300, 40).astype(float),
+    })
+    spec = FeatureSpec("voc_ppb", ("temp_c", "humidity", "voc_ppb"), n_lags=3, rolling_windows=(4, 8))
+    X, y = build_training_matrix(df, spec)
+
+    assert X.shape == (40 - spec.history_length, spec.n_features)
+    assert len(spec.feature_names()) == spec.n_features
+
+    # Replay the readings through the edge device store
+    store = DeviceStateStore(spec.history_length, 10, max_devices=1, n_channels=3)
+    edge_rows = []
+    for values in df[list(spec.feature_cols)].to_numpy():
+        history = store.push_reading("roomA", values, now=0)
+        if history is not None:
+            edge_rows.append(build_feature_row(history, spec))
+
+    np.testing.assert_allclose(np.array(edge_rows), X)
+    np.testing.assert_array_equal(y, df["voc_ppb"].to_numpy()[spec.history_length:])
+
+    # Single-column lags: lag_1 is the previous reading, and X is a view (no copy)
+    lag_spec = FeatureSpec(n_lags=2)
+    values = np.arange(6, dtype=float)
+    X, y = build_training_matrix({"voc_ppb": values}, lag_spec)
+    assert X.tolist() == [[1, 0], [2, 1], [3, 2], [4, 3]]
+    assert np.shares_memory(X, values)
+
+
+# --- TEST 12: Incremental Training Mode ---
+def test_incremental_training_window_and_schedule():
+    """
+    Incremental runs only train on readings after the watermark (older rows are
+    still used as lags), and fall back to a full retrain when one is due.
+    """
+    from datetime import datetime, timedelta
+    from cloud.train import build_dataset, choose_mode, next_watermark, FEATURE_SPEC, FULL_RETRAIN_EVERY
+
+    start = datetime(2025, 1, 1)
+    df = pd.DataFrame({
+        "timestamp": [start + timedelta(seconds=2 * i) for i in range(30)],
+        "voc_ppb": np.arange(30, dtype=float),
+    })
+    watermark = df["timestamp"][19]
+    X, y = build_dataset(df, FEATURE_SPEC, since=watermark)
+    assert y.tolist() == list(range(20, 30))
+    assert X[0].tolist() == [19, 18, 17, 16, 15]  # Lags reach back before the watermark
+
+    # Several devices: rows come out in time order, so the last 20% is the latest window of every device
+    two = pd.concat([df.assign(device_id="a"), df.assign(device_id="b")], ignore_index=True)
+    X, y, times = build_dataset(two, FEATURE_SPEC, return_times=True)
+    assert (np.diff(times) >= np.timedelta64(0)).all()
+    split_index = int(len(y) * 0.8)
+    assert times[split_index:].min() >= times[:split_index].max()
+    assert sorted(y[split_index:].tolist()) == [25, 25, 26, 26, 27, 27, 28, 28, 29, 29]
+
+    # The next incremental run trains on exactly the rows this one held out, none skipped
+    _, y_next = build_dataset(two, FEATURE_SPEC, since=next_watermark(times, split_index))
+    assert sorted(y_next.tolist()) == sorted(y[split_index:].tolist())
+
+    now = datetime(2025, 1, 1, 1)
+    state = {"watermark": watermark.isoformat(), "last_full_train": now.isoformat(), "incremental_runs": 0}
+    with patch("cloud.train.latest_model_path", return_value="models/m.joblib"):
+        assert choose_mode("auto", state, now=now) == "incremental"
+        assert choose_mode("auto", dict(state, incremental_runs=FULL_RETRAIN_EVERY), now=now) == "full"
+        assert choose_mode("auto", state, now=now + timedelta(days=1)) == "full"
+        assert choose_mode("full", state, now=now) == "full"
+    with patch("cloud.train.latest_model_path", return_value=None):
+        assert choose_mode("incremental", state, now=now) == "full"  # Nothing to warm-start from
+
+
+# --- TEST 13: Compiled Model Artifact ---
+def test_compiled_model_matches_lightgbm(tmp_path):
+    """
+    The NumPy evaluator must reproduce LightGBM's predictions, including rows
+    with missing values, and carry the feature spec for the edge's check.
+    """
+    import lightgbm as lgb
+    from common.compiled_model import CompiledTreeModel, export_compiled_model
+
+    rng = np.random.default_rng(7)
+    X = rng.uniform(50, 300, size=(400, N_LAGS))
+    y = X[:, 0] * 0.6 + rng.normal(0, 5, 400)
+    model = lgb.LGBMRegressor(n_estimators=30, random_state=42, verbose=-1).fit(X, y)
+
+    path = tmp_path / "model.npz"
+    export_compiled_model(model.booster_, str(path), {"n_lags": N_LAGS})
+    compiled = CompiledTreeModel.load(str(path))
+
+    X_test = rng.uniform(50, 300, size=(64, N_LAGS))
+    X_test[0, 0] = np.nan
+    np.testing.assert_allclose(compiled.predict(X_test), model.predict(X_test), rtol=1e-9)
+    assert compiled.feature_spec_ == {"n_lags": N_LAGS}
+
+
+# --- TEST 14: Model Registry ---
+def test_model_registry_retention_and_rollback(tmp_path):
+    """
+    Registering versions moves `current`, keeps only the newest `keep` artifacts,
+    and re-reads the manifest only when it changes on disk.
+    """
+    from common.model_registry import ModelRegistry
+
+    registry = ModelRegistry(str(tmp_path), keep=2)
+    for i in range(3):
+        for ext in (".joblib", ".npz"):
+            (tmp_path / f"m{i}{ext}").write_bytes(b"model %d" % i)
+        registry.register(str(tmp_path / f"m{i}.joblib"), metrics={"rmse": float(i)},
+                          compiled_path=str(tmp_path / f"m{i}.npz"))
+
+    assert [e["version"] for e in registry.entries()] == ["m1", "m2"]
+    assert not (tmp_path / "m0.joblib").exists() and not (tmp_path / "m0.npz").exists()
+    assert registry.current()["path"] == "m2.joblib"
+    assert registry.previous("m2")["version"] == "m1"
+    assert registry.previous("m1") is None
+
+    # A second instance (e.g. the edge) sees the rollback; unchanged manifests come from cache
+    reader = ModelRegistry(str(tmp_path))
+    manifest = reader.read()
+    assert reader.read() is manifest
+    registry.set_current("m1")
+    assert reader.current()["version"] == "m1"
+
+
+# --- TEST 15: Edge Load Benchmark ---
+def test_edge_benchmark_reports_throughput_and_latency(tmp_path):
+    """
+    A short in-process run through the fake broker predicts every reading once
+    a device's lag window is full, and leaves the edge's globals untouched.
+    """
+    import json
+    import app.edge_infer as edge_infer
+    from benchmarks.bench_edge import FakeBroker, run_benchmark
+
+    assert FakeBroker.matches("+/sensors".split("/"), "roomA/sensors")
+    assert not FakeBroker.matches("+/sensors".split("/"), "roomA/status")
+    assert FakeBroker.matches("#".split("/"), "roomA/sensors")
+
+    model_before, generations_before = edge_infer.model, (edge_infer.model_generation, edge_infer.buffer_generation)
+    results = run_benchmark(devices=5, rate=500, duration=0.5, transport="fake", batch_size=8,
+                            work_dir=str(tmp_path))
+    assert results["messages"] > 5 * N_LAGS
+    assert results["predictions"] == results["messages"] - 5 * N_LAGS
+    assert results["latency_ms"]["p50"] <= results["latency_ms"]["p99"]
+    assert results["retrains"] == 0
+    assert json.loads(json.dumps(results)) == results
+    assert edge_infer.model is model_before
+    assert (edge_infer.model_generation, edge_infer.buffer_generation) == generations_before
+
+
+# --- TEST 16: Device Simulator ---
+def test_simulator_is_reproducible_and_batches_reach_the_edge():
+    """
+    Simulated devices are reproducible per seed, drift only where injected,
+    and a batched message updates every device it names.
+    """
+    import json
+    from devices.simulator import SensorSimulator, encode_readings
+
+    a, b = SensorSimulator(200, seed=3), SensorSimulator(200, seed=3)
+    a.inject_drift(0.1, "step", magnitude=500.0, start_s=10.0)
+    b.inject_drift(0.1, "step", magnitude=500.0, start_s=10.0)
+    for t in range(10):
+        readings_a, readings_b = a.step(t), b.step(t)
+    assert all(np.array_equal(x, y) for x, y in zip(readings_a, readings_b))
+    temp, humidity, voc = a.step(10.0)
+    assert (voc[a.drift_mask] > 450).all() and (voc[~a.drift_mask] < 450).all()
+    assert a.drift_mask.sum() == 20
+
+    device_ids = ["d1", "d2", "d3"]
+    messages = list(encode_readings("2025-01-01T00:00:00", device_ids, [21.0] * 3, [50.0] * 3, [100.0, 110.0, 120.0], 2))
+    assert [ids for ids, _ in messages] == [["d1", "d2"], ["d3"]]
+    assert json.loads(messages[0][1])[1] == {"timestamp": "2025-01-01T00:00:00", "device_id": "d2",
+                                             "temp_c": 21.0, "humidity": 50.0, "voc_ppb": 110.0}
+
+    store = DeviceStateStore(N_LAGS, PREDICTION_BUFFER_SIZE, max_devices=8)
+    with patch("app.edge_infer.device_store", store):
+        for ids, payload in messages:
+            msg = MagicMock(topic=f"{ids[0]}/sensors", payload=payload.encode())
+            on_message(None, None, msg)
+    assert all(d in store for d in device_ids)
+
+
+# --- TEST 17: Binary Payload Format ---
+def test_binary_payload_round_trip_and_edge_decoding():
+    """
+    Packed payloads round-trip readings and device ids, reject unknown
+    versions, and feed the edge the same values as the JSON fallback.
+    """
+    from common.payload import decode_binary, encode_binary, is_binary
+
+    payload = encode_binary(1735732800000, ["a", "b", "a"], [21.0, 22.0, 23.0], [50.0, 51.0, 52.0], [100.0, 110.0, 120.5])
+    assert is_binary(payload) and not is_binary(b'{"voc_ppb": 1}')
+    device_ids, records = decode_binary(payload)
+    assert device_ids == ["a", "b"]
+    assert records["device"].tolist() == [0, 1, 0]
+    assert records["voc_ppb"].tolist() == [100.0, 110.0, 120.5]
+    assert (records["timestamp_ms"] == 1735732800000).all()
+    with pytest.raises(ValueError):
+        decode_binary(payload[:2] + b"\x09" + payload[3:])
+
+    # Single-reading messages take the device from the topic
+    single = encode_binary(1735732800000, ["roomA"], [21.0], [50.0], [100.0], include_ids=False)
+    assert decode_binary(single)[0] is None
+
+    store = DeviceStateStore(N_LAGS, PREDICTION_BUFFER_SIZE, max_devices=8)
+    with patch("app.edge_infer.device_store", store):
+        on_message(None, None, MagicMock(topic="gw/sensors", payload=payload))
+        on_message(None, None, MagicMock(topic="roomA/sensors", payload=single))
+    assert store.history_count[store._slots["a"]] == 2
+    assert "b" in store and "roomA" in store and "gw" not in store
+
+
+# --- TEST 18: Metrics Endpoint ---
+def test_metrics_counters_histograms_and_endpoint():
+    """
+    Counters sum across threads without locks, histogram buckets are
+    cumulative, and the edge's registry is served in the Prometheus format.
+    """
+    import threading
+    import urllib.request
+    from app.metrics import MetricsRegistry, start_metrics_server
+    import app.edge_infer as edge_infer
+
+    registry = MetricsRegistry()
+    counter = registry.counter("test_events_total", "Events")
+    histogram = registry.histogram("test_latency_seconds", "Latency", buckets=(0.1, 1.0))
+    threads = [threading.Thread(target=lambda: [counter.inc() for _ in range(1000)]) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert counter.value() == 4000
+    # Exited threads' shards are folded into the total instead of piling up
+    for _ in range(20):
+        t = threading.Thread(target=counter.inc)
+        t.start()
+        t.join()
+    assert counter.value() == 4020 and counter._shards == []
+    for v in (0.05, 0.5, 5.0):
+        histogram.observe(v)
+    text = registry.render()
+    assert 'test_latency_seconds_bucket{le="0.1"} 1.0' in text
+    assert 'test_latency_seconds_bucket{le="1.0"} 2.0' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3.0' in text
+    assert "test_latency_seconds_count 3.0" in text
+
+    received = edge_infer.messages_received.value()
+    errors = edge_infer.decode_errors.value()
+    on_message(None, None, MagicMock(topic="roomA/sensors", payload=b"not json"))
+    assert edge_infer.messages_received.value() == received + 1
+    assert edge_infer.decode_errors.value() == errors + 1
+
+    server = start_metrics_server(edge_infer.metrics, 0, host="127.0.0.1")
+    try:
+        port = server.server_address[1]
+        body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5).read().decode()
+    finally:
+        server.shutdown()
+    assert "# TYPE edge_messages_received_total counter" in body
+    assert "edge_decode_errors_total" in body and "edge_prediction_latency_seconds_bucket" in body
+
+
+# --- TEST 19: Scale-Out Partitioning ---
+def test_partition_assignment_and_membership_rebalance():
+    """
+    Replicas agree on a balanced partition assignment, a new replica only
+    takes over its own share, and membership changes (re)subscribe the
+    shared-subscription topics.
+    """
+    from common.partitioning import assign_partitions, device_partition, partition_topic
+    from app.scale_out import PartitionMembership
+
+    assert device_partition("roomA", 64) == device_partition("roomA", 64)
+    assert partition_topic("roomA", 64).startswith("roomA/sensors/p")
+
+    two = assign_partitions({"edge-a", "edge-b"}, 64)
+    three = assign_partitions({"edge-a", "edge-b", "edge-c"}, 64)
+    assert sorted(two["edge-a"] + two["edge-b"]) == list(range(64))
+    assert all(len(p) >= 10 for p in three.values())
+    # Only partitions taken over by the new replica change hands
+    for member in ("edge-a", "edge-b"):
+        assert set(three[member]) <= set(two[member])
+
+    client = MagicMock()
+    membership = PartitionMembership("edge-a", 8, settle_s=60)
+    membership.attach(client)
+    client.will_set.assert_called_once_with("edge/members/edge-a", b"", qos=1, retain=True)
+    membership.on_connect(client)
+    assert membership.owned == set()  # Nothing claimed before the membership has arrived
+    # Retained presences come first, then the echo of this replica's own announcement
+    membership._on_member_message(client, None, MagicMock(topic="edge/members/edge-b", payload=b"{}"))
+    assert membership.owned == set()
+    announcement = client.publish.call_args[0][1].encode()
+    membership._on_member_message(client, None, MagicMock(topic="edge/members/edge-a", payload=announcement))
+    assert membership.owned == set(assign_partitions({"edge-a", "edge-b"}, 8)["edge-a"])
+    topics = [t for t, _ in client.subscribe.call_args_list[-1][0][0]]
+    assert all(t.startswith("$share/edge-p") for t in topics)
+    client.unsubscribe.assert_not_called()
+    membership._on_member_message(client, None, MagicMock(topic="edge/members/edge-b", payload=b""))
+    assert membership.owned == set(range(8))
+    assert "$share/edge-p000/+/sensors/p000" in [t for t, _ in client.subscribe.call_args_list[-1][0][0]]
+    membership._on_member_message(client, None, MagicMock(topic="edge/members/edge-c", payload=b"{}"))
+    client.unsubscribe.assert_called_once()
+
+    # Without an echo (e.g. a broker that reorders), the settle timer does the first assignment
+    alone = PartitionMembership("edge-z", 4, settle_s=0.05)
+    alone.attach(MagicMock())
+    alone.on_connect(alone._client)
+    alone._settle_timer.join(5)
+    assert alone.owned == set(range(4))
+
+    # A single replica takes both topic forms, so unpartitioned and partitioned publishers both reach it
+    import app.edge_infer as edge_infer
+    single = MagicMock()
+    with patch.object(edge_infer, "membership", None):
+        edge_infer.on_connect(single, None, None, 0, None)
+    assert [t for t, _ in single.subscribe.call_args[0][0]] == ["+/sensors", "+/sensors/+"]
+
+    store = DeviceStateStore(N_LAGS, PREDICTION_BUFFER_SIZE, max_devices=4)
+    with patch("app.edge_infer.device_store", store):
+        on_message(None, None, MagicMock(topic="roomA/sensors/p003", payload=b'{"voc_ppb": 120}'))
+    assert "roomA" in store
+
+
+# --- TEST 20: Ingest Queue Backpressure ---
+def test_ingest_queue_policies_and_crash_replay(tmp_path):
+    """
+    drop_oldest keeps the newest messages, spill overflows to a log without
+    reordering, and a restarted queue replays what a crash left in the log.
+    """
+    import threading
+    import time
+    from app.ingest_queue import IngestQueue
+
+    handled = []
+    queue = IngestQueue(lambda t, p: handled.append(p), maxsize=2, policy="drop_oldest")
+    for i in range(4):
+        queue.put("d/sensors", b"%d" % i)
+    queue.start()
+    queue.stop()
+    assert handled == [b"2", b"3"] and queue.dropped == 2
+
+    # Spill: the handler stalls while a burst arrives
+    handled, release = [], threading.Event()
+    def slow_handler(topic, payload):
+        release.wait(5)
+        handled.append(payload)
+    spill_path = str(tmp_path / "ingest.log")
+    queue = IngestQueue(slow_handler, maxsize=2, policy="spill", spill_path=spill_path)
+    queue.start()
+    for i in range(10):
+        queue.put("d/sensors", b"%d" % i)
+    assert queue.spilled >= 7
+    release.set()
+    deadline = time.monotonic() + 5
+    while len(handled) < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    queue.stop()
+    assert handled == [b"%d" % i for i in range(10)]
+    assert os.path.getsize(spill_path) == 0  # Drained logs are emptied
+
+    # Crash while spilled: a new queue replays the log, ignoring a torn last record
+    crashed = IngestQueue(lambda t, p: None, maxsize=1, policy="spill", spill_path=spill_path)
+    for i in range(4):
+        crashed.put("roomA/sensors", b"%d" % i)
+    with open(spill_path, "ab") as f:
+        f.write(b"\x05\x00\x00")
+    replayed = []
+    restarted = IngestQueue(lambda t, p: replayed.append((t, p)), maxsize=10, policy="spill", spill_path=spill_path)
+    restarted.start()
+    deadline = time.monotonic() + 5
+    while len(replayed) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    restarted.stop()
+    assert replayed == [("roomA/sensors", b"1"), ("roomA/sensors", b"2"), ("roomA/sensors", b"3")]
+
+    # stop() times out while the worker replays: the log stays open until the worker finishes with it
+    handled, gates, in_replay = [], {b"0": threading.Event(), b"2": threading.Event()}, threading.Event()
+    def stuck_handler(topic, payload):
+        if payload == b"2":
+            in_replay.set()
+        if payload in gates:
+            gates[payload].wait(5)
+        handled.append(payload)
+    stopped_path = str(tmp_path / "stopped.log")
+    queue = IngestQueue(stuck_handler, maxsize=1, policy="spill", spill_path=stopped_path)
+    queue.start()
+    for i in range(5):
+        queue.put("d/sensors", b"%d" % i)
+    gates[b"0"].set()
+    assert in_replay.wait(5)
+    with patch("threading.excepthook") as excepthook:
+        queue.stop(timeout=0.1)
+        assert queue._log is not None
+        gates[b"2"].set()
+        queue._worker.join(5)
+    excepthook.assert_not_called()
+    assert not queue._worker.is_alive() and queue._log is None
+    replayed = []
+    restarted = IngestQueue(lambda t, p: replayed.append(p), policy="spill", spill_path=stopped_path)
+    restarted.start()
+    restarted.stop()
+    assert handled + replayed == [b"%d" % i for i in range(5)]
+
+
+# --- TEST 21: Hyperparameter Search ---
+def test_hyperparameter_search_time_series_cv():
+    """
+    Folds never test on readings older than their training rows, the default
+    settings are always tried, trials run in a process pool, and an exhausted
+    budget stops the search.
+    """
+    from datetime import datetime, timedelta
+    from cloud.train import tune_hyperparameters
+    from cloud.tuning import DEFAULT_PARAMS, PARAM_GRID, run_search, sample_configs, time_series_folds
+
+    times = np.array([datetime(2025, 1, 1) + timedelta(seconds=i) for i in range(100)] * 2, dtype="datetime64[ns]")
+    folds = time_series_folds(times, n_folds=3)
+    assert len(folds) == 3
+    for train_idx, test_idx in folds:
+        assert times[train_idx].max() < times[test_idx].min()
+    assert sum(len(t) for _, t in folds) == 100  # Second half of the timeline, each row tested once
+
+    configs = sample_configs(PARAM_GRID, [3, 5], n_trials=6)
+    assert configs[:2] == [{"n_lags": 3, "params": DEFAULT_PARAMS}, {"n_lags": 5, "params": DEFAULT_PARAMS}]
+    assert len({str(c) for c in configs}) == 6
+
+    rng = np.random.default_rng(3)
+    start = datetime(2025, 1, 1)
+    df = pd.concat([pd.DataFrame({
+        "timestamp": [start + timedelta(seconds=2 * i) for i in range(150)],
+        "device_id": device,
+        "voc_ppb": 150 + np.cumsum(rng.normal(0, 2, 150)),
+    }) for device in ("roomA", "roomB")], ignore_index=True)
+    best, trials = tune_hyperparameters(df, lag_candidates=[3, 5], n_trials=4, n_workers=2, budget_s=60)
+    assert [t["trial"] for t in trials] == [0, 1, 2, 3]
+    assert all(t["complete"] and len(t["fold_rmse"]) == 3 for t in trials)
+    assert best["n_lags"] == 5  # Only the edge's lag count is promoted
+    assert best["cv_rmse"] == min(t["cv_rmse"] for t in trials if t["n_lags"] == 5)
+
+    # With a cut, the search never sees the held-out rows after it
+    from cloud.train import build_dataset, FEATURE_SPEC
+    _, _, target_times = build_dataset(df, FEATURE_SPEC, return_times=True)
+    cut = target_times[int(len(target_times) * 0.8)]
+    with patch("cloud.train.run_search", return_value=[]) as search:
+        tune_hyperparameters(df, lag_candidates=[5], n_trials=1, n_workers=1, budget_s=60, before=cut)
+    _, y_searched, _ = search.call_args[0][0][5]
+    assert len(y_searched) == (target_times < cut).sum() < len(target_times)
+
+    assert run_search({}, configs, n_workers=1, budget_s=0) == []
+
+
+# --- TEST 22: Spooled MLflow Logging ---
+def test_spooled_mlflow_runs_upload_after_the_fact(tmp_path, monkeypatch):
+    """
+    A training run is written to the local spool without contacting MLflow;
+    drain() uploads it later (retrying a failure on the same run), links the
+    run id into the model registry and empties the spool.
+    """
+    import time
+    import joblib
+    import lightgbm as lgb
+    import mlflow
+    from cloud import mlflow_spool
+    from cloud.mlflow_spool import SpooledRun, drain, pending_records
+    from common.model_registry import ModelRegistry
+
+    monkeypatch.setenv("MLFLOW_ALLOW_FILE_STORE", "true")
+    spool_dir, model_dir = str(tmp_path / "spool"), str(tmp_path / "models")
+    os.makedirs(spool_dir)
+    rng = np.random.default_rng(0)
+    model = lgb.LGBMRegressor(n_estimators=5, verbose=-1).fit(rng.normal(size=(50, N_LAGS)), rng.normal(size=50))
+    os.makedirs(model_dir)
+    model_path = os.path.join(model_dir, "voc_predictor-v1.joblib")
+    joblib.dump(model, model_path)
+    ModelRegistry(model_dir).register(model_path)
+
+    with SpooledRun(spool_dir, "IoT VOC Prediction") as run:
+        run.log_params({"n_lags": N_LAGS, "train_mode": "full"})
+        for step in range(3):
+            run.log_metric("cv_rmse", 1.0 + step, step=step)
+        run.log_metric("rmse", 0.5)
+        run.log_dict({"trials": []}, "tuning/trials.json")
+        run.log_model(model_path, "model", registered_model_name="voc_predictor")
+        run.link_registry(model_dir, "voc_predictor-v1")
+    assert [os.path.basename(p) for p in pending_records(spool_dir)] == [run.record_id]
+
+    tracking_uri = (tmp_path / "mlruns").as_uri()
+    real_upload, calls = mlflow_spool.upload_record, []
+    def flaky_upload(record_dir, client):
+        calls.append(record_dir)
+        if len(calls) == 1:
+            raise ConnectionError("mlflow down")
+        return real_upload(record_dir, client)
+    with patch("cloud.mlflow_spool.upload_record", side_effect=flaky_upload), \
+         patch("mlflow.sklearn.log_model") as log_model:
+        assert drain(spool_dir, tracking_uri, timeout_s=5, retry_s=0.01) == 1
+    log_model.assert_called_once()
+    assert pending_records(spool_dir) == []
+
+    run_id = ModelRegistry(model_dir).get("voc_predictor-v1")["mlflow_run_id"]
+    client = mlflow.tracking.MlflowClient(tracking_uri)
+    uploaded = client.get_run(run_id)
+    assert uploaded.data.params["n_lags"] == str(N_LAGS)
+    assert uploaded.data.metrics["rmse"] == 0.5
+    assert uploaded.data.tags["spool_id"] == run.record_id
+    assert [m.step for m in client.get_metric_history(run_id, "cv_rmse")] == [0, 1, 2]
+    assert uploaded.info.status == "FINISHED"
+
+    # An outage uses up no attempts; only refusals do, and a set-aside record is retried later
+    from mlflow.exceptions import MlflowException, RestException
+    from cloud.mlflow_spool import MAX_ATTEMPTS, FAILED_RETENTION_S, FAILED_RETRY_S, failed_records, _retry_failed
+    with SpooledRun(spool_dir, "IoT VOC Prediction") as run:
+        run.log_metric("rmse", 0.7)
+    for _ in range(3 * MAX_ATTEMPTS):
+        mlflow_spool._record_failure(pending_records(spool_dir)[0], MlflowException("API request failed: connection refused"))
+    assert len(pending_records(spool_dir)) == 1
+    for _ in range(MAX_ATTEMPTS):
+        mlflow_spool._record_failure(pending_records(spool_dir)[0], RestException({"error_code": "INVALID_PARAMETER_VALUE"}))
+    assert pending_records(spool_dir) == [] and len(failed_records(spool_dir)) == 1
+    assert _retry_failed(spool_dir, client) == 0  # Too soon
+    assert _retry_failed(spool_dir, client, now=time.time() + FAILED_RETRY_S + 1) == 1
+    assert failed_records(spool_dir) == []
+
+    with SpooledRun(spool_dir, "IoT VOC Prediction") as run:
+        run.log_metric("rmse", 0.9)
+    for _ in range(MAX_ATTEMPTS):
+        mlflow_spool._record_failure(pending_records(spool_dir)[0], ValueError("bad record"))
+    assert _retry_failed(spool_dir, client, now=time.time() + FAILED_RETENTION_S + 1) == 0
+    assert os.listdir(spool_dir) == [".lock"]  # Pruned with its artifacts
+
+
+def test_mlflow_spool_stays_under_its_byte_cap(tmp_path, monkeypatch):
+    """
+    During a long outage the spool is trimmed oldest first: the model and
+    artifact copies go before the runs' params and metrics, and whole runs
+    are dropped only when that is not enough.
+    """
+    import json
+    from cloud import mlflow_spool
+    from cloud.mlflow_spool import RECORD_NAME, SpooledRun, pending_records
+
+    spool_dir = str(tmp_path / "spool")
+    model_path = str(tmp_path / "model.joblib")
+    with open(model_path, "wb") as f:
+        f.write(b"\0" * 100_000)
+    def spool_run(rmse):
+        with SpooledRun(spool_dir, "IoT VOC Prediction") as run:
+            run.log_metric("rmse", rmse)
+            run.log_dict({"pad": "x" * 10_000}, "tuning/trials.json")
+            run.log_model(model_path)
+    def load(record_dir):
+        with open(os.path.join(record_dir, RECORD_NAME)) as f:
+            return json.load(f)
+
+    monkeypatch.setattr(mlflow_spool, "MAX_SPOOL_BYTES", 250_000)
+    for rmse in (0.1, 0.2, 0.3):
+        spool_run(rmse)
+    oldest, *newer = [load(r) for r in pending_records(spool_dir)]
+    assert oldest["model"] is None and oldest["tags"]["spool_artifacts_dropped"] == "true"
+    assert oldest["metrics"] and not os.path.exists(os.path.join(pending_records(spool_dir)[0], "artifacts"))
+    assert all(r["model"] is not None for r in newer)
+    assert mlflow_spool._dir_bytes(spool_dir) <= 250_000
+
+    # When compacting everything still is not enough, the oldest runs go entirely
+    assert mlflow_spool._enforce_limit(spool_dir, max_bytes=1_000) > 0
+    assert [load(r)["metrics"][0][1] for r in pending_records(spool_dir)] == [0.3]
+    assert load(pending_records(spool_dir)[0])["model"] is None
+
+
+# --- TEST 23: Out-of-core Training ---
+def test_streaming_features_and_training_match_in_memory(tmp_path):
+    """
+    Chunked feature building must give the same rows as the in-memory path
+    (lags reach across chunk boundaries), and a booster trained from the
+    memory-mapped files must predict like one trained on plain arrays.
+    """
+    from datetime import datetime, timedelta
+    import lightgbm as lgb
+    import cloud.train as train
+    from cloud.out_of_core import build_feature_file, predict_in_chunks, train_booster
+
+    rng = np.random.default_rng(5)
+    start = datetime(2025, 1, 1)
+    rows = [(start + timedelta(seconds=2 * i), device, 150 + rng.normal(0, 10))
+            for i in range(120) for device in ("roomA", "roomB", "roomC") if rng.random() < 0.8]
+    df = pd.DataFrame(rows, columns=["timestamp", "device_id", "voc_ppb"])
+    csv_path = tmp_path / "raw.csv"
+    df.to_csv(csv_path, index=False)
+
+    with patch.object(train, "RAW_DATA_FORMAT", "csv"), patch.object(train, "RAW_DATA_PATH", str(csv_path)), \
+         patch.object(train, "TRAIN_CHUNK_ROWS", 7):
+        X, y, times = build_feature_file(train.iter_raw_chunks(), train.FEATURE_SPEC, str(tmp_path / "cache"))
+    X_ref, y_ref, times_ref = train.build_dataset(pd.read_csv(csv_path), train.FEATURE_SPEC, return_times=True)
+
+    def canonical(X, y, t):
+        table = np.column_stack([np.asarray(t).astype("datetime64[ns]").astype(np.int64), y, X])
+        return table[np.lexsort(table.T[::-1])]
+    assert isinstance(X, np.memmap) and len(y) == len(y_ref)
+    np.testing.assert_array_equal(canonical(X, y, times), canonical(X_ref, y_ref, times_ref))
+
+    params = {"n_estimators": 20, "num_leaves": 7, "min_child_samples": 5}
+    booster = train_booster(X, y, params, n_rows=200, batch_rows=16)
+    reference = lgb.train({"objective": "regression", "seed": 42, "verbose": -1, "num_leaves": 7,
+                           "min_child_samples": 5}, lgb.Dataset(np.asarray(X[:200]), label=np.asarray(y[:200])),
+                          num_boost_round=20)
+    np.testing.assert_allclose(predict_in_chunks(booster, X, 200, chunk_rows=16),
+                               reference.predict(np.asarray(X[200:])), rtol=1e-9)
+
+
+# --- TEST 24: Shadow Evaluation of Retrained Models ---
+def test_shadow_candidate_is_promoted_or_rejected_on_live_traffic(tmp_path):
+    """
+    A retrained model is scored on the same feature rows as the serving one:
+    a better candidate is swapped in with its shadow errors as the warm
+    buffer, a worse one is rejected and the registry points back at the
+    serving version. No retrain starts while a candidate is under evaluation.
+    """
+    import app.edge_infer as edge
+    from app.shadow import ShadowEvaluator
+    from common.model_registry import ModelRegistry
+
+    # Decision rule: early promotion/rejection once min_samples are in, timeout without enough samples rejects
+    rng = np.random.default_rng(0)
+    actuals = 100 + rng.normal(0, 5, 50)
+    better = ShadowEvaluator(None, "b", 100, min_samples=40, max_samples=1000)
+    assert better.observe(actuals[:30], actuals[:30] + 10, actuals[:30] + rng.normal(0, 1, 30)) is None
+    assert better.observe(actuals[30:], actuals[30:] + 10, actuals[30:] + rng.normal(0, 1, 20)) == "promote"
+    worse = ShadowEvaluator(None, "w", 100, min_samples=40, max_samples=1000)
+    assert worse.observe(actuals, actuals + rng.normal(0, 1, 50), actuals - 10) == "reject"
+    slow = ShadowEvaluator(None, "s", 100, min_samples=40, timeout_s=60)
+    assert slow.observe(actuals[:5], actuals[:5], actuals[:5]) is None
+    assert slow.decide(now=slow.started + 61) == "reject"
+
+    def constant_model(value):
+        model = MagicMock()
+        model.predict.side_effect = lambda X: np.full(len(X), value, dtype=np.float64)
+        return model
+    models = {"v1.joblib": constant_model(110.0), "v2.joblib": constant_model(101.0), "v3.joblib": constant_model(130.0)}
+    registry = ModelRegistry(str(tmp_path))
+    for name in models:
+        (tmp_path / name).write_bytes(b"model")
+
+    with patch.object(edge, "model_registry", registry), patch.object(edge, "read_model", side_effect=models.get), \
+         patch.object(edge, "model", models["v1.joblib"]), patch.object(edge, "model_version", "v1.joblib"), \
+         patch.object(edge, "shadow", None), patch.object(edge, "SHADOW_MIN_SAMPLES", 50), \
+         patch.object(edge, "prediction_buffer", RollingErrorStats(PREDICTION_BUFFER_SIZE)), \
+         patch.object(edge, "device_store", DeviceStateStore(N_LAGS, PREDICTION_BUFFER_SIZE)), \
+         patch.object(edge, "model_generation", 0), patch.object(edge, "buffer_generation", 0), \
+         patch.object(edge, "save_state"):
+
+        def serve(n_batches):
+            for _ in range(n_batches):
+                features = np.zeros((10, edge.FEATURE_SPEC.n_features))
+                predictions, shadow_scores = edge.predict_batch(features)
+                edge.handle_predictions([(f"dev{i}", 100.0) for i in range(10)], predictions, shadow_scores)
+
+        # The trainer registers retrained versions as candidates; only a promotion makes them current
+        registry.register(str(tmp_path / "v1.joblib"))
+        registry.register(str(tmp_path / "v2.joblib"), make_current=False)
+        assert edge.load_latest_model()
+        assert edge.shadow.version == "v2.joblib" and edge.model_version == "v1.joblib"
+        assert registry.current()["version"] == "v1"
+        assert not edge.trigger_retrain()
+        serve(5) # Decided at min_samples: the errors differ with no variance
+        assert edge.shadow is None and edge.model_version == "v2.joblib"
+        assert edge.prediction_buffer.rmse() == pytest.approx(1.0) # Errors the candidate made in shadow
+        assert registry.get("v2")["shadow"]["decision"] == "promote"
+        assert registry.current()["version"] == "v2"
+        assert models["v1.joblib"].predict.call_count == models["v2.joblib"].predict.call_count == 5
+
+        registry.register(str(tmp_path / "v3.joblib"), make_current=False)
+        assert edge.load_latest_model()
+        serve(6)
+        assert edge.shadow is None and edge.model_version == "v2.joblib"
+        assert registry.current()["version"] == "v2"
+        assert registry.get("v3")["shadow"]["decision"] == "reject"
+        assert edge.load_latest_model() and edge.shadow is None  # Decided candidates are not evaluated again
+
+    # A restart during a shadow evaluation serves the vetted version and resumes evaluating the candidate
+    (tmp_path / "v4.joblib").write_bytes(b"model")
+    registry.register(str(tmp_path / "v4.joblib"), make_current=False)
+    models["v4.joblib"] = constant_model(100.0)
+    with patch.object(edge, "model_registry", registry), patch.object(edge, "read_model", side_effect=models.get), \
+         patch.object(edge, "model", None), patch.object(edge, "model_version", "N/A"), \
+         patch.object(edge, "shadow", None), patch.object(edge, "SHADOW_MIN_SAMPLES", 50), \
+         patch.object(edge, "model_generation", 0), patch.object(edge, "rollback_watch", None):
+        assert edge.load_latest_model()
+        assert edge.model_version == "v2.joblib" and edge.shadow.version == "v4.joblib"
+
+
+# --- TEST 25: Drift Detectors, Hysteresis and Cooldown ---
+def test_drift_detectors_hysteresis_and_cooldown():
+    """
+    The threshold detector fires once per excursion (re-arming below the
+    clear level), Page-Hinkley and the input CUSUM stay quiet on stationary
+    data and fire after a shift, and the monitor holds alarms during the
+    retrain cooldown.
+    """
+    from app.drift import DriftMonitor, InputShiftDetector, PageHinkleyDetector, ThresholdDetector
+
+    threshold = ThresholdDetector(75.0, clear_ratio=0.8)
+    fired = [threshold.update("roomA", 0, 0, rmse) for rmse in (70, 76, 80, 74, 77, 59, 76)]
+    assert [r is not None for r in fired] == [False, True, False, False, False, False, True]
+
+    rng = np.random.default_rng(1)
+    page_hinkley = PageHinkleyDetector(delta=7.5, threshold=1500, min_samples=100)
+    assert all(page_hinkley.update("d", 100 + e, 100, None) is None for e in rng.normal(0, 20, 20000))
+    shifted = [page_hinkley.update("d", 100 + e, 100, None) for e in rng.normal(150, 20, 100)]
+    assert any(r is not None for r in shifted)
+
+    input_shift = InputShiftDetector(reference_size=200, threshold=50)
+    assert all(input_shift.update("d", v, 0, None) is None for v in rng.normal(150, 10, 5000))
+    assert any(input_shift.update("d", v, 0, None) is not None for v in rng.normal(170, 10, 100))
+
+    monitor = DriftMonitor.from_names(["threshold"], {"threshold": {"threshold": 75.0}}, cooldown_s=60)
+    monitor.update("roomA", 0, 0, 90.0)
+    assert monitor.poll(now=0.0).startswith("threshold: roomA")
+    monitor.acknowledge()
+    monitor.start_cooldown(now=0.0)
+    monitor.reset() # New model: roomA re-armed
+    monitor.update("roomA", 0, 0, 90.0)
+    assert monitor.poll(now=30.0) is None # Held during the cooldown, not dropped
+    assert monitor.poll(now=61.0) is not None
+    assert monitor.stats()["alarms"] == 2
+
+    # Devices the state store evicts (full or idle) leave no disarmed entry behind
+    from app.device_state import DeviceStateStore
+    store = DeviceStateStore(history_length=3, error_window=4, max_devices=2, idle_timeout_s=10.0,
+                             on_evict=monitor.forget)
+    store.push_reading("roomA", [1.0], now=0.0)
+    store.push_reading("roomB", [1.0], now=1.0)
+    monitor.update("roomB", 0, 0, 90.0)
+    assert monitor.detectors[0]._disarmed == {"roomA", "roomB"}
+    store.push_reading("roomC", [1.0], now=2.0) # Full: roomA, the least recently seen, is evicted
+    assert monitor.detectors[0]._disarmed == {"roomB"}
+    store.evict_idle(now=20.0)
+    assert monitor.detectors[0]._disarmed == set() and len(store) == 0
+
+
+# --- TEST 26: Cold Start ---
+def test_cold_start_waits_for_data_and_imports_stay_light(tmp_path):
+    """
+    Without a model the edge trains in the background as soon as the raw
+    store has enough rows (no fixed sleep), records the startup phases, and
+    importing the trainer for its helpers does not load LightGBM/sklearn.
+    """
+    import subprocess
+    import threading
+    import time
+    from collections import OrderedDict
+    import app.edge_infer as edge
+
+    raw_csv = tmp_path / "raw.csv"
+    raw_csv.write_text("timestamp,voc_ppb\n")
+    trained = threading.Event()
+
+    def fake_load():
+        if not trained.is_set():
+            return False
+        edge.model = MagicMock()
+        return True
+
+    with patch.object(edge, "RAW_DATA_FORMAT", "csv"), patch.object(edge, "RAW_DATA_FILE", str(raw_csv)), \
+         patch.object(edge, "READINESS_POLL_S", 0.01), patch.object(edge, "model", None), \
+         patch.object(edge, "startup_phases", OrderedDict()), patch.object(edge, "load_latest_model", fake_load), \
+         patch("subprocess.run", side_effect=lambda *a, **kw: trained.set()) as mock_run:
+        edge.record_startup_phase("imports")
+        edge.start_initial_training()
+        assert not edge.trigger_retrain() # The initial training holds the retrain guard
+        time.sleep(0.1)
+        mock_run.assert_not_called() # Not enough rows yet
+
+        with open(raw_csv, "a") as f:
+            f.writelines(f"2025-01-01T00:00:{i:02d},{100 + i}\n" for i in range(edge.INITIAL_TRAIN_MIN_ROWS))
+        edge.wait_for_retrain(timeout=5)
+        mock_run.assert_called_once()
+        assert edge.model is not None
+        assert list(edge.startup_phases) == ["imports", "first_model"]
+        assert "first_model" in edge.startup_report()
+
+    imported = subprocess.run(
+        [sys.executable, "-c", "import sys, cloud.train; print(sorted({'lightgbm', 'sklearn', 'joblib'} & set(sys.modules)))"],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    assert imported.stdout.strip() == "[]"
+
+
+# --- TEST 27: Downsampled Rollups ---
+def test_rollups_match_resampling_and_stay_bounded(tmp_path):
+    """
+    Incremental rollups give the same per-bucket mean/min/max as resampling
+    the raw readings, merge buckets of several writers, keep a fixed file
+    size as old buckets are overwritten, and are fed by the edge's batches.
+    """
+    import app.edge_infer as edge
+    from common.rollups import PREDICTION_METRICS, RollupWriter, read_rollups
+
+    rng = np.random.default_rng(3)
+    t0 = 1_735_689_600_000 # 2025-01-01
+    ts = np.sort(rng.integers(t0, t0 + 3 * 3600_000, 5000))
+    values = rng.normal(150, 20, (5000, 2))
+    RollupWriter(str(tmp_path), "sensors-a", ("voc_ppb", "temp_c")).add(ts[:3000], values[:3000])
+    second = RollupWriter(str(tmp_path), "sensors-b", ("voc_ppb", "temp_c"))
+    for t, row in zip(ts[3000:], values[3000:]):
+        second.add(int(t), row) # One reading at a time, as the single-device publisher does
+
+    reference = pd.DataFrame(values, columns=["voc_ppb", "temp_c"], index=pd.to_datetime(ts, unit="ms"))
+    for resolution, rule in (("1m", "1min"), ("1h", "1h")):
+        expected = reference.resample(rule).agg(["mean", "min", "max", "count"]).dropna()
+        rollup = read_rollups(str(tmp_path), "sensors", resolution)
+        assert list(rollup["count"]) == list(expected[("voc_ppb", "count")])
+        np.testing.assert_allclose(rollup["voc_ppb_mean"], expected[("voc_ppb", "mean")])
+        np.testing.assert_allclose(rollup["temp_c_min"], expected[("temp_c", "min")])
+        np.testing.assert_allclose(rollup["temp_c_max"], expected[("temp_c", "max")])
+    assert len(read_rollups(str(tmp_path), "sensors", "1h", start=pd.Timestamp(t0 + 3600_000, unit="ms"))) == 2
+
+    # A ring of 3 one-minute buckets: newer minutes replace the oldest, the file never grows
+    ring = RollupWriter(str(tmp_path), "small", ("x",), resolutions=(("1m", 60, 3),))
+    size = os.path.getsize(tmp_path / "small.1m.bin")
+    for minute in range(10):
+        ring.add(t0 + minute * 60_000, [[minute]])
+    ring.add(t0, [[-1.0]]) # Older than the ring retains: ignored
+    assert list(read_rollups(str(tmp_path), "small", "1m")["x_mean"]) == [7.0, 8.0, 9.0]
+    assert os.path.getsize(tmp_path / "small.1m.bin") == size
+
+    with patch.object(edge, "prediction_rollups", RollupWriter(str(tmp_path), "predictions", PREDICTION_METRICS)), \
+         patch.object(edge, "prediction_buffer", RollingErrorStats(PREDICTION_BUFFER_SIZE)), \
+         patch.object(edge, "device_store", DeviceStateStore(N_LAGS, PREDICTION_BUFFER_SIZE)), \
+         patch.object(edge, "save_state"):
+        edge.handle_predictions([("roomA", 100.0), ("roomB", 110.0)], np.array([103.0, 106.0]))
+    errors = read_rollups(str(tmp_path), "predictions", "1m")
+    assert errors["count"].sum() == 2
+    assert errors["abs_error_mean"].iloc[-1] == pytest.approx(3.5)
+    assert errors["sq_error_max"].iloc[-1] == pytest.approx(16.0)
+
+
+# --- TEST 28: Rollback on Regression and Artifact Integrity ---
+def test_regressed_model_is_rolled_back_and_tampered_artifacts_refused(tmp_path):
+    """
+    A model swapped in without shadow evaluation is on probation: once it has
+    filled the prediction buffer, an RMSE clearly above the replaced model's
+    rolls back to that model. Artifacts whose sha256 no longer matches the
+    manifest are never loaded.
+    """
+    import joblib
+    from collections import OrderedDict
+    import app.edge_infer as edge
+    from common.model_registry import ModelRegistry
+
+    def constant_model(value):
+        model = MagicMock()
+        model.predict.side_effect = lambda X: np.full(len(X), value, dtype=np.float64)
+        return model
+    models = {"v1.joblib": constant_model(102.0), "v2.joblib": constant_model(130.0), "v3.joblib": constant_model(102.4)}
+    registry = ModelRegistry(str(tmp_path))
+    for name in models:
+        (tmp_path / name).write_bytes(b"model")
+    registry.register(str(tmp_path / "v1.joblib"))
+
+    with patch.object(edge, "model_registry", registry), patch.object(edge, "read_model", side_effect=models.get), \
+         patch.object(edge, "model", models["v1.joblib"]), patch.object(edge, "model_version", "v1.joblib"), \
+         patch.object(edge, "shadow", None), patch.object(edge, "SHADOW_MIN_SAMPLES", 0), \
+         patch.object(edge, "prediction_buffer", RollingErrorStats(PREDICTION_BUFFER_SIZE)), \
+         patch.object(edge, "device_store", DeviceStateStore(N_LAGS, PREDICTION_BUFFER_SIZE)), \
+         patch.object(edge, "model_generation", 0), patch.object(edge, "buffer_generation", 0), \
+         patch.object(edge, "rollback_watch", None), patch.object(edge, "save_state"):
+
+        def serve(n_batches):
+            for _ in range(n_batches):
+                predictions, shadow_scores = edge.predict_batch(np.zeros((10, edge.FEATURE_SPEC.n_features)))
+                edge.handle_predictions([(f"dev{i}", 100.0) for i in range(10)], predictions, shadow_scores)
+
+        serve(10)
+        rollbacks = edge.rollbacks.value()
+        registry.register(str(tmp_path / "v2.joblib"), make_current=False)
+        assert edge.load_latest_model() and edge.model_version == "v2.joblib"
+        serve(9)
+        assert edge.model_version == "v2.joblib"  # Not judged before the buffer is full
+        serve(1)
+        assert edge.model_version == "v1.joblib" and registry.current()["version"] == "v1"
+        assert edge.rollbacks.value() == rollbacks + 1 and edge.rollback_watch is None
+
+        serve(10)
+        registry.register(str(tmp_path / "v3.joblib"), make_current=False)
+        assert edge.load_latest_model()
+        serve(12)
+        assert edge.model_version == "v3.joblib" and edge.rollback_watch is None  # Within tolerance: kept
+
+    # Integrity: a registered artifact modified after training is refused
+    joblib.dump({"weights": [1, 2, 3]}, tmp_path / "v4.joblib")
+    registry.register(str(tmp_path / "v4.joblib"))
+    with patch.object(edge, "MODEL_DIR", str(tmp_path)), patch.object(edge, "model_registry", registry), \
+         patch.object(edge, "MODEL_FORMAT", "joblib"), patch.object(edge, "model_cache", OrderedDict()):
+        assert edge.read_model("v4.joblib") == {"weights": [1, 2, 3]}
+        joblib.dump({"weights": [6, 6, 6]}, tmp_path / "v4.joblib")
+        edge.model_cache.clear()
+        with pytest.raises(ValueError, match="sha256"):
+            edge.read_model("v4.joblib")